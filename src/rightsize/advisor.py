@@ -0,0 +1,85 @@
+"""Advisor resize recommendations fetched per subscription concurrently and kept as a compact table.
+
+Only the target SKU and last updated time of each recommendation are kept. The table of the last load can
+be stored, so a run reports which recommendations are new, changed, unchanged or withdrawn.
+"""
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from pandas import DataFrame
+import os
+import time
+import pandas as pd
+from .scheduler import retry_throttled
+
+
+# load_resize_recommendations(subscriptions) -> {resource id: recommendation}
+AdvisorLoader = Callable[[Sequence[str]], Dict[str, Any]]
+
+RECOMMENDATION_COLUMNS = ['resource_id', 'target_sku', 'last_updated']
+
+
+def fetch_resize_recommendations(subscriptions: Sequence[str], load: AdvisorLoader, max_concurrency: int = 8, logger=None,
+    sleep: Callable[[float], None] = time.sleep) -> DataFrame:
+    """One row per recommendation with its resource id, target SKU and last updated time, in subscription order."""
+    def fetch(subscription: str) -> DataFrame:
+        recommendations = retry_throttled(lambda: load([subscription]), f'Advisor subscription {subscription}', logger=logger, sleep=sleep)
+        # Keep only the compact columns, so the recommendation objects are released as each subscription completes.
+        return DataFrame([(k, v.extended_properties['targetSku'], getattr(v, 'last_updated', None)) for k, v in recommendations.items()],
+                         columns=RECOMMENDATION_COLUMNS)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        frames = list(pool.map(fetch, subscriptions))
+    if not frames:
+        return DataFrame(columns=RECOMMENDATION_COLUMNS)
+    table = pd.concat(frames, ignore_index=True)
+    table['last_updated'] = pd.to_datetime(table.last_updated, utc=True)
+    return table.drop_duplicates('resource_id', keep='last').reset_index(drop=True)
+
+
+def recommendation_delta(previous: DataFrame, current: DataFrame) -> Dict[str, int]:
+    """Count the recommendations added, changed and unchanged since ``previous``, and those no longer made.
+
+    A recommendation is unchanged when its target SKU and last updated time are.
+    """
+    merged = current.merge(previous, on='resource_id', how='outer', suffixes=('', '_previous'), indicator=True)
+    both = merged[merged._merge == 'both']
+    unchanged = (both.target_sku == both.target_sku_previous) & \
+                ((both.last_updated == both.last_updated_previous) | (both.last_updated.isna() & both.last_updated_previous.isna()))
+    return {
+        'added': int((merged._merge == 'left_only').sum()),
+        'changed': int((~unchanged).sum()),
+        'unchanged': int(unchanged.sum()),
+        'removed': int((merged._merge == 'right_only').sum()),
+    }
+
+
+class RecommendationStore(object):
+    """The recommendations of the last load, as a Parquet file."""
+
+    def __init__(self, root: str):
+        self.path = os.path.join(root, 'advisor_recommendations.parquet')
+
+    def read(self) -> DataFrame:
+        if not os.path.exists(self.path):
+            return DataFrame({'resource_id': pd.Series(dtype=object), 'target_sku': pd.Series(dtype=object),
+                              'last_updated': pd.Series(dtype='datetime64[ns, UTC]')})
+        return pd.read_parquet(self.path)
+
+    def write(self, recommendations: DataFrame) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        recommendations.to_parquet(f'{self.path}.tmp', index=False)
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def load_recommendations(subscriptions: Sequence[str], load: AdvisorLoader, max_concurrency: int = 8, store_dir: Optional[str] = None,
+    logger=None) -> Tuple[Dict[str, str], Optional[Dict[str, int]]]:
+    """The target SKU of each recommendation, and the delta against the stored recommendations when ``store_dir`` is given."""
+    recommendations = fetch_resize_recommendations(subscriptions, load, max_concurrency, logger)
+    delta = None
+    if store_dir:
+        store = RecommendationStore(store_dir)
+        delta = recommendation_delta(store.read(), recommendations)
+        store.write(recommendations)
+        if logger:
+            logger.info(f'Advisor recommendations: {", ".join(f"{v} {k}" for k, v in delta.items())}.')
+    return dict(zip(recommendations.resource_id, recommendations.target_sku)), delta
@@ -0,0 +1,112 @@
+"""Arrow IPC storage of the DataFrames passed between solids.
+
+String columns are dictionary encoded, so an id repeated across rows is stored once per file and decoded
+to one shared Python string. Decoding builds an object array, so string columns are always copied out of
+the file. Files are written uncompressed and read memory-mapped, so numeric columns without missing values
+are used in place rather than copied; those columns are read-only unless the frame is read ``writable``.
+The storage plugin reads writable frames, since solids may modify their inputs in place.
+"""
+from pandas import DataFrame
+from typing import List
+import functools
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+_STRING_COLUMNS = b'rightsize.dictionary_strings'
+_JSON_COLUMNS = b'rightsize.json'
+
+
+def write_frame(frame: DataFrame, path: str) -> None:
+    """Write a frame as an Arrow IPC file, dictionary encoding string columns and JSON encoding other objects."""
+    string_columns: List[str] = []
+    json_columns: List[str] = []
+    encoded = {}
+    for name in frame.columns[[d == object or isinstance(d, pd.StringDtype) for d in frame.dtypes]]:
+        values = frame[name]
+        present = values.dropna()
+        if present.map(type).eq(str).all():
+            string_columns.append(name)
+        else:
+            json_columns.append(name)
+            encoded[name] = [None if v is None else json.dumps(v) for v in values]
+
+    table = pa.Table.from_pandas(frame.assign(**encoded) if encoded else frame)
+    for name in string_columns + json_columns:
+        i = table.schema.get_field_index(name)
+        if pa.types.is_string(table.schema.field(i).type) or pa.types.is_large_string(table.schema.field(i).type):
+            table = table.set_column(i, name, table.column(i).dictionary_encode())
+    metadata = dict(table.schema.metadata or {})
+    metadata[_STRING_COLUMNS] = json.dumps(string_columns).encode()
+    metadata[_JSON_COLUMNS] = json.dumps(json_columns).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    with pa.OSFile(f'{path}.tmp', 'wb') as sink:
+        writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+    os.replace(f'{path}.tmp', path)
+
+
+def read_frame(path: str, writable: bool = False) -> DataFrame:
+    """Memory map a frame written by ``write_frame``.
+
+    The numeric columns used in place are read-only, so writing to them in place raises. With ``writable``
+    they are copied out of the map instead.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    metadata = table.schema.metadata or {}
+    frame = table.to_pandas(split_blocks=True)
+    if writable:
+        # Before decoding, so string columns are copied as their dictionary codes.
+        frame = frame.copy()
+    decoded = {name: _decode_strings(frame[name]) for name in json.loads(metadata.get(_STRING_COLUMNS, b'[]'))}
+    decoded.update({name: [json.loads(v) if isinstance(v, str) else None for v in _decode_strings(frame[name])]
+                    for name in json.loads(metadata.get(_JSON_COLUMNS, b'[]'))})
+    return frame.assign(**decoded) if decoded else frame
+
+
+def _decode_strings(values: pd.Series) -> np.ndarray:
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.to_numpy(dtype=object)
+    codes = values.cat.codes.to_numpy()
+    decoded = np.full(len(codes), None, dtype=object)
+    present = codes >= 0
+    decoded[present] = values.cat.categories.to_numpy(dtype=object)[codes[present]]
+    return decoded
+
+
+@functools.lru_cache(maxsize=None)
+def arrow_frame_storage_plugin():
+    """The storage plugin class, defined on first use so reading and writing frames does not import dagster."""
+    from dagster.core.storage.type_storage import TypeStoragePlugin
+
+    class ArrowFrameStoragePlugin(TypeStoragePlugin):  # pylint: disable=no-init
+        """Stores DataFrame intermediates as memory-mapped Arrow files in filesystem storage."""
+
+        @classmethod
+        def compatible_with_storage_def(cls, system_storage_def):
+            return system_storage_def.name == 'filesystem'
+
+        @classmethod
+        def set_intermediate_object(cls, intermediate_storage, context, dagster_type, step_output_handle, value):
+            path = intermediate_storage.uri_for_paths(['intermediates', step_output_handle.step_key, step_output_handle.output_name])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_frame(value, path)
+            return path
+
+        @classmethod
+        def get_intermediate_object(cls, intermediate_storage, context, dagster_type, step_output_handle):
+            return read_frame(intermediate_storage.uri_for_paths(['intermediates', step_output_handle.step_key, step_output_handle.output_name]),
+                              writable=True)
+
+    return ArrowFrameStoragePlugin
+
+
+def with_arrow_storage(dagster_type):
+    """Store a DataFrame type's intermediates as Arrow files when the pipeline uses filesystem storage."""
+    dagster_type.auto_plugins = list(dagster_type.auto_plugins) + [arrow_frame_storage_plugin()]
+    return dagster_type
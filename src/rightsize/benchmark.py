@@ -0,0 +1,285 @@
+"""Benchmarks for the rightsize pipeline stages on synthetic fleets.
+
+Run from the ``src`` directory with ``python -m rightsize.benchmark``.
+"""
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+from pandas import DataFrame
+import pandas as pd
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from .synthetic import generate_fleet, SyntheticFleet
+from .stubs import StubLogAnalytics, StubResourceGraph, StubAdvisor
+from .queries import AzureMonitorContext, run_query
+from .resource_graph import load_vm_resources, vm_resources_query
+from .advisor import fetch_resize_recommendations
+from .normalization import to_acus, to_used_memory, classify_disk_utilization, _caching_on
+from .engine import RightSizeAnalysis, vm_features, regional_sku_index, validate_recommendations, right_size, right_size_sharded
+from .inventory import write_inventory
+from .sweep import policy_grid, sweep_policies
+from .report import build_report_frame, write_report
+from .profiling import PeakRssSampler
+
+
+# The modules whose import time the cold start benchmark reports when they are loaded.
+HEAVY_MODULES = ('dagster', 'dagster_pandas', 'dagstermill', 'nbformat', 'azmeta', 'matplotlib', 'openpyxl')
+COLD_START_MODULES = ('rightsize.engine', 'rightsize.rightsizedag')
+
+
+class BenchmarkResult(NamedTuple):
+    stage: str
+    rows: int
+    seconds: float
+    peak_rss_mib: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else float('inf')
+
+
+def _rowwise_to_acus(utilization: DataFrame, compute_specs, resources: DataFrame) -> DataFrame:
+    # The row-wise implementation normalize_cpu_utilization used before vectorization, kept as the baseline.
+    resources = resources.set_index('resource_id')
+
+    def to_acus(row):
+        vm_sku = compute_specs.virtual_machine_by_name(resources.loc[row['resource_id']].vm_size)
+        row.update(row['percentile_50th':'max'] / 100 * vm_sku.capabilities.d_total_acus)
+        return row
+
+    return utilization.apply(to_acus, axis=1)
+
+
+def _rowwise_to_used_memory(utilization: DataFrame, compute_specs, resources: DataFrame) -> DataFrame:
+    resources = resources.set_index('resource_id')
+
+    def to_used(row):
+        vm_sku = compute_specs.virtual_machine_by_name(resources.loc[row['resource_id']].vm_size)
+        row.update(vm_sku.capabilities.memory_gb * 1024 + row['percentile_50th':'max'])
+        return row
+
+    return utilization.apply(to_used, axis=1)
+
+
+def _rowwise_classify_disk_utilization(utilization: DataFrame, resources: DataFrame, logger) -> DataFrame:
+    # The per-VM implementation normalize_disk_utilization used before batching, kept as the baseline.
+    resources = resources.set_index('resource_id')
+    utilization = utilization.set_index('resource_id').sort_index()
+    value_columns = utilization.select_dtypes('number').columns.to_list()
+
+    clean_name = lambda name: name.rstrip(':').upper()
+    resource_frames = []
+    for resource_id, data in utilization.groupby('resource_id'):
+        all_names = {clean_name(x) for x in data.instance_name.unique()}
+        storage_profile = resources.loc[resource_id].storage_profile
+        mapping_cache = {x: _rowwise_disk_is_cached(x, storage_profile, all_names) for x in all_names}
+        unmapped = [k for k, v in mapping_cache.items() if v is None]
+        if unmapped:
+            logger.warning(f'Failed to deduce cache config for {",".join(unmapped)} on {resource_id}')
+            for k in unmapped:
+                mapping_cache[k] = True
+        data = data.assign(cached=data.apply(lambda x: mapping_cache[clean_name(x.instance_name)], axis=1))
+        data = data.groupby(['cached', 'counter_name'])[value_columns].sum().reset_index().assign(resource_id=resource_id)
+        resource_frames.append(data)
+
+    return pd.concat(resource_frames, ignore_index=True)
+
+
+def _rowwise_disk_is_cached(name: str, storage_profile: Dict, all_names: Set[str]) -> Optional[bool]:
+    if name == 'D':
+        return True
+
+    if name == 'C':
+        return _caching_on(storage_profile['osDisk']['caching'])
+
+    if len(all_names) == 3 and len(storage_profile['dataDisks']) == 1:
+        return _caching_on(storage_profile['dataDisks'][0]['caching'])
+
+    if 'S' in all_names and 'L' in all_names and name in ('S', 'L'):
+        suffix = 'data' if name == 'S' else 'log'
+        caching = list(x['caching'] for x in storage_profile['dataDisks'] if x['managedDisk']['id'].endswith(suffix))
+        if caching:
+            return _caching_on(caching[0])
+
+    if name == 'T':
+        caching = list(x['caching'] for x in storage_profile['dataDisks'] if x['managedDisk']['id'].endswith('temp'))
+        if caching:
+            return _caching_on(caching[0])
+
+    cache_settings = set(_caching_on(x['caching']) for x in storage_profile['dataDisks'])
+    if len(cache_settings) == 1:
+        return next(iter(cache_settings))
+
+    return None
+
+
+def _rowwise_validate_recommendations(cpu_utilization: DataFrame, mem_utilization: DataFrame, disk_utilization: DataFrame,
+    compute_specs, advisor_recommendations: Dict[str, str], resources: DataFrame) -> Dict[str, RightSizeAnalysis]:
+    # The per-VM implementation advisor_validator used before the feature table, kept as the baseline.
+    cpu_utilization = cpu_utilization.set_index('resource_id')
+    mem_utilization = mem_utilization.set_index('resource_id')
+    disk_utilization = disk_utilization.set_index('resource_id').sort_index()
+    results: Dict[str, RightSizeAnalysis] = {}
+    for resource in resources.itertuples():
+        advisor_sku = advisor_recommendations.get(resource.resource_id)
+        if advisor_sku is None:
+            continue
+        try:
+            cpu = cpu_utilization.loc[resource.resource_id]
+            mem = mem_utilization.loc[resource.resource_id]
+            disk = disk_utilization.loc[[resource.resource_id]].set_index(['cached', 'counter_name'])
+        except KeyError:
+            continue
+        test_sku = compute_specs.virtual_machine_by_name(advisor_sku)
+        c = test_sku.capabilities
+        disk_at = lambda cached, counter_name, percentile_name: disk.at[(cached, counter_name), percentile_name]
+        flex_mem_down = resource.role_code == 'DBS' and \
+            30 * 1024**2 > disk_at(True, 'Disk Bytes/sec', 'percentile_99th') and 800 > disk_at(True, 'Disk Transfers/sec', 'percentile_99th')
+
+        total_mem = c.memory_gb * 1024
+        cpu_fit = c.d_total_acus > cpu.percentile_99th * 0.9 and c.d_total_acus > cpu.percentile_95th
+        if flex_mem_down:
+            mem_fit = total_mem > mem.percentile_99th * 0.75 and total_mem > mem.percentile_95th * 0.8 and total_mem > mem.percentile_80th * 0.8
+        else:
+            mem_fit = total_mem > mem.percentile_99th * 1.05 and total_mem > mem.percentile_80th * 1.10
+        disk_fit = all(
+            c.combined_temp_disk_and_cached_read_bytes_per_second > disk_at(True, 'Disk Bytes/sec', p) * factor and
+            c.combined_temp_disk_and_cached_iops > disk_at(True, 'Disk Transfers/sec', p) * factor and
+            c.uncached_disk_bytes_per_second > disk_at(False, 'Disk Bytes/sec', p) * factor and
+            c.uncached_disk_iops > disk_at(False, 'Disk Transfers/sec', p) * factor
+            for p, factor in (('percentile_99th', 0.9), ('percentile_95th', 1.0)))
+
+        valid = cpu_fit and mem_fit and disk_fit
+        reason = None if valid else f"{'CPU ' if not cpu_fit else ''}{'Memory ' if not mem_fit else ''}{'I/O ' if not disk_fit else ''}fitness."
+        results[resource.resource_id] = RightSizeAnalysis(test_sku.name, valid, reason)
+
+    return results
+
+
+def time_stage(stage: str, rows: int, fn: Callable, *args, **kwargs):
+    with PeakRssSampler() as sampler:
+        start = time.perf_counter()
+        value = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+    return value, BenchmarkResult(stage, rows, seconds, sampler.peak / 1024**2)
+
+
+def benchmark_fleet(fleet: SyntheticFleet, query_latency: float = 0.0, baseline: bool = False, processes: int = 0) -> List[BenchmarkResult]:
+    """Run every stage of the pipeline over a synthetic fleet, feeding each stage the previous stage's output."""
+    logger = logging.getLogger('rightsize.benchmark')
+    resources = fleet.resources
+    vm_count = len(resources)
+    results = []
+    subscriptions = sorted(resources.subscription_id.unique())
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        graph = StubResourceGraph(resources, latency=query_latency)
+        for stage in ('query_vm_resources', 'query_vm_resources (snapshot)'):
+            results.append(time_stage(stage, vm_count, load_vm_resources, subscriptions, vm_resources_query(), graph.query_dataframe,
+                                      snapshot_dir=snapshot_dir, logger=logger)[1])
+    advisor = StubAdvisor(fleet.advisor_recommendations, latency=query_latency)
+    results.append(time_stage('fetch_advisor_recommendations', len(fleet.advisor_recommendations), fetch_resize_recommendations,
+                              subscriptions, advisor.load_resize_recommendations, logger=logger)[1])
+
+    raw: Dict[str, DataFrame] = {}
+    for name, canned in (('cpu', fleet.cpu_utilization), ('mem', fleet.mem_utilization), ('disk', fleet.disk_utilization)):
+        stub = StubLogAnalytics(canned, latency=query_latency)
+        monitor = AzureMonitorContext('P30D', {s: f'workspace-{s[:8]}' for s in resources.subscription_id.unique()}, chunk_executor=stub.execute)
+        raw[name], result = time_stage(f'query_{name}_utilization', vm_count, run_query, None, resources, monitor, logger)
+        results.append(result)
+
+    cpu, result = time_stage('normalize_cpu_utilization', len(raw['cpu']), to_acus, raw['cpu'], fleet.compute_specs, resources)
+    results.append(result)
+    mem, result = time_stage('normalize_mem_utilization', len(raw['mem']), to_used_memory, raw['mem'], fleet.compute_specs, resources)
+    results.append(result)
+    if baseline:
+        results.append(time_stage('normalize_cpu (row-wise)', len(raw['cpu']), _rowwise_to_acus, raw['cpu'], fleet.compute_specs, resources)[1])
+        results.append(time_stage('normalize_mem (row-wise)', len(raw['mem']), _rowwise_to_used_memory, raw['mem'], fleet.compute_specs, resources)[1])
+    disk, result = time_stage('normalize_disk_utilization', len(raw['disk']), classify_disk_utilization, raw['disk'], resources, logger)
+    results.append(result)
+    if baseline:
+        results.append(time_stage('normalize_disk (row-wise)', len(raw['disk']), _rowwise_classify_disk_utilization, raw['disk'], resources, logger)[1])
+
+    features, result = time_stage('build_vm_features', vm_count, vm_features, cpu, mem, disk, resources)
+    results.append(result)
+    index, result = time_stage('build_sku_index', len(fleet.compute_specs.virtual_machine_skus), regional_sku_index, fleet.compute_specs, fleet.price_catalog, resources, logger)
+    results.append(result)
+    advisor_analysis, result = time_stage('advisor_validator', vm_count, validate_recommendations, features, index.default, fleet.advisor_recommendations)
+    results.append(result)
+    if baseline:
+        results.append(time_stage('advisor_validator (row-wise)', vm_count, _rowwise_validate_recommendations,
+                                  cpu, mem, disk, fleet.compute_specs, fleet.advisor_recommendations, resources)[1])
+    analysis, result = time_stage('right_size_engine', vm_count, right_size, features, index, logger)
+    results.append(result)
+    if processes:
+        results.append(time_stage(f'right_size_engine ({processes} proc)', vm_count, right_size_sharded, features, index, logger, processes)[1])
+    policies = policy_grid(cpu_p99=[0.8, 0.9, 1.0], memory_p99=[1.0, 1.05, 1.2], disk_p99=[0.8, 0.9, 1.0])
+    results.append(time_stage(f'policy_sweep ({len(policies)} policies)', vm_count * len(policies), sweep_policies,
+                              features, index, policies, logger, fleet.advisor_recommendations)[1])
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        _, result = time_stage('write_operation_inventory', len(analysis), write_inventory, analysis, resources, fleet.price_catalog,
+                               os.path.join(output_dir, 'operation_inventory'))
+        results.append(result)
+        frame, result = time_stage('build_report_frame', vm_count, build_report_frame, advisor_analysis, analysis, cpu, mem, disk, fleet.compute_specs, resources)
+        results.append(result)
+        _, result = time_stage('write_paginated_report', len(frame), write_report, frame, os.path.join(output_dir, 'report'))
+        results.append(result)
+
+    return results
+
+
+class ColdStart(NamedTuple):
+    module: str
+    seconds: float
+    heavy_modules: List[str]
+
+
+def cold_start(module: str) -> ColdStart:
+    """Import a module in a fresh interpreter and time it, noting which heavy dependencies it loaded."""
+    script = (f'import json, sys, time; start = time.perf_counter(); import {module}; seconds = time.perf_counter() - start; '
+              f'print(json.dumps([seconds, sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)]))')
+    source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', script], cwd=source_dir, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    seconds, heavy_modules = json.loads(output.strip().splitlines()[-1])
+    return ColdStart(module, seconds, heavy_modules)
+
+
+def format_cold_starts(results: Sequence[ColdStart]) -> str:
+    lines = [f'{"import":<32}{"seconds":>12}  heavy modules loaded']
+    lines.extend(f'{r.module:<32}{r.seconds:>12.3f}  {", ".join(r.heavy_modules) or "none"}' for r in results)
+    return '\n'.join(lines)
+
+
+def format_results(results: Sequence[BenchmarkResult]) -> str:
+    lines = [f'{"stage":<32}{"rows":>10}{"seconds":>12}{"rows/sec":>14}{"peak RSS MiB":>14}']
+    lines.extend(f'{r.stage:<32}{r.rows:>10}{r.seconds:>12.3f}{r.rows_per_second:>14,.0f}{r.peak_rss_mib:>14,.1f}' for r in results)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the rightsize pipeline stages on synthetic fleets.')
+    parser.add_argument('--vms', type=int, nargs='+', default=[1_000, 10_000, 100_000], help='Fleet sizes to benchmark.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--regions', nargs='+', default=['eastus2'], help='Regions to spread the fleet over.')
+    parser.add_argument('--query-latency', type=float, default=0.0, help='Seconds of simulated latency per Log Analytics chunk.')
+    parser.add_argument('--baseline', action='store_true', help='Also time the row-wise normalization and validation baselines.')
+    parser.add_argument('--processes', type=int, default=0, help='Also time the right sizing engine sharded over this many processes.')
+    parser.add_argument('--skip-cold-start', action='store_true', help='Do not time importing the engine and the pipeline.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    if not args.skip_cold_start:
+        print('\nCold start')
+        print(format_cold_starts([cold_start(m) for m in COLD_START_MODULES]))
+    for vm_count in args.vms:
+        fleet = generate_fleet(vm_count, seed=args.seed, regions=args.regions)
+        print(f'\n{vm_count:,} VMs')
+        print(format_results(benchmark_fleet(fleet, args.query_latency, args.baseline, args.processes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Solids loading the compute specifications and the price catalog, and their Dagster types.
+
+The catalogs themselves are in ``specifications`` and ``pricing``, which do not import Dagster.
+"""
+from dagster import solid, SolidExecutionContext, Field, String, Int, Bool, PythonObjectDagsterType, make_python_type_usable_as_dagster_type
+from azmeta.access.specifications import AzureComputeSpecifications, load_compute_specifications
+import datetime
+from .specifications import ComputeSpecificationsSnapshot, SpecificationsSnapshotCache
+from .pricing import PriceCatalog, load_catalog
+from .instrumentation import instrumented
+
+
+AzureComputeSpecificationsDagsterType = PythonObjectDagsterType((AzureComputeSpecifications, ComputeSpecificationsSnapshot), name='AzureComputeSpecifications')
+make_python_type_usable_as_dagster_type(AzureComputeSpecifications, AzureComputeSpecificationsDagsterType)
+
+PriceCatalogDagsterType = PythonObjectDagsterType(PriceCatalog)
+make_python_type_usable_as_dagster_type(PriceCatalog, PriceCatalogDagsterType)
+
+
+@solid(required_resource_keys={'profiling'}, config_schema={
+    'subscription': Field(String, is_required=False, description='A subscription label for the snapshot file name. The SKU list is not filtered by it.'),
+    'region': Field(String, is_required=False, description='A region label for the snapshot file name. The SKU list is not filtered by it.'),
+    'snapshot_dir': Field(String, is_required=False, description='Cache the SKU list in this directory.'),
+    'ttl_hours': Field(Int, default_value=168, is_required=False, description='How long a snapshot is used before it is refreshed.'),
+    'background_refresh': Field(Bool, default_value=True, is_required=False, description='Use an expired snapshot while a fresh one is downloaded.'),
+    'offline': Field(Bool, default_value=False, is_required=False, description='Only use the snapshot, never download the SKU list.'),
+})
+@instrumented
+def load_compute_specs(context: SolidExecutionContext) -> AzureComputeSpecifications:
+    config = context.solid_config
+    if 'snapshot_dir' not in config:
+        if config['offline']:
+            raise Exception('Offline compute specifications require a snapshot_dir.')
+        return load_compute_specifications(logger=context.log)
+
+    cache = SpecificationsSnapshotCache(config['snapshot_dir'], config.get('subscription'), config.get('region'))
+    return cache.load(datetime.timedelta(hours=config['ttl_hours']), config['background_refresh'], config['offline'], logger=context.log)
+
+
+@solid(required_resource_keys={'profiling'}, config_schema={
+    'price_sheet': Field(String, default_value='prices202006.eastus2.json', is_required=False, description='The retail price sheet JSON file.'),
+    'cache_dir': Field(String, is_required=False, description='Where to keep the compact catalog. Defaults to the price sheet directory.'),
+    'region': Field(String, default_value='eastus2', is_required=False, description='The region to price VMs without a location in. Every other VM is priced in its own region.'),
+})
+@instrumented
+def load_price_catalog(context: SolidExecutionContext) -> PriceCatalog:
+    config = context.solid_config
+    catalog = load_catalog(config['price_sheet'], config.get('cache_dir'), config['region'])
+    context.log.info(f'Loaded price catalog version {catalog.version}.')
+    return catalog
@@ -0,0 +1,85 @@
+"""Chunk query results persisted as they complete, so a re-executed query only fetches the chunks it is missing.
+
+A checkpoint directory holds the results of one query over one timespan. Each completed chunk is written as
+an Arrow file named by the hash of its resource ids, then a manifest listing those ids marks it complete.
+Checkpoint directories no longer written to are removed by :func:`expire_checkpoints`.
+"""
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+from pandas import DataFrame
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from .arrow_storage import write_frame, read_frame
+
+
+class RestoredChunk(NamedTuple):
+    workspace: str
+    resource_ids: List[str]
+    frame: DataFrame
+
+
+def checkpoint_key(query: str, timespan: str) -> str:
+    return hashlib.sha1(f'{timespan}\n{query}'.encode()).hexdigest()
+
+
+def resource_set_hash(resource_ids: Iterable[str]) -> str:
+    return hashlib.sha1('\n'.join(sorted(resource_ids)).encode()).hexdigest()
+
+
+class ChunkCheckpoint(object):
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def save(self, workspace: str, resource_ids: Sequence[str], frame: DataFrame) -> None:
+        """Persist a chunk's result. Safe to call from worker threads, as every chunk has its own files."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, resource_set_hash(resource_ids))
+        write_frame(frame.reset_index(drop=True), f'{path}.arrow')
+        with open(f'{path}.json.tmp', 'w') as fd:
+            json.dump({'workspace': workspace, 'resources': list(resource_ids)}, fd)
+        os.replace(f'{path}.json.tmp', f'{path}.json')
+
+    def restore(self, resource_ids: Iterable[str]) -> List[RestoredChunk]:
+        """The completed chunks covering only the given resources, each resource covered at most once."""
+        wanted = set(resource_ids)
+        covered = set()
+        chunks = []
+        for manifest_path in sorted(glob.glob(os.path.join(self.directory, '*.json'))):
+            with open(manifest_path) as fd:
+                manifest = json.load(fd)
+            ids = manifest['resources']
+            if not wanted.issuperset(ids) or not covered.isdisjoint(ids):
+                continue
+            covered.update(ids)
+            chunks.append(RestoredChunk(manifest['workspace'], ids, read_frame(f'{manifest_path[:-len(".json")]}.arrow')))
+        return chunks
+
+
+def lookback_age(lookback_duration: str) -> Optional[datetime.timedelta]:
+    """The length of an ISO 8601 duration of days, hours and minutes such as P7D or PT12H, or None for other forms."""
+    match = re.fullmatch(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?)?', lookback_duration)
+    if not match or not any(match.groups()):
+        return None
+    days, hours, minutes = (int(x or 0) for x in match.groups())
+    return datetime.timedelta(days=days, hours=hours, minutes=minutes)
+
+
+def expire_checkpoints(root: str, max_age: datetime.timedelta, now: Optional[float] = None) -> int:
+    """Remove the checkpoint directories under ``root`` not written to for ``max_age``. Returns the number removed."""
+    if not os.path.isdir(root):
+        return 0
+    cutoff = (now if now is not None else time.time()) - max_age.total_seconds()
+    removed = 0
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        modified = max([entry.stat().st_mtime] + [os.path.getmtime(p) for p in glob.glob(os.path.join(entry.path, '*'))])
+        if modified < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
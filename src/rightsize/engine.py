@@ -0,0 +1,371 @@
+"""The right sizing engine as a library, with no orchestration dependencies.
+
+``analyze`` takes utilization as Log Analytics returns it, the compute specifications, the price catalog
+and optionally the Advisor recommendations, and returns the same analyses as the pipeline. The solids in
+``right_size``, ``features`` and ``utilization`` wrap these functions. Importing this module does not
+import Dagster, dagstermill or the reporting libraries, so batch jobs and services start quickly.
+"""
+from typing import NamedTuple, Dict, List, Optional, Callable, Tuple, Iterable, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pandas import DataFrame
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+from .pricing import PriceCatalog, annual_cost
+from .fitness import AXES, DISK_COUNTERS, DEFAULT_POLICY, SkuIndex, RegionalSkuIndex, FitnessSelection, build_requirements, rules_version
+from .sharding import SharedArray, SharedSkuIndex, share, share_sku_index, shard_assignments, shard_bounds
+from .fingerprints import FingerprintStore, RESULT_COLUMNS, salt_fingerprints, utilization_fingerprints, storage_profile_hashes
+from .specifications import specifications_version
+from .normalization import to_acus, to_used_memory, classify_disk_utilization
+from .profiling import SolidProfile
+
+if TYPE_CHECKING:
+    from azmeta.access.specifications import AzureComputeSpecifications, VirtualMachineSku
+
+
+class RightSizeAnalysis(NamedTuple):
+    advisor_sku: str
+    advisor_sku_valid: bool
+    advisor_sku_invalid_reason: Optional[str] = None
+    annual_savings_no_ri: Optional[float] = None
+
+
+class Fitness(NamedTuple):
+    cpu: bool
+    memory: bool
+    disk: bool
+
+
+class EngineResult(NamedTuple):
+    features: DataFrame
+    advisor_analysis: Dict[str, RightSizeAnalysis]
+    local_analysis: Dict[str, RightSizeAnalysis]
+
+
+def analyze(cpu_utilization: DataFrame, mem_utilization: DataFrame, disk_utilization: DataFrame, resources: DataFrame,
+    compute_specs: 'AzureComputeSpecifications', price_catalog: PriceCatalog, advisor_recommendations: Optional[Dict[str, str]] = None,
+    normalized: bool = False, logger=None, max_workers: int = 4, processes: int = 0, shard_by: str = 'hash',
+    fingerprint_store: Optional[str] = None) -> EngineResult:
+    """Right size the resources from their CPU, memory and disk utilization, as queried or already ``normalized``.
+
+    Runs the pipeline's steps from normalization to the analyses. The advisor analysis is empty without
+    recommendations. The options are those of the ``right_size_engine`` solid.
+    """
+    logger = logger or logging.getLogger(__name__)
+    if not normalized:
+        cpu_utilization, mem_utilization, disk_utilization = normalize_utilization(
+            cpu_utilization, mem_utilization, disk_utilization, compute_specs, resources, logger)
+    features = vm_features(cpu_utilization, mem_utilization, disk_utilization, resources)
+    index = regional_sku_index(compute_specs, price_catalog, resources, logger)
+    advisor_analysis, _ = validate_advised(features, index, advisor_recommendations or {}, fingerprint_store)
+    local_analysis, _ = right_size_fleet(features, index, logger, max_workers, processes, shard_by, fingerprint_store)
+    return EngineResult(features, advisor_analysis, local_analysis)
+
+
+def normalize_utilization(cpu_utilization: DataFrame, mem_utilization: DataFrame, disk_utilization: DataFrame,
+    compute_specs: 'AzureComputeSpecifications', resources: DataFrame, logger) -> Tuple[DataFrame, DataFrame, DataFrame]:
+    """Convert queried utilization to ACUs, used MiB and cached and uncached disk totals."""
+    return (to_acus(cpu_utilization, compute_specs, resources),
+            to_used_memory(mem_utilization, compute_specs, resources),
+            classify_disk_utilization(disk_utilization, resources, logger))
+
+
+# The percentiles kept per axis. Memory also keeps the 80th for the memory fitness rules.
+FEATURE_COLUMNS = [f'{axis}_{p}' for axis in AXES for p in ('p95', 'p99')] + ['memory_p80']
+
+
+def vm_features(cpu_utilization: DataFrame, mem_utilization: DataFrame, disk_utilization: DataFrame, resources: DataFrame) -> DataFrame:
+    """One row per resource, in resource order, with the utilization percentiles the fitness rules use.
+
+    ``complete`` is false for VMs without CPU, memory or any disk utilization; their percentiles are NaN
+    and they are not evaluated. A VM without a disk of some caching class puts no load on it, so those
+    percentiles are 0. Percentiles are float32 and ids are categorical. ``fingerprint`` hashes the quantized
+    percentiles with the size, location and storage profile, and changes only when the inputs move noticeably.
+    """
+    index = pd.Index(resources.resource_id)
+    cpu = cpu_utilization.set_index('resource_id').reindex(index)
+    mem = mem_utilization.set_index('resource_id').reindex(index)
+    disk = disk_utilization.set_index(['resource_id', 'cached', 'counter_name'])[['percentile_95th', 'percentile_99th']]
+    disk_present = index.isin(disk.index.get_level_values(0))
+    disk = disk.unstack(['cached', 'counter_name'])
+
+    def disk_percentile(percentile_name: str, cached: bool, counter_name: str) -> np.ndarray:
+        column = (percentile_name, cached, counter_name)
+        if column not in disk.columns:
+            return np.zeros(len(index))
+        return disk[column].reindex(index).fillna(0.0).to_numpy(dtype=float)
+
+    complete = cpu.percentile_99th.notna().to_numpy() & mem.percentile_99th.notna().to_numpy() & disk_present
+    columns = {
+        'cpu_p95': cpu.percentile_95th.to_numpy(dtype=float),
+        'cpu_p99': cpu.percentile_99th.to_numpy(dtype=float),
+        'memory_p95': mem.percentile_95th.to_numpy(dtype=float),
+        'memory_p99': mem.percentile_99th.to_numpy(dtype=float),
+        'memory_p80': mem.percentile_80th.to_numpy(dtype=float),
+    }
+    for axis, (cached, counter_name) in zip(AXES[2:], DISK_COUNTERS):
+        for p, percentile_name in (('p95', 'percentile_95th'), ('p99', 'percentile_99th')):
+            columns[f'{axis}_{p}'] = disk_percentile(percentile_name, cached, counter_name)
+
+    features = DataFrame({
+        'resource_id': pd.Categorical(resources.resource_id),
+        'vm_size': pd.Categorical(resources.vm_size),
+        'location': pd.Categorical(resources.location if 'location' in resources.columns else [None] * len(resources)),
+        'is_database': (resources.role_code == 'DBS').to_numpy(),
+    })
+    for name in FEATURE_COLUMNS:
+        features[name] = np.where(complete, columns[name], np.nan).astype(np.float32)
+    features['low_cached_usage'] = (DEFAULT_POLICY.low_cached_bytes > features.cached_bytes_p99.to_numpy()) & (DEFAULT_POLICY.low_cached_iops > features.cached_iops_p99.to_numpy())
+    features['complete'] = complete
+    if 'disk_caching' in resources.columns:
+        storage_profiles = resources.disk_caching
+    else:
+        storage_profiles = resources.storage_profile if 'storage_profile' in resources.columns else [None] * len(resources)
+    features['fingerprint'] = utilization_fingerprints(features.assign(storage_profile=storage_profile_hashes(storage_profiles)),
+                                                       FEATURE_COLUMNS, ['vm_size', 'location', 'is_database', 'storage_profile'])
+    return features
+
+
+def regional_sku_index(compute_specs: 'AzureComputeSpecifications', price_catalog: PriceCatalog, resources: DataFrame, logger) -> RegionalSkuIndex:
+    """Index the SKUs in the default region and every region the resources are in that the price catalog covers."""
+    locations = resources.location.dropna().unique() if 'location' in resources.columns else []
+    priced_regions = set(price_catalog.regions)
+    regions = {x for x in locations if x}
+    for region in sorted(regions - priced_regions):
+        logger.warning(f'The price catalog has no prices in {region}, VMs there will not be evaluated.')
+    regions = sorted((regions & priced_regions) | {price_catalog.default_region})
+    indexes = {r: sku_index(compute_specs, price_catalog, logger, r) for r in regions}
+    return RegionalSkuIndex(price_catalog.default_region, indexes, price_catalog.version, specifications_version(compute_specs))
+
+
+def sku_index(compute_specs: 'AzureComputeSpecifications', price_catalog: PriceCatalog, logger, region: Optional[str] = None) -> SkuIndex:
+    """Price the SKUs in a region and index the new generation ones available there as resize candidates."""
+    region = region or price_catalog.default_region
+    def price_sku(sku: 'VirtualMachineSku') -> Optional[float]:
+        cost = annual_cost(price_catalog, sku, region)
+        if cost is None:
+            logger.warning(f'Failed to locate price for {sku.name} in {region}')
+        return cost
+
+    skus = ((price_sku(s), s) for s in compute_specs.virtual_machine_skus if s.family.startswith('standardD') or s.family.startswith('standardES') or s.family.startswith('standardMS'))
+    skus_hash = {s[1].name.lower():s for s in skus if s[0] is not None}
+    
+    new_sku_families = {'standardDSv2Family', 'standardDSv3Family', 'standardESv3Family', 'standardMSFamily'}
+    new_skus = (s for s in skus_hash.values() if s[1].family in new_sku_families and not (s[1].capabilities.d_vcpus_available < 4 and s[1].capabilities.vcpus > s[1].capabilities.d_vcpus_available))
+    new_skus_list = sorted(new_skus, key=lambda x:x[0])
+    return SkuIndex(compute_specs.virtual_machine_skus, skus_hash, new_skus_list)
+
+
+def validate_advised(features: DataFrame, sku_index: RegionalSkuIndex, advisor_recommendations: Dict[str, str],
+    fingerprint_store: Optional[str] = None) -> Tuple[Dict[str, RightSizeAnalysis], int]:
+    """Validate the recommendations of the complete VMs, reusing the stored analyses of VMs whose fingerprint is unchanged.
+
+    Returns the analyses and the number reused.
+    """
+    advisor_skus = np.array([advisor_recommendations.get(x) for x in features.resource_id.to_numpy(dtype=object)], dtype=object)
+    mask = features.complete.to_numpy() & (advisor_skus != None)
+    advised = features[mask]
+    keys = salt_fingerprints(advised.fingerprint.to_numpy(), rules_version(), sku_index.specifications_version, advisor_skus[mask])
+    return cached_analysis(fingerprint_store, 'advisor', advised, keys, lambda x: validate_recommendations(x, sku_index.default, advisor_recommendations),
+                           features.resource_id)
+
+
+def validate_recommendations(features: DataFrame, sku_index: SkuIndex, advisor_recommendations: Dict[str, str]) -> Dict[str, RightSizeAnalysis]:
+    """Check each Advisor recommended SKU against the VM's utilization. Only capabilities are used, so any region's index will do."""
+    advisor_skus = np.array([advisor_recommendations.get(x) for x in features.resource_id.to_numpy(dtype=object)], dtype=object)
+    mask = features.complete.to_numpy() & (advisor_skus != None)
+    advised = features[mask]
+    advisor_skus = advisor_skus[mask]
+
+    fit = sku_index.capabilities_of(advisor_skus) > build_requirements(advised)
+    cpu_fit, mem_fit, disk_fit = fit[:, 0], fit[:, 1], fit[:, 2:].all(axis=1)
+
+    results: Dict[str, RightSizeAnalysis] = {}
+    for i, resource_id in enumerate(advised.resource_id):
+        fitness = Fitness(cpu_fit[i], mem_fit[i], disk_fit[i])
+        valid = bool(fitness.cpu and fitness.memory and fitness.disk)
+        reason = None if valid else f"{'CPU ' if not fitness.cpu else ''}{'Memory ' if not fitness.memory else ''}{'I/O ' if not fitness.disk else ''}fitness."
+        results[resource_id] = RightSizeAnalysis(sku_index.sku(advisor_skus[i]).name, valid, reason)
+
+    return results
+
+
+def right_size_fleet(features: DataFrame, sku_index: RegionalSkuIndex, logger, max_workers: int = 4, processes: int = 0,
+    shard_by: str = 'hash', fingerprint_store: Optional[str] = None, profile: Optional[SolidProfile] = None) -> Tuple[Dict[str, RightSizeAnalysis], int]:
+    """Right size the complete VMs in this process or sharded over ``processes`` of them, reusing the stored
+    analyses of VMs whose fingerprint is unchanged. Returns the analyses and the number reused.
+    """
+    evaluated = features[features.complete.to_numpy()]
+    keys = salt_fingerprints(evaluated.fingerprint.to_numpy(), rules_version(), sku_index.price_catalog_version, sku_index.specifications_version)
+    if processes > 0:
+        engine = lambda x: right_size_sharded(x, sku_index, logger, processes, shard_by, profile=profile)
+    else:
+        engine = lambda x: right_size(x, sku_index, logger, max_workers, profile)
+    return cached_analysis(fingerprint_store, 'engine', evaluated, keys, engine, features.resource_id)
+
+
+def right_size(features: DataFrame, sku_index: RegionalSkuIndex, logger, max_workers: int = 4, profile: Optional[SolidProfile] = None) -> Dict[str, RightSizeAnalysis]:
+    """Find the cheapest new generation SKU each VM fits on, priced in the VM's region.
+
+    Regions are evaluated in parallel and the results are returned in feature order. The VMs and SKUs
+    evaluated are counted in ``profile`` when given.
+    """
+    evaluated = features[features.complete.to_numpy()]
+    regions = pd.Series([sku_index.region_of(x) for x in evaluated.location.to_numpy(dtype=object)], index=evaluated.index)
+    partitions = [(sku_index.regions[r], evaluated[regions.to_numpy() == r]) for r in regions.unique() if r in sku_index.regions]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='right-size-region') as executor:
+        partials = list(executor.map(lambda p: right_size_region(p[1], p[0], logger, profile), partitions))
+
+    merged: Dict[str, RightSizeAnalysis] = {}
+    for partial in partials:
+        merged.update(partial)
+    return {x: merged[x] for x in evaluated.resource_id if x in merged}
+
+
+def right_size_region(features: DataFrame, sku_index: SkuIndex, logger, profile: Optional[SolidProfile] = None) -> Dict[str, RightSizeAnalysis]:
+    """Right size VMs against the candidates and prices of a single region."""
+    priced, current_costs, current_memory_gb = current_prices(features, sku_index, logger)
+    evaluated = features[priced]
+    selection = sku_index.select_cheapest_fit(build_requirements(evaluated), current_costs[priced], current_memory_gb[priced])
+    _count_selection(profile, selection)
+    names = [s.name for s in sku_index.candidates.skus]
+    return _analyses(evaluated.resource_id, evaluated.vm_size, selection, names, sku_index.candidates.costs, current_costs[priced])
+
+
+def current_prices(features: DataFrame, sku_index: SkuIndex, logger) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Whether each VM's current size is priced in the region, and its annual cost and memory (NaN if not)."""
+    priced = np.array([vm_size.lower() in sku_index.priced_skus for vm_size in features.vm_size], dtype=bool)
+    for vm_size in features.vm_size[~priced].unique():
+        logger.warning(f'Failed to locate price for current size {vm_size}, VMs of that size will not be evaluated.')
+    current = [sku_index.priced_skus[vm_size.lower()] if p else None for vm_size, p in zip(features.vm_size, priced)]
+    current_costs = np.array([c[0] if c else np.nan for c in current], dtype=float)
+    current_memory_gb = np.array([c[1].capabilities.memory_gb if c else np.nan for c in current], dtype=float)
+    return priced, current_costs, current_memory_gb
+
+
+def _count_selection(profile: Optional[SolidProfile], selection: FitnessSelection) -> None:
+    if profile is not None:
+        profile.add('vms_evaluated', len(selection.index))
+        profile.add('skus_compared', int(selection.comparisons.sum()))
+        profile.add('skus_in_linear_scan', int(selection.index.sum() + len(selection.index)))
+
+
+def _analyses(resource_ids: Iterable[str], vm_sizes: Iterable[str], selection: FitnessSelection, candidate_names: List[str],
+    candidate_costs: np.ndarray, current_costs: np.ndarray) -> Dict[str, RightSizeAnalysis]:
+    results: Dict[str, RightSizeAnalysis] = {}
+    for i, (resource_id, vm_size) in enumerate(zip(resource_ids, vm_sizes)):
+        sku_current_cost = float(current_costs[i])
+        test_sku_name = candidate_names[selection.index[i]]
+        test_cost = float(candidate_costs[selection.index[i]])
+        fitness = Fitness(selection.cpu[i], selection.memory[i], selection.disk[i])
+
+        if vm_size == test_sku_name:
+            analysis = RightSizeAnalysis(test_sku_name, False, "Reduction not possible.")
+        elif test_cost <= sku_current_cost:
+            savings = sku_current_cost - test_cost
+            analysis = RightSizeAnalysis(test_sku_name, True, None, savings)
+        else:
+            reason = f"{'CPU ' if not fitness.cpu else ''}{'Memory ' if not fitness.memory else ''}{'I/O ' if not fitness.disk else ''} suggests increase."
+            analysis = RightSizeAnalysis(vm_size, False, reason) 
+        results[resource_id] = analysis
+
+    return results
+
+
+class _ShardTables(NamedTuple):
+    regions: List[SharedSkuIndex]
+    region_codes: SharedArray
+    requirements: SharedArray
+    current_costs: SharedArray
+    current_memory_gb: SharedArray
+
+
+def right_size_sharded(features: DataFrame, sku_index: RegionalSkuIndex, logger, processes: int, shard_by: str = 'hash',
+    shards_per_process: int = 4, profile: Optional[SolidProfile] = None) -> Dict[str, RightSizeAnalysis]:
+    """Right size like ``right_size``, searching shards of VMs in a pool of processes.
+
+    The SKU tables and the VM requirements are written once to memory-mapped files the workers read, so
+    only the ids and sizes of a shard's VMs are pickled. The result is identical to ``right_size``.
+    """
+    evaluated = features[features.complete.to_numpy()]
+    regions = np.array([sku_index.region_of(x) for x in evaluated.location.to_numpy(dtype=object)], dtype=object)
+    region_names = [r for r in pd.unique(regions) if r in sku_index.regions]
+    region_codes = np.full(len(evaluated), -1, dtype=np.int32)
+    current_costs = np.full(len(evaluated), np.nan)
+    current_memory_gb = np.full(len(evaluated), np.nan)
+    for code, region in enumerate(region_names):
+        rows = np.flatnonzero(regions == region)
+        priced, current_costs[rows], current_memory_gb[rows] = current_prices(evaluated.iloc[rows], sku_index.regions[region], logger)
+        region_codes[rows[priced]] = code
+
+    keep = region_codes >= 0
+    vms = evaluated[keep]
+    shards = max(1, processes * shards_per_process)
+    order, bounds = shard_bounds(shard_assignments(vms.resource_id.to_numpy(dtype=object), shards, shard_by), shards)
+    resource_ids = vms.resource_id.to_numpy(dtype=object)[order]
+    vm_sizes = vms.vm_size.to_numpy(dtype=object)[order]
+
+    with tempfile.TemporaryDirectory(prefix='rightsize-shards-') as directory:
+        tables = _ShardTables(
+            regions=[share_sku_index(directory, f'region-{i}', sku_index.regions[r]) for i, r in enumerate(region_names)],
+            region_codes=share(directory, 'region-codes', region_codes[keep][order]),
+            requirements=share(directory, 'requirements', build_requirements(vms)[order]),
+            current_costs=share(directory, 'current-costs', current_costs[keep][order]),
+            current_memory_gb=share(directory, 'current-memory-gb', current_memory_gb[keep][order]),
+        )
+        with ProcessPoolExecutor(max_workers=max(1, processes)) as pool:
+            futures = [pool.submit(_right_size_shard, tables, start, stop, resource_ids[start:stop], vm_sizes[start:stop]) for start, stop in bounds]
+            partials = [f.result() for f in futures]
+
+    merged: Dict[str, RightSizeAnalysis] = {}
+    for partial, comparisons, linear_scan in partials:
+        merged.update(partial)
+        if profile is not None:
+            profile.add('vms_evaluated', len(partial))
+            profile.add('skus_compared', comparisons)
+            profile.add('skus_in_linear_scan', linear_scan)
+    if profile is not None:
+        profile.add('shards', len(bounds))
+    return {x: merged[x] for x in evaluated.resource_id if x in merged}
+
+
+def _right_size_shard(tables: _ShardTables, start: int, stop: int, resource_ids: np.ndarray, vm_sizes: np.ndarray) -> Tuple[Dict[str, RightSizeAnalysis], int, int]:
+    region_codes = tables.region_codes.open()[start:stop]
+    requirements = tables.requirements.open()[start:stop]
+    current_costs = tables.current_costs.open()[start:stop]
+    current_memory_gb = tables.current_memory_gb.open()[start:stop]
+
+    results: Dict[str, RightSizeAnalysis] = {}
+    comparisons = linear_scan = 0
+    for code in np.unique(region_codes):
+        rows = np.flatnonzero(region_codes == code)
+        region = tables.regions[code]
+        selection = region.select_cheapest_fit(requirements[rows], current_costs[rows], current_memory_gb[rows])
+        comparisons += int(selection.comparisons.sum())
+        linear_scan += int(selection.index.sum() + len(rows))
+        results.update(_analyses(resource_ids[rows], vm_sizes[rows], selection, region.names, region.costs.open(), current_costs[rows]))
+    return results, comparisons, linear_scan
+
+
+def cached_analysis(store_dir: Optional[str], kind: str, features: DataFrame, keys: np.ndarray,
+    analyze: Callable[[DataFrame], Dict[str, RightSizeAnalysis]], fleet: Optional[Iterable[str]] = None) -> Tuple[Dict[str, RightSizeAnalysis], int]:
+    """Reuse the stored analyses of VMs whose key is unchanged, analyze the rest and store their results.
+
+    Returns the analyses in feature order and the number of VMs reused. Without a store every VM is analyzed.
+    Stored analyses of VMs no longer in the ``fleet`` resource ids are removed.
+    """
+    if not store_dir:
+        return analyze(features), 0
+    store = FingerprintStore(store_dir)
+    resource_ids = features.resource_id.to_numpy(dtype=object)
+    hits = store.lookup(kind, resource_ids, keys)
+    missed = ~pd.Index(resource_ids).isin(hits.index)
+    fresh = analyze(features[missed])
+    store.update(kind, resource_ids[missed], keys[missed], DataFrame(list(fresh.values()), index=list(fresh.keys()), columns=RESULT_COLUMNS),
+                 fleet)
+
+    reused = {resource_id: RightSizeAnalysis(sku, bool(valid), reason if isinstance(reason, str) else None, None if pd.isna(savings) else float(savings))
+              for resource_id, sku, valid, reason, savings in hits.itertuples()}
+    results = {x: fresh[x] if x in fresh else reused[x] for x in resource_ids if x in fresh or x in reused}
+    return results, len(reused)
@@ -0,0 +1,43 @@
+from dagster import solid, SolidExecutionContext, InputDefinition, Output
+from dagster_pandas import PandasColumn, create_dagster_pandas_dataframe_type
+from pandas import DataFrame
+from typing import Any, TYPE_CHECKING
+from .resources import ResourcesDataFrame
+from .utilization import UtilizationDataFrame
+from .engine import FEATURE_COLUMNS, vm_features
+from .instrumentation import instrumented
+from .arrow_storage import with_arrow_storage
+
+if TYPE_CHECKING:
+    VmFeaturesDataFrame = Any # DataFrame # Pandas has no type info yet.
+else:
+    VmFeaturesDataFrame = with_arrow_storage(create_dagster_pandas_dataframe_type(
+        name='VmFeaturesDataFrame',
+        columns=[
+            PandasColumn.exists('resource_id'),
+            PandasColumn.exists('vm_size'),
+            PandasColumn.exists('location'),
+            PandasColumn.boolean_column('is_database'),
+            PandasColumn.boolean_column('low_cached_usage'),
+            PandasColumn.boolean_column('complete'),
+        ],
+    ))
+
+
+@solid(required_resource_keys={'profiling'}, input_defs=[
+    InputDefinition('cpu_utilization', UtilizationDataFrame),
+    InputDefinition('mem_utilization', UtilizationDataFrame),
+    InputDefinition('disk_utilization', UtilizationDataFrame),
+    InputDefinition('resources', ResourcesDataFrame),
+])
+@instrumented
+def build_vm_features(context: SolidExecutionContext,
+    cpu_utilization: DataFrame,
+    mem_utilization: DataFrame,
+    disk_utilization: DataFrame,
+    resources: DataFrame) -> VmFeaturesDataFrame:
+    features = vm_features(cpu_utilization, mem_utilization, disk_utilization, resources)
+    incomplete = int((~features.complete).sum())
+    if incomplete:
+        context.log.warning(f'{incomplete} VMs are missing CPU, memory or disk utilization and will not be evaluated.')
+    yield Output(features)
@@ -0,0 +1,92 @@
+"""Per-VM fingerprints of the analysis inputs, and a store of the last analysis of each VM by fingerprint.
+
+Utilization is quantized to relative steps before hashing, so VMs whose percentiles barely move keep
+their fingerprint and their previous analysis is reused.
+"""
+from typing import Any, Dict, Iterable, Optional, Sequence
+from pandas import DataFrame
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_RESOLUTION = 0.02
+RESULT_COLUMNS = ['advisor_sku', 'advisor_sku_valid', 'advisor_sku_invalid_reason', 'annual_savings_no_ri']
+STORE_COLUMNS = ['resource_id', 'fingerprint'] + RESULT_COLUMNS + ['updated']
+
+
+def quantize(values: np.ndarray, resolution: float = DEFAULT_RESOLUTION) -> np.ndarray:
+    """Map values to integer steps of ``resolution`` relative size. Zero, negative and missing values get their own steps."""
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        steps = np.floor(np.log(np.abs(values)) / np.log1p(resolution))
+    steps = np.where(np.isfinite(steps), steps, 0).astype(np.int64) * 4
+    return np.where(np.isnan(values), 1, np.where(values == 0, 2, np.where(values < 0, steps + 3, steps)))
+
+
+def storage_profile_hashes(storage_profiles: Iterable[Any]) -> np.ndarray:
+    serialized = pd.Series([json.dumps(p, sort_keys=True, default=str) for p in storage_profiles], dtype=object)
+    return pd.util.hash_pandas_object(serialized, index=False).to_numpy()
+
+
+def utilization_fingerprints(frame: DataFrame, value_columns: Sequence[str], key_columns: Sequence[str], resolution: float = DEFAULT_RESOLUTION) -> np.ndarray:
+    """Hash each row's quantized values and keys into a uint64."""
+    parts = DataFrame({c: quantize(frame[c].to_numpy(), resolution) for c in value_columns}, index=frame.index)
+    for column in key_columns:
+        parts[column] = frame[column].astype(object).to_numpy()
+    return pd.util.hash_pandas_object(parts, index=False).to_numpy()
+
+
+def salt_fingerprints(fingerprints: np.ndarray, *salts: Any) -> np.ndarray:
+    """Combine fingerprints with run wide (scalar) or per VM (array) values such as catalog versions."""
+    parts = DataFrame({'fingerprint': fingerprints})
+    for i, salt in enumerate(salts):
+        parts[f'salt{i}'] = pd.Series(salt if isinstance(salt, (list, np.ndarray, pd.Series)) else [salt] * len(parts), dtype=object).to_numpy()
+    return pd.util.hash_pandas_object(parts, index=False).to_numpy()
+
+
+class FingerprintStore(object):
+    """The last analysis result and fingerprint of each VM, one Parquet file per kind of analysis."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, kind: str) -> str:
+        return os.path.join(self.root, f'{kind}.parquet')
+
+    def read(self, kind: str) -> DataFrame:
+        path = self._path(kind)
+        if not os.path.exists(path):
+            return DataFrame(columns=STORE_COLUMNS)
+        return pd.read_parquet(path)
+
+    def lookup(self, kind: str, resource_ids: Sequence[str], fingerprints: np.ndarray) -> DataFrame:
+        """The stored results, indexed by resource id, of the VMs whose fingerprint is unchanged."""
+        stored = self.read(kind)
+        current = DataFrame({'resource_id': np.asarray(resource_ids, dtype=object), 'fingerprint': fingerprints})
+        hits = current.merge(stored.astype({'fingerprint': np.uint64}), on=['resource_id', 'fingerprint'], how='inner')
+        return hits.set_index('resource_id')[RESULT_COLUMNS]
+
+    def update(self, kind: str, resource_ids: Sequence[str], fingerprints: np.ndarray, results: DataFrame,
+        fleet: Optional[Iterable[str]] = None) -> None:
+        """Replace the stored rows of ``resource_ids`` with their new fingerprints and results (indexed by resource id).
+
+        With a ``fleet`` of resource ids, the rows of VMs not in it are removed.
+        """
+        resource_ids = np.asarray(resource_ids, dtype=object)
+        fresh = DataFrame({'resource_id': resource_ids, 'fingerprint': fingerprints})
+        fresh = fresh.merge(results[RESULT_COLUMNS], left_on='resource_id', right_index=True, how='inner')
+        fresh['updated'] = pd.Timestamp(datetime.datetime.utcnow())
+        stored = self.read(kind)
+        stored = stored[~stored.resource_id.isin(set(resource_ids))]
+        if fleet is not None:
+            stored = stored[stored.resource_id.isin(set(fleet))]
+        merged = pd.concat([stored, fresh[STORE_COLUMNS]], ignore_index=True) if len(stored) else fresh[STORE_COLUMNS]
+        merged = merged.astype({'fingerprint': np.uint64, 'advisor_sku_valid': bool, 'annual_savings_no_ri': float})
+
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(kind)
+        merged.to_parquet(f'{path}.tmp', index=False)
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,240 @@
+from typing import Dict, NamedTuple, List, Optional, Sequence, Tuple, TYPE_CHECKING
+from pandas import DataFrame
+import numpy as np
+
+if TYPE_CHECKING:
+    from azmeta.access.specifications import VirtualMachineSku
+
+
+# Column order of the capability and requirement matrices. Fitness on an axis means capability > requirement.
+AXES = ('cpu', 'memory', 'cached_bytes', 'cached_iops', 'uncached_bytes', 'uncached_iops')
+_CPU_AND_DISK_AXES = [0, 2, 3, 4, 5]
+DISK_COUNTERS = (
+    (True, 'Disk Bytes/sec'),
+    (True, 'Disk Transfers/sec'),
+    (False, 'Disk Bytes/sec'),
+    (False, 'Disk Transfers/sec'),
+)
+
+
+class SkuArrays(NamedTuple):
+    skus: List['VirtualMachineSku']
+    costs: np.ndarray
+    memory_gb: np.ndarray
+    capabilities: np.ndarray
+
+
+class FitnessSelection(NamedTuple):
+    index: np.ndarray
+    cpu: np.ndarray
+    memory: np.ndarray
+    disk: np.ndarray
+    comparisons: Optional[np.ndarray] = None
+
+
+def sku_capability_vector(sku: 'VirtualMachineSku') -> Tuple[float, ...]:
+    c = sku.capabilities
+    return (
+        c.d_total_acus,
+        c.memory_gb * 1024,
+        c.combined_temp_disk_and_cached_read_bytes_per_second,
+        c.combined_temp_disk_and_cached_iops,
+        c.uncached_disk_bytes_per_second,
+        c.uncached_disk_iops,
+    )
+
+
+def build_sku_arrays(priced_skus: Sequence[Tuple[float, 'VirtualMachineSku']]) -> SkuArrays:
+    """Convert a cost sorted list of (annual cost, sku) pairs to capability arrays."""
+    skus = [s for _, s in priced_skus]
+    return SkuArrays(
+        skus=skus,
+        costs=np.array([c for c, _ in priced_skus], dtype=float),
+        memory_gb=np.array([s.capabilities.memory_gb for s in skus], dtype=float),
+        capabilities=np.array([sku_capability_vector(s) for s in skus], dtype=float).reshape(len(skus), len(AXES)))
+
+
+class FitnessPolicy(NamedTuple):
+    """The thresholds of the fitness rules. A requirement is the larger of its scaled percentiles."""
+    cpu_p99: float = 0.9
+    cpu_p95: float = 1.0
+    memory_p99: float = 1.05
+    memory_p80: float = 1.10
+    flex_memory_p99: float = 0.75
+    flex_memory_p95: float = 0.8
+    flex_memory_p80: float = 0.8
+    disk_p99: float = 0.9
+    disk_p95: float = 1.0
+    low_cached_bytes: float = 30 * 1024**2
+    low_cached_iops: float = 800
+
+
+DEFAULT_POLICY = FitnessPolicy()
+
+# Bump when a change to the fitness rules or the cheapest fit search changes results, so stored analyses
+# keyed by the previous rules are not reused.
+RULES_VERSION = 1
+
+
+def rules_version(policy: FitnessPolicy = DEFAULT_POLICY) -> str:
+    """Identifies the fitness rules and thresholds an analysis was made with."""
+    return f'{RULES_VERSION}:' + ','.join(repr(float(x)) for x in policy)
+
+
+def build_requirements(features: DataFrame, policy: FitnessPolicy = DEFAULT_POLICY) -> np.ndarray:
+    """Build the (VMs x AXES) matrix of the values each capability of a SKU must exceed for the VM to fit.
+
+    Databases with little cached disk usage flex memory down, as their memory is mostly buffer pool.
+    """
+    p = lambda name: features[name].to_numpy(dtype=float)
+    low_cached_usage = (policy.low_cached_bytes > p('cached_bytes_p99')) & (policy.low_cached_iops > p('cached_iops_p99'))
+    flex_mem_down = features.is_database.to_numpy(dtype=bool) & low_cached_usage
+    requirements = np.empty((len(features), len(AXES)))
+    requirements[:, 0] = np.maximum(p('cpu_p99') * policy.cpu_p99, p('cpu_p95') * policy.cpu_p95)
+    requirements[:, 1] = np.where(flex_mem_down,
+        np.maximum.reduce([p('memory_p99') * policy.flex_memory_p99, p('memory_p95') * policy.flex_memory_p95, p('memory_p80') * policy.flex_memory_p80]),
+        np.maximum(p('memory_p99') * policy.memory_p99, p('memory_p80') * policy.memory_p80))
+    for axis, name in enumerate(AXES[2:], start=2):
+        requirements[:, axis] = np.maximum(p(f'{name}_p99') * policy.disk_p99, p(f'{name}_p95') * policy.disk_p95)
+    return requirements
+
+
+class _Frontier(NamedTuple):
+    positions: np.ndarray
+    capabilities: np.ndarray
+    running_max: np.ndarray
+
+
+def pareto_frontier(capabilities: np.ndarray, positions: np.ndarray) -> _Frontier:
+    """Drop the SKUs at ``positions`` that an earlier (no more expensive) SKU matches or beats on every axis.
+
+    A dominated SKU can never be the first in cost order to fit a VM, since the SKU dominating it fits too.
+    """
+    candidates = capabilities[positions]
+    if len(positions) > 1:
+        covers = (candidates[:, np.newaxis, :] >= candidates[np.newaxis, :, :]).all(axis=2)
+        positions = positions[~np.triu(covers, k=1).any(axis=0)]
+    return frontier_at(capabilities, positions)
+
+
+def frontier_at(capabilities: np.ndarray, positions: np.ndarray) -> _Frontier:
+    """The frontier of the SKUs at ``positions``, which must already be free of dominated SKUs."""
+    capabilities = capabilities[positions]
+    return _Frontier(positions, capabilities, np.maximum.accumulate(capabilities, axis=0))
+
+
+def frontiers_at(capabilities: np.ndarray, positions: np.ndarray, memory_positions: Dict[float, np.ndarray]) -> Tuple[_Frontier, Dict[float, _Frontier]]:
+    """Rebuild the frontiers of a ``SkuIndex`` from their candidate positions."""
+    cpu_and_disk = capabilities[:, _CPU_AND_DISK_AXES]
+    return frontier_at(capabilities, positions), {m: frontier_at(cpu_and_disk, p) for m, p in memory_positions.items()}
+
+
+def first_fit(frontier: _Frontier, requirements: np.ndarray, limits: np.ndarray, comparisons: Optional[np.ndarray] = None) -> np.ndarray:
+    """The candidate position of the first frontier SKU exceeding every requirement of each VM, or its limit if none before it does.
+
+    No SKU before the first whose running maximum exceeds a requirement can fit, so the scan for each VM
+    starts at the largest such lower bound over the axes and stops at the limit. The SKUs compared per VM
+    are added to ``comparisons`` when given.
+    """
+    result = limits.copy()
+    if len(frontier.positions) == 0:
+        return result
+    lower = np.zeros(len(requirements), dtype=np.intp)
+    for axis in range(requirements.shape[1]):
+        lower = np.maximum(lower, np.searchsorted(frontier.running_max[:, axis], requirements[:, axis], side='right'))
+    stop = np.searchsorted(frontier.positions, limits)
+
+    active = np.flatnonzero(lower < stop)
+    k = lower[active]
+    while len(active):
+        fits = (frontier.capabilities[k] > requirements[active]).all(axis=1)
+        result[active[fits]] = frontier.positions[k[fits]]
+        if comparisons is not None:
+            comparisons[active] += 1
+        k = k + 1
+        remaining = ~fits & (k < stop[active])
+        active, k = active[remaining], k[remaining]
+    return result
+
+
+class SkuIndex(object):
+    """Capabilities of every SKU by name, and the cost sorted resize candidates indexed for the cheapest fit search.
+
+    The candidates are pruned to a Pareto frontier over all axes, plus one frontier over the cpu and disk
+    axes per memory size for VMs that may keep their current memory.
+    """
+
+    def __init__(self, skus: Sequence['VirtualMachineSku'], priced_skus: Dict[str, Tuple[float, 'VirtualMachineSku']],
+        candidates: Sequence[Tuple[float, 'VirtualMachineSku']]):
+        self.priced_skus = priced_skus
+        self.candidates = build_sku_arrays(candidates)
+        self._by_name = {s.name.lower(): s for s in skus}
+        self._capabilities = {}
+
+        positions = np.arange(len(self.candidates.skus))
+        self.frontier = pareto_frontier(self.candidates.capabilities, positions)
+        cpu_and_disk = self.candidates.capabilities[:, _CPU_AND_DISK_AXES]
+        self.memory_frontiers = {
+            memory_gb: pareto_frontier(cpu_and_disk, positions[self.candidates.memory_gb == memory_gb])
+            for memory_gb in np.unique(self.candidates.memory_gb)
+        }
+
+    def sku(self, name: str) -> 'VirtualMachineSku':
+        return self._by_name[name.lower()]
+
+    def capabilities_of(self, names: Sequence[str]) -> np.ndarray:
+        """The (len(names) x AXES) capability matrix of the named SKUs."""
+        for name in set(names) - self._capabilities.keys():
+            self._capabilities[name] = sku_capability_vector(self.sku(name))
+        return np.array([self._capabilities[n] for n in names], dtype=float).reshape(len(names), len(AXES))
+
+    def select_cheapest_fit(self, requirements: np.ndarray, current_costs: np.ndarray, current_memory_gb: np.ndarray) -> FitnessSelection:
+        """Find the cheapest candidate SKU that fits each VM. See ``cheapest_fit``."""
+        return cheapest_fit(self.candidates.costs, self.candidates.capabilities, self.frontier, self.memory_frontiers,
+                            requirements, current_costs, current_memory_gb)
+
+
+def cheapest_fit(costs: np.ndarray, capabilities: np.ndarray, frontier: _Frontier, memory_frontiers: Dict[float, _Frontier],
+    requirements: np.ndarray, current_costs: np.ndarray, current_memory_gb: np.ndarray) -> FitnessSelection:
+    """Find the cheapest of the cost sorted candidates that fits each VM.
+
+    Equivalent to a linear scan of the candidates: the scan stops at the first SKU that costs more than the
+    current SKU, or that fits cpu, disk and either fits memory or matches the current memory. If nothing
+    stops the scan the last candidate is selected. The returned fitness flags are those of the last SKU that
+    was evaluated, which is the one before the selection when the scan stopped on cost. ``comparisons``
+    counts the frontier SKUs compared per VM.
+    """
+    sku_count = len(costs)
+    if sku_count == 0:
+        raise ValueError('No candidate SKUs to evaluate.')
+
+    over_cost = np.searchsorted(costs, current_costs, side='right')
+    comparisons = np.zeros(len(requirements), dtype=np.int64)
+    stop = first_fit(frontier, requirements, over_cost, comparisons)
+    for memory_gb, memory_frontier in memory_frontiers.items():
+        vms = np.flatnonzero(current_memory_gb == memory_gb)
+        if len(vms):
+            memory_comparisons = np.zeros(len(vms), dtype=np.int64)
+            stop[vms] = first_fit(memory_frontier, requirements[vms][:, _CPU_AND_DISK_AXES], stop[vms], memory_comparisons)
+            comparisons[vms] += memory_comparisons
+
+    selected = np.minimum(stop, sku_count - 1)
+    eligible = costs[selected] <= current_costs
+    evaluated = np.where(eligible, selected, np.maximum(selected - 1, 0))
+    fit = capabilities[evaluated] > requirements
+    return FitnessSelection(index=selected, cpu=fit[:, 0], memory=fit[:, 1], disk=fit[:, 2:].all(axis=1), comparisons=comparisons)
+
+
+class RegionalSkuIndex(NamedTuple):
+    """A SKU index per region. Prices and so the candidates differ by region, capabilities do not."""
+    default_region: str
+    regions: Dict[str, SkuIndex]
+    price_catalog_version: str = ''
+    specifications_version: str = ''
+
+    def region_of(self, location: Optional[str]) -> str:
+        return location if isinstance(location, str) and location else self.default_region
+
+    @property
+    def default(self) -> SkuIndex:
+        return self.regions[self.default_region]
@@ -0,0 +1,169 @@
+"""Opt-in per-solid instrumentation.
+
+Solids wrapped with ``instrumented`` report wall and CPU time, peak memory, input and output row counts and
+any counters added from the hot paths through the ``profiling`` resource, as metadata of a materialization
+labelled ``<solid>_profile``. Each solid may also be profiled with cProfile or pyinstrument.
+"""
+from dagster import resource, InitResourceContext, SolidExecutionContext, Field, Bool, String, Output, Materialization, EventMetadataEntry
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from pandas import DataFrame, Series
+import functools
+import inspect
+import os
+import time
+from .scheduler import ChunkStats, chunk_status_counts
+from .profiling import PeakRssSampler, SolidProfile, current_rss
+
+
+class SolidProfiler(object):
+    def __init__(self, enabled: bool = False, profile_dir: Optional[str] = None, profiler: str = 'cprofile'):
+        if profiler not in ('cprofile', 'pyinstrument'):
+            raise ValueError(f'Unknown profiler {profiler}, expected cprofile or pyinstrument.')
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self._active: Dict[str, SolidProfile] = {}
+
+    def current(self, context: SolidExecutionContext) -> SolidProfile:
+        """The profile of the executing solid to add counters to. A detached one when instrumentation is disabled."""
+        return self._active.get(context.solid.name) or SolidProfile(context.solid.name)
+
+
+@resource(config_schema={
+    'enabled': Field(Bool, default_value=False, is_required=False, description='Report the time, memory, rows and counters of every solid.'),
+    'profile_dir': Field(String, is_required=False, description='Also write a profile of every solid to <profile_dir>/<run id>/.'),
+    'profiler': Field(String, default_value='cprofile', is_required=False, description='cprofile, or pyinstrument if installed.'),
+})
+def solid_profiling(context: InitResourceContext) -> SolidProfiler:
+    config = context.resource_config
+    return SolidProfiler(config['enabled'], config.get('profile_dir'), config['profiler'])
+
+
+def instrumented(compute_fn: Callable) -> Callable:
+    """Measure a solid compute function when the profiling resource is enabled. The solid must require the ``profiling`` resource."""
+    is_generator = inspect.isgeneratorfunction(compute_fn)
+
+    def events(context: SolidExecutionContext, *args, **kwargs):
+        if is_generator:
+            yield from compute_fn(context, *args, **kwargs)
+        else:
+            yield Output(compute_fn(context, *args, **kwargs))
+
+    @functools.wraps(compute_fn)
+    def compute(context: SolidExecutionContext, *args, **kwargs):
+        profiler: SolidProfiler = context.resources.profiling
+        if not profiler.enabled:
+            yield from events(context, *args, **kwargs)
+            return
+
+        name = context.solid.name
+        profile = profiler._active[name] = SolidProfile(name)
+        arguments = inspect.signature(compute_fn).bind(context, *args, **kwargs).arguments
+        outputs: List[Output] = []
+        times = {'wall': 0.0, 'cpu': 0.0}
+        dump, sampler = _ProfileDump(profiler, context), PeakRssSampler()
+        try:
+            with dump, sampler:
+                start, cpu_start = time.perf_counter(), time.process_time()
+                waiting, cpu_waiting = 0.0, 0.0
+                try:
+                    for event in events(context, *args, **kwargs):
+                        # Outputs are held back so the profile is reported before them, everything else as it happens.
+                        if isinstance(event, Output):
+                            outputs.append(event)
+                            continue
+                        paused, cpu_paused = time.perf_counter(), time.process_time()
+                        yield event
+                        waiting += time.perf_counter() - paused
+                        cpu_waiting += time.process_time() - cpu_paused
+                finally:
+                    # The time dagster spends handling the yielded events is not the solid's.
+                    times['wall'] = time.perf_counter() - start - waiting
+                    times['cpu'] = time.process_time() - cpu_start - cpu_waiting
+        except Exception:
+            # A failed solid still reports what it used until the failure.
+            yield _profile_materialization(name, times, sampler, arguments, outputs, profile, dump)
+            raise
+        finally:
+            del profiler._active[name]
+
+        yield _profile_materialization(name, times, sampler, arguments, outputs, profile, dump)
+        yield from outputs
+
+    return compute
+
+
+def _profile_materialization(name: str, times: Dict[str, float], sampler: PeakRssSampler, arguments: Dict[str, Any],
+    outputs: Sequence[Output], profile: SolidProfile, dump: '_ProfileDump') -> Materialization:
+    entries = [
+        EventMetadataEntry.json({'wall_seconds': round(times['wall'], 6), 'cpu_seconds': round(times['cpu'], 6),
+                                 'peak_rss_mib': round(sampler.peak / 1024**2, 1), 'rss_growth_mib': round((sampler.peak - sampler.start) / 1024**2, 1)}, 'Time and Memory'),
+        EventMetadataEntry.json({'inputs': _row_counts(arguments), 'outputs': {e.output_name: _rows(e.value) for e in outputs}}, 'Row Counts'),
+    ]
+    if profile.counters:
+        entries.append(EventMetadataEntry.json(profile.counters, 'Counters'))
+    if profile.chunks:
+        entries.append(EventMetadataEntry.json(_chunk_summary(profile.chunks), 'Query Chunks'))
+    if dump.path:
+        entries.append(EventMetadataEntry.path(dump.path, 'profile_path'))
+    return Materialization(label=f'{name}_profile', description=f'The resources {name} used.', metadata_entries=entries)
+
+
+def _rows(value: Any) -> Optional[int]:
+    return len(value) if isinstance(value, (DataFrame, Series, dict, list)) else None
+
+
+def _row_counts(arguments: Dict[str, Any]) -> Dict[str, int]:
+    rows = {k: _rows(v) for k, v in arguments.items() if k != 'context'}
+    return {k: v for k, v in rows.items() if v is not None}
+
+
+def _chunk_summary(chunks: Sequence[ChunkStats]) -> Dict:
+    frame = DataFrame(chunks, columns=ChunkStats._fields)
+    return {
+        'chunks': len(frame),
+        'resources': int(frame.resources.sum()),
+        'rows': int(frame.rows.sum()),
+        'bytes': int(frame.bytes.sum()),
+        'retries': int((frame.attempts - 1).clip(lower=0).sum()),
+        'status': chunk_status_counts(chunks),
+        'latency_seconds': {q: round(float(frame.seconds.quantile(p)), 3) for q, p in (('p50', 0.5), ('p95', 0.95), ('max', 1.0))},
+        'transform_seconds': round(float(frame.transform_seconds.sum()), 3),
+        'per_chunk': [[c.workspace, c.resources, c.rows, c.bytes, round(c.seconds, 3), c.attempts, c.status] for c in chunks],
+    }
+
+
+class _ProfileDump(object):
+    def __init__(self, profiler: SolidProfiler, context: SolidExecutionContext):
+        self._settings = profiler
+        self._directory = os.path.join(profiler.profile_dir, context.run_id) if profiler.profile_dir else None
+        self._name = context.solid.name
+        self._profiler = None
+        self.path: Optional[str] = None
+
+    def __enter__(self):
+        if self._directory is None:
+            return self
+        if self._settings.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            self._profiler = Profiler()
+            self._profiler.start()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler is None:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        if self._settings.profiler == 'pyinstrument':
+            self._profiler.stop()
+            self.path = os.path.join(self._directory, f'{self._name}.html')
+            with open(self.path, 'w', encoding='utf-8') as fd:
+                fd.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            self.path = os.path.join(self._directory, f'{self._name}.prof')
+            self._profiler.dump_stats(self.path)
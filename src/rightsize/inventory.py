@@ -0,0 +1,61 @@
+"""The operation inventory: the validated resize operations, written as one JSON Lines shard per subscription."""
+from typing import Dict
+from pandas import DataFrame
+import gzip
+import json
+import os
+from .engine import RightSizeAnalysis
+from .pricing import PriceCatalog
+
+
+def inventory_operations(analysis: Dict[str, RightSizeAnalysis], resources: DataFrame) -> DataFrame:
+    """The validated resize operations joined to their VM's subscription and current size, ordered by subscription.
+
+    Raises KeyError if an operation's VM is not in ``resources``.
+    """
+    valid = [(resource_id, a.advisor_sku) for resource_id, a in analysis.items() if a.advisor_sku_valid]
+    operations = DataFrame(valid, columns=['resource_id', 'new_sku'])
+    operations = operations.merge(resources[['resource_id', 'subscription_id', 'vm_size']], on='resource_id', how='left',
+                                  validate='one_to_one', indicator=True)
+    unmatched = operations.resource_id[operations._merge == 'left_only']
+    if len(unmatched):
+        raise KeyError(f'{len(unmatched)} resize operations are for VMs not in the resources, such as {unmatched.iloc[0]}.')
+    operations = operations.rename(columns={'vm_size': 'current_sku'})
+    return operations[['subscription_id', 'resource_id', 'current_sku', 'new_sku']].sort_values('subscription_id', kind='mergesort')
+
+
+def write_inventory(analysis: Dict[str, RightSizeAnalysis], resources: DataFrame, price_catalog: PriceCatalog, output_dir: str, compress: bool = False) -> str:
+    """Write the operations as one JSON Lines file per subscription and return the path of the manifest.
+
+    The manifest lists every shard up front as pending and is rewritten as each shard completes, so
+    consumers can start on finished subscriptions while later shards are still being written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    operations = inventory_operations(analysis, resources)
+    extension = 'jsonl.gz' if compress else 'jsonl'
+    groups = list(operations.groupby('subscription_id', sort=False))
+    manifest = {
+        'price_catalog_version': price_catalog.version,
+        'complete': False,
+        'shards': [{'subscription_id': s, 'path': f'{s}.{extension}', 'operations': len(g), 'status': 'pending'} for s, g in groups],
+    }
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    _write_manifest(manifest_path, manifest)
+
+    for shard, (_, group) in zip(manifest['shards'], groups):
+        shard_path = os.path.join(output_dir, shard['path'])
+        with (gzip.open(f'{shard_path}.tmp', 'wt', encoding='utf-8') if compress else open(f'{shard_path}.tmp', 'w', encoding='utf-8')) as fd:
+            fd.writelines(json.dumps(x) + '\n' for x in group.to_dict('records'))
+        os.replace(f'{shard_path}.tmp', shard_path)
+        shard['status'] = 'complete'
+        _write_manifest(manifest_path, manifest)
+
+    manifest['complete'] = True
+    _write_manifest(manifest_path, manifest)
+    return manifest_path
+
+
+def _write_manifest(path: str, manifest: Dict) -> None:
+    with open(f'{path}.tmp', 'w') as fd:
+        json.dump(manifest, fd, indent=3)
+    os.replace(f'{path}.tmp', path)
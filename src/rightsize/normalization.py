@@ -0,0 +1,163 @@
+"""Normalization of raw utilization to the units the fitness rules compare: ACUs, used MiB, and cached and uncached disk totals."""
+from pandas import DataFrame
+from typing import Optional, List, TYPE_CHECKING, NamedTuple, Dict, Iterable, Tuple, FrozenSet
+import functools
+import pandas as pd
+
+if TYPE_CHECKING:
+    from azmeta.access.specifications import AzureComputeSpecifications
+
+
+def to_acus(utilization: DataFrame, compute_specs: 'AzureComputeSpecifications', resources: DataFrame) -> DataFrame:
+    """Convert percent processor time to ACUs used."""
+    columns = utilization.loc[:, 'percentile_50th':'max'].columns
+    acus = _join_vm_capabilities(utilization, compute_specs, resources).d_total_acus.to_numpy()
+    return utilization.assign(**{c: utilization[c].to_numpy() / 100 * acus for c in columns})
+
+
+def to_used_memory(utilization: DataFrame, compute_specs: 'AzureComputeSpecifications', resources: DataFrame) -> DataFrame:
+    """Convert negated available MiB to used MiB."""
+    columns = utilization.loc[:, 'percentile_50th':'max'].columns
+    total_memory_mib = _join_vm_capabilities(utilization, compute_specs, resources).memory_gb.to_numpy() * 1024
+    return utilization.assign(**{c: total_memory_mib + utilization[c].to_numpy() for c in columns})
+
+
+def vm_size_capabilities(compute_specs: 'AzureComputeSpecifications', vm_sizes: Iterable[str]) -> DataFrame:
+    """Build a vm_size indexed lookup table of the capabilities used to normalize utilization."""
+    vm_sizes = pd.unique(pd.Series(list(vm_sizes), dtype=object).dropna())
+    capabilities = (compute_specs.virtual_machine_by_name(s).capabilities for s in vm_sizes)
+    return DataFrame([(c.d_total_acus, c.memory_gb) for c in capabilities], 
+        index=pd.Index(vm_sizes, name='vm_size'), columns=['d_total_acus', 'memory_gb'], dtype=float)
+
+
+def _join_vm_capabilities(utilization: DataFrame, compute_specs: 'AzureComputeSpecifications', resources: DataFrame) -> DataFrame:
+    sizes = resources[['resource_id', 'vm_size']]
+    lookup = vm_size_capabilities(compute_specs, sizes.vm_size)
+    joined = utilization[['resource_id']].merge(sizes, on='resource_id', how='left').merge(lookup, left_on='vm_size', right_index=True, how='left')
+    if joined.vm_size.isna().any():
+        missing = joined.resource_id[joined.vm_size.isna()].iloc[0]
+        raise KeyError(missing)
+    return joined
+
+
+class DataDiskCaching(NamedTuple):
+    cached: bool
+    role: Optional[str]
+
+
+class DiskCachingProfile(NamedTuple):
+    os_cached: bool
+    data_disks: Tuple[DataDiskCaching, ...]
+
+
+def classify_disk_utilization(utilization: DataFrame, resources: DataFrame, logger) -> DataFrame:
+    """Sum per drive utilization into cached and uncached totals per VM and counter."""
+    value_columns = utilization.select_dtypes('number').columns.to_list()
+    if not len(utilization):
+        return DataFrame({'cached': pd.Series(dtype=bool), 'counter_name': utilization.counter_name,
+                          **{c: utilization[c] for c in value_columns}, 'resource_id': utilization.resource_id})
+    profiles = disk_caching_profiles(resources)
+    drives = utilization.instance_name.str.rstrip(':').str.upper()
+    drive_sets = drives.groupby(utilization.resource_id).agg(frozenset)
+    keys = DataFrame({'profile': profiles.reindex(drive_sets.index), 'drives': drive_sets})
+
+    key_ids: Dict[Tuple[DiskCachingProfile, FrozenSet[str]], int] = {}
+    unmapped_by_key: List[List[str]] = []
+    mapping_rows = []
+    resource_key_ids = []
+    for resource_id, profile, all_names in keys.itertuples():
+        key = (profile, all_names)
+        key_id = key_ids.get(key)
+        if key_id is None:
+            key_id = key_ids[key] = len(key_ids)
+            mapping = {x: _disk_is_cached(x, profile, all_names) for x in all_names}
+            unmapped_by_key.append([k for k, v in mapping.items() if v is None])
+            mapping_rows.extend((key_id, k, True if v is None else v) for k, v in mapping.items())
+        unmapped = unmapped_by_key[key_id]
+        if unmapped:
+            logger.warning(f'Failed to deduce cache config for {",".join(unmapped)} on {resource_id}')
+        resource_key_ids.append(key_id)
+
+    drive_caching = DataFrame(mapping_rows, columns=['key_id', 'drive', 'cached'])
+    resource_keys = pd.Series(resource_key_ids, index=drive_sets.index, name='key_id')
+    data = utilization.assign(drive=drives.to_numpy(), key_id=utilization.resource_id.map(resource_keys).to_numpy())
+    data = data.merge(drive_caching, on=['key_id', 'drive'], how='left')
+
+    summed = data.groupby(['resource_id', 'cached', 'counter_name'])[value_columns].sum().reset_index()
+    return summed[['cached', 'counter_name'] + value_columns + ['resource_id']]
+
+
+def disk_caching_profiles(resources: DataFrame) -> pd.Series:
+    """Flatten each VM's storage profile to the fields the cache rules depend on.
+
+    Resources fetched with compact storage profiles have them as ``disk_caching`` codes instead.
+    """
+    if 'disk_caching' in resources.columns:
+        profiles = [decode_disk_caching(c) for c in resources.disk_caching]
+    else:
+        profiles = [_caching_profile(p) for p in resources.storage_profile]
+    return pd.Series(profiles, index=resources.resource_id, name='profile')
+
+
+def encode_disk_caching(storage_profile: Dict) -> str:
+    """A short code of the storage profile fields the cache rules depend on, such as ``1|1data,0log``.
+
+    The OS disk caching comes first, then each data disk's caching and role. VMs with the same layout
+    share a code, so a fleet has few distinct ones.
+    """
+    profile = _caching_profile(storage_profile)
+    return f'{int(profile.os_cached)}|' + ','.join(f'{int(d.cached)}{d.role or ""}' for d in profile.data_disks)
+
+
+@functools.lru_cache(maxsize=4096)
+def decode_disk_caching(code: str) -> DiskCachingProfile:
+    os_cached, data_disks = code.split('|', 1)
+    return DiskCachingProfile(
+        os_cached=os_cached == '1',
+        data_disks=tuple(DataDiskCaching(d[0] == '1', d[1:] or None) for d in data_disks.split(',') if d))
+
+
+def _caching_profile(storage_profile: Dict) -> DiskCachingProfile:
+    return DiskCachingProfile(
+        os_cached=_caching_on(storage_profile['osDisk']['caching']),
+        data_disks=tuple(DataDiskCaching(_caching_on(x['caching']), _disk_role(x)) for x in storage_profile['dataDisks']))
+
+
+def _disk_role(data_disk: Dict) -> Optional[str]:
+    disk_id = (data_disk.get('managedDisk') or {}).get('id') or ''
+    for role in ('data', 'log', 'temp'):
+        if disk_id.endswith(role):
+            return role
+    return None
+
+
+def _disk_is_cached(name: str, profile: DiskCachingProfile, all_names: FrozenSet[str]) -> Optional[bool]:
+    if name == 'D':
+        return True
+
+    if name == 'C':
+        return profile.os_cached
+
+    if len(all_names) == 3 and len(profile.data_disks) == 1:
+        return profile.data_disks[0].cached
+    
+    if 'S' in all_names and 'L' in all_names and name in ('S', 'L'):
+        role = 'data' if name == 'S' else 'log'
+        caching = list(x.cached for x in profile.data_disks if x.role == role)
+        if caching:
+            return caching[0]
+
+    if name == 'T':
+        caching = list(x.cached for x in profile.data_disks if x.role == 'temp')
+        if caching:
+            return caching[0]
+
+    cache_settings = set(x.cached for x in profile.data_disks)
+    if len(cache_settings) == 1:
+        return next(iter(cache_settings))
+
+    return None
+
+
+def _caching_on(value: str) -> bool:
+    return value.lower() in ('readonly', 'readwrite')
@@ -1,4 +1,4 @@
-from dagster import solid, SolidExecutionContext, InputDefinition, OutputDefinition, Materialization, Output, EventMetadataEntry, Nothing, FileHandle
+from dagster import solid, SolidExecutionContext, InputDefinition, OutputDefinition, Materialization, Output, EventMetadataEntry, Nothing, FileHandle, Field, Int, Bool, String
 from dagster.utils import script_relative_path
 import dagstermill as dm
 from typing import Dict
@@ -6,40 +6,48 @@ from pandas import DataFrame
 from .right_size import RightSizeAnalysis
 from .resources import ResourcesDataFrame
 from .utilization import UtilizationDataFrame
-from azmeta.access.specifications import AzureComputeSpecifications
-from azmeta.access.reporting import convert_nodebook_node_to_html
-import nbformat
-import json
+from .catalogs import AzureComputeSpecifications, PriceCatalog
+from .inventory import write_inventory
+from .instrumentation import instrumented
 import os
 
-@solid(input_defs=[
+@solid(required_resource_keys={'profiling'}, config_schema={
+    'output_dir': Field(String, is_required=False, description='The inventory directory. Defaults to operation_inventory_<run id>.'),
+    'compress': Field(Bool, default_value=False, is_required=False, description='Gzip the subscription shards.'),
+}, input_defs=[
     InputDefinition('analysis', Dict[str, RightSizeAnalysis]),
     InputDefinition('resources', ResourcesDataFrame),
+    InputDefinition('price_catalog', PriceCatalog),
 ])
+@instrumented
 def write_operation_inventory(context: SolidExecutionContext, 
     analysis: Dict[str, RightSizeAnalysis],
-    resources: DataFrame) -> Nothing:
-    resources = resources.set_index('resource_id')
-    resizes = [{'subscription_id': resources.at[resource_id, 'subscription_id'], 'resource_id': resource_id, 'current_sku': resources.at[resource_id, 'vm_size'], 'new_sku': analysis.advisor_sku} 
-               for resource_id, analysis in analysis.items() if analysis.advisor_sku_valid]
-    output = { 'vm_resize_operations': resizes }
+    resources: DataFrame,
+    price_catalog: PriceCatalog) -> Nothing:
+    """Write the validated resize operations as one JSON Lines shard per subscription and a manifest.json.
 
-    output_path = os.path.abspath(f'operation_inventory_{context.run_id}.json')
-    with open(output_path, 'w') as fd:
-        json.dump(output, fd, indent=3)
+    This replaces the single operation_inventory_<run id>.json file and its vm_resize_operations list. Consumers
+    read the shards listed in the manifest instead; each record has the same fields as before.
+    """
+    config = context.solid_config
+    output_dir = os.path.abspath(config.get('output_dir', f'operation_inventory_{context.run_id}'))
+    manifest_path = write_inventory(analysis, resources, price_catalog, output_dir, config['compress'])
 
     yield Materialization(
         label='operation_inventory',
-        description='An inventory of the right sizing operations that are recommended and validated.',
+        description='An inventory of the right sizing operations that are recommended and validated, in one JSON Lines shard per subscription. '
+                    'The path is the manifest.json listing the shards, no longer a single JSON file.',
         metadata_entries=[
             EventMetadataEntry.path(
-                output_path, 'operation_inventory_path'
+                manifest_path, 'operation_inventory_path'
             )
         ],
     )
     yield Output(None)
 
 
+# The notebook report renders only the VMs with the largest savings. The pipelines write the full report
+# with write_paginated_report, these solids are kept to compose the notebook into a pipeline of one's own.
 right_size_report = dm.define_dagstermill_solid(
     'right_size_report', script_relative_path('rightsizereport.ipynb'),
     input_defs=[
@@ -49,15 +57,67 @@ right_size_report = dm.define_dagstermill_solid(
         InputDefinition('mem_utilization', UtilizationDataFrame),
         InputDefinition('disk_utilization', UtilizationDataFrame),
         InputDefinition('compute_specs', AzureComputeSpecifications),
+        InputDefinition('price_catalog', PriceCatalog),
         InputDefinition('resources', ResourcesDataFrame),
     ], output_notebook='output_notebook'
 )
 
 
-@solid(input_defs=[
+@solid(required_resource_keys={'profiling'}, config_schema={
+    'page_size': Field(Int, default_value=500, is_required=False, description='The VMs per HTML report page.'),
+    'excel': Field(Bool, default_value=True, is_required=False, description='Also write the report as an Excel workbook.'),
+    'output_dir': Field(String, is_required=False, description='The report directory. Defaults to right_size_report_<run id>.'),
+}, input_defs=[
+    InputDefinition('advisor_analysis', Dict[str, RightSizeAnalysis]),
+    InputDefinition('local_analysis', Dict[str, RightSizeAnalysis]),
+    InputDefinition('cpu_utilization', UtilizationDataFrame),
+    InputDefinition('mem_utilization', UtilizationDataFrame),
+    InputDefinition('disk_utilization', UtilizationDataFrame),
+    InputDefinition('compute_specs', AzureComputeSpecifications),
+    InputDefinition('price_catalog', PriceCatalog),
+    InputDefinition('resources', ResourcesDataFrame),
+])
+@instrumented
+def write_paginated_report(context: SolidExecutionContext,
+    advisor_analysis: Dict[str, RightSizeAnalysis],
+    local_analysis: Dict[str, RightSizeAnalysis],
+    cpu_utilization: DataFrame,
+    mem_utilization: DataFrame,
+    disk_utilization: DataFrame,
+    compute_specs: AzureComputeSpecifications,
+    price_catalog: PriceCatalog,
+    resources: DataFrame) -> Nothing:
+    config = context.solid_config
+    output_dir = os.path.abspath(config.get('output_dir', f'right_size_report_{context.run_id}'))
+    from .report import build_report_frame, write_report
+    frame = build_report_frame(advisor_analysis, local_analysis, cpu_utilization, mem_utilization, disk_utilization, compute_specs, resources)
+    savings = sum(v.annual_savings_no_ri or 0 for v in local_analysis.values())
+    summary = [f'Total Annual Savings: ${savings:,.2f} (Non-RI Pricing, SQL and Windows AHUB Licensing)',
+               f'Price Catalog Version: {price_catalog.version} ({price_catalog.default_region})']
+    files = write_report(frame, output_dir, config['page_size'], config['excel'], summary=summary)
+
+    entries = [
+        EventMetadataEntry.path(files.index_path, 'report_index_path'),
+        EventMetadataEntry.path(files.parquet_path, 'report_parquet_path'),
+        EventMetadataEntry.text(str(len(files.page_paths)), 'report_pages'),
+    ]
+    if files.excel_path:
+        entries.append(EventMetadataEntry.path(files.excel_path, 'report_excel_path'))
+    yield Materialization(
+        label='paginated_resize_report',
+        description='All VMs utilization data and evaluation of the recommendations, in pages of page_size VMs.',
+        metadata_entries=entries,
+    )
+    yield Output(None)
+
+
+@solid(required_resource_keys={'profiling'}, input_defs=[
     InputDefinition('report_notebook', FileHandle)
 ])
+@instrumented
 def write_html_report(context: SolidExecutionContext, report_notebook: FileHandle) -> Nothing:
+    from azmeta.access.reporting import convert_nodebook_node_to_html
+    import nbformat
     with context.file_manager.read(report_notebook) as node_file:
         node = nbformat.read(node_file, nbformat.NO_CONVERT)
     html = convert_nodebook_node_to_html(node, full_width=True)
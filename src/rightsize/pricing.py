@@ -0,0 +1,105 @@
+from typing import Dict, Tuple, Optional, Iterable, NamedTuple, TYPE_CHECKING
+from pandas import DataFrame
+import pandas as pd
+import functools
+import hashlib
+import os
+
+if TYPE_CHECKING:
+    from azmeta.access.specifications import VirtualMachineSku
+
+
+ANNUAL_SQL_2CORE_COST = 10.0
+ANNUAL_WIN_SERVER_COST = 10.0
+_CATALOG_COLUMNS = ['armSkuName', 'armRegionName', 'os', 'type', 'unitPrice', 'unitOfMeasure']
+
+
+class PriceRecord(NamedTuple):
+    unit_price: float
+    unit_of_measure: str
+
+
+class PriceCatalog(object):
+    """Virtual machine retail prices indexed by (armSkuName, region, OS, consumption type)."""
+
+    def __init__(self, prices: DataFrame, version: str, default_region: str):
+        self.version = version
+        self.default_region = default_region
+        self._prices = prices
+        self._index: Dict[Tuple[str, str, str, str], PriceRecord] = {
+            (r.armSkuName, r.armRegionName, r.os, r.type): PriceRecord(r.unitPrice, r.unitOfMeasure)
+            for r in prices.itertuples()
+        }
+
+    @property
+    def regions(self) -> Iterable[str]:
+        return self._prices.armRegionName.unique()
+
+    def find(self, arm_sku_name: str, region: str, os: str = 'Linux', consumption_type: str = 'Consumption') -> Optional[PriceRecord]:
+        return self._index.get((arm_sku_name, region, os, consumption_type))
+
+    def hourly_price(self, arm_sku_name: str, region: str, os: str = 'Linux', consumption_type: str = 'Consumption') -> Optional[float]:
+        record = self.find(arm_sku_name, region, os, consumption_type)
+        if record is None:
+            return None
+        if record.unit_of_measure != '1 Hour':
+            raise ValueError(f'Unhandled unit of measure {record.unit_of_measure} for {arm_sku_name}.')
+        return record.unit_price
+
+
+def load_catalog(price_sheet: str, cache_dir: Optional[str] = None, default_region: str = 'eastus2') -> PriceCatalog:
+    """Load a price catalog, parsing the retail price sheet only when its compact Parquet form is missing or stale.
+
+    Catalogs stay loaded per version of the price sheet, so a replaced sheet is loaded again.
+    """
+    price_sheet = os.path.abspath(price_sheet)
+    stat = os.stat(price_sheet)
+    return _load_catalog(price_sheet, stat.st_size, stat.st_mtime_ns, cache_dir, default_region)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_catalog(price_sheet: str, size: int, mtime_ns: int, cache_dir: Optional[str], default_region: str) -> PriceCatalog:
+    version = hashlib.sha1(f'{os.path.basename(price_sheet)}:{size}:{mtime_ns}'.encode()).hexdigest()[:16]
+    cache_dir = cache_dir or os.path.dirname(price_sheet)
+    cache_path = os.path.join(cache_dir, f'{os.path.splitext(os.path.basename(price_sheet))[0]}.{version}.parquet')
+
+    if os.path.exists(cache_path):
+        prices = pd.read_parquet(cache_path)
+    else:
+        prices = _compact_price_sheet(pd.read_json(price_sheet))
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f'{cache_path}.tmp'
+        prices.to_parquet(temp_path, index=False)
+        os.replace(temp_path, cache_path)
+
+    return PriceCatalog(prices, version, default_region)
+
+
+def _compact_price_sheet(sheet: DataFrame) -> DataFrame:
+    prices = sheet[(sheet.serviceName == 'Virtual Machines') & ~pd.isna(sheet.partNumber) & ~sheet.skuName.str.contains('Low Priority')]
+    prices = prices.assign(os=prices.productName.str.endswith('Windows').map({True: 'Windows', False: 'Linux'}))
+    prices = prices[_CATALOG_COLUMNS]
+    # Keys that match several records are ambiguous and left unpriced.
+    prices = prices.drop_duplicates(subset=_CATALOG_COLUMNS[:4], keep=False)
+    for column in ('armRegionName', 'os', 'type', 'unitOfMeasure'):
+        prices[column] = prices[column].astype('category')
+    return prices.reset_index(drop=True)
+
+
+def find_vm_billables(vm_sku: 'VirtualMachineSku') -> Tuple[str, int]:
+    bill_sku = vm_sku.capabilities.parent_size if vm_sku.capabilities.parent_size else vm_sku.name
+    bill_sku = bill_sku.replace('s_', '_').replace('_DS', '_D')
+    cores = vm_sku.capabilities.d_vcpus_available
+    return (bill_sku, cores)
+
+
+def annual_cost(catalog: PriceCatalog, vm_sku: 'VirtualMachineSku', region: str) -> Optional[float]:
+    """The annual cost of a SKU on Linux pricing plus SQL and Windows AHUB licensing."""
+    billing_sku_name, billing_cores = find_vm_billables(vm_sku)
+    hourly_price = catalog.hourly_price(billing_sku_name, region)
+    if hourly_price is None:
+        return None
+    sql_cost = max(4, billing_cores) / 2 * ANNUAL_SQL_2CORE_COST
+    win_cost = (0.5 if billing_cores <= 8 else float(-(-billing_cores // 16))) * ANNUAL_WIN_SERVER_COST
+    vm_cost = hourly_price * 24 * 365
+    return sql_cost + vm_cost + win_cost
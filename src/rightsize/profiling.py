@@ -0,0 +1,57 @@
+"""Resource measurements with no orchestration dependencies: peak memory sampling and per-solid counters."""
+from typing import Dict, List, Sequence
+import os
+import resource as rusage
+import threading
+from .scheduler import ChunkStats
+
+
+class PeakRssSampler(object):
+    """Samples the resident set size on a background thread, since ru_maxrss only ever grows."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return rusage.getrusage(rusage.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SolidProfile(object):
+    """Counters and query chunk statistics of one solid execution. Safe to add to from worker threads."""
+
+    def __init__(self, solid_name: str):
+        self.solid_name = solid_name
+        self.counters: Dict[str, float] = {}
+        self.chunks: List[ChunkStats] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_chunks(self, stats: Sequence[ChunkStats]) -> None:
+        with self._lock:
+            self.chunks.extend(stats)
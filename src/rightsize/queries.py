@@ -0,0 +1,114 @@
+"""Log Analytics utilization queries with no orchestration dependencies.
+
+``run_query`` queries a percentile query for every resource through the chunk scheduler, and
+``run_sketch_query`` reads the percentiles from the daily sketches, querying only the days missing from the
+sketch store. The utilization solids wrap these functions. Chunks are executed by ``azmeta`` unless the
+context has a chunk executor, such as a stub, and ``azmeta`` is only imported to execute a chunk.
+"""
+from typing import Any, Callable, Optional, Sequence
+from pandas import DataFrame
+import datetime
+import functools
+import os
+from .scheduler import QueryScheduler, ChunkExecutor, ChunkTransform
+from .checkpoints import ChunkCheckpoint, checkpoint_key, expire_checkpoints, lookback_age
+from .profiling import SolidProfile
+from .sketches import (
+    SketchCounterSpec, SketchStore, BUCKET_COLUMNS, DEFAULT_INGESTION_DELAY,
+    build_sketch_query, sketch_quantiles, lookback_days, contiguous_runs, split_days
+)
+
+
+class AzureMonitorContext(object):
+    def __init__(self, lookback_duration: str, workspace_map: dict, max_concurrency: int = 8, chunk_size: int = 32, adaptive_chunking: bool = True,
+        chunk_executor: Optional[ChunkExecutor] = None, sketch_store: Optional[str] = None, sketch_accuracy: float = 0.01,
+        checkpoint_dir: Optional[str] = None, sketch_ingestion_delay: datetime.timedelta = DEFAULT_INGESTION_DELAY):
+        self.lookback_duration = lookback_duration
+        self.checkpoint_dir = checkpoint_dir
+        self.sketch_store = sketch_store
+        self.sketch_accuracy = sketch_accuracy
+        self.sketch_ingestion_delay = sketch_ingestion_delay
+        self.chunk_executor = chunk_executor
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.adaptive_chunking = adaptive_chunking
+        self._workspace_map = workspace_map
+
+    def map_to_workspace(self, subscription_id: str) -> str:
+        return self._workspace_map[subscription_id]
+
+
+def query_utilization(builder: Callable, sketch_spec: SketchCounterSpec, resources: DataFrame, context: AzureMonitorContext, logger,
+    profile: Optional[SolidProfile] = None) -> DataFrame:
+    """The utilization percentiles of every resource, from the sketch store when the context has one."""
+    if context.sketch_store:
+        return run_sketch_query(sketch_spec, resources, context, logger, profile)
+    return run_query(builder, resources, context, logger, profile)
+
+
+def run_query(builder: Callable, resources: DataFrame, context: AzureMonitorContext, logger, profile: Optional[SolidProfile] = None,
+    transform: Optional[ChunkTransform] = None) -> DataFrame:
+    """Query ``builder`` over the lookback for every resource, in chunks per workspace, applying ``transform`` to each chunk."""
+    scheduler = _scheduler(context, logger)
+    try:
+        return scheduler.run(resources, lambda x:context.map_to_workspace(x.subscription_id), builder, context.lookback_duration, transform,
+            _checkpoint(context, builder, context.lookback_duration))
+    finally:
+        # Also the stats of a failed query, for its checkpoint status.
+        if profile is not None:
+            profile.add_chunks(scheduler.stats)
+
+
+def run_sketch_query(spec: SketchCounterSpec, resources: DataFrame, context: AzureMonitorContext, logger, profile: Optional[SolidProfile] = None) -> DataFrame:
+    """Query the days of the lookback missing from the sketch store and read the percentiles from the merged sketches."""
+    days = lookback_days(context.lookback_duration)
+    store = SketchStore(context.sketch_store, len(days), context.sketch_ingestion_delay)
+    store_key = f'{spec.key}-{context.sketch_accuracy}'
+    missing_ids, missing_days = store.missing(store_key, days, resources.resource_id)
+    logger.info(f'Sketch store {store_key} is missing {len(missing_days)} of {len(days)} days for {len(missing_ids)} resources.')
+    if profile is not None:
+        profile.add('sketch_days_missing', len(missing_days))
+        profile.add('sketch_resources_missing', len(missing_ids))
+
+    missing = resources[resources.resource_id.isin(missing_ids)]
+    empty = DataFrame(columns=spec.group_columns + BUCKET_COLUMNS)
+    for start, end in contiguous_runs(missing_days):
+        builder = functools.partial(build_sketch_query, spec=spec, start=start, end=end, relative_accuracy=context.sketch_accuracy)
+        timespan = f'{start.isoformat()}T00:00:00Z/{end.isoformat()}T00:00:00Z'
+        scheduler = _scheduler(context, logger)
+        try:
+            result = scheduler.run(missing, lambda x:context.map_to_workspace(x.subscription_id), builder, timespan, checkpoint=_checkpoint(context, builder, timespan))
+        finally:
+            if profile is not None:
+                profile.add_chunks(scheduler.stats)
+        by_day = dict(split_days(result))
+        for day in (d for d in missing_days if start <= d < end):
+            store.write(store_key, day, by_day.get(day, empty), missing.resource_id)
+
+    buckets = store.read(store_key, days, resources.resource_id)
+    return sketch_quantiles(buckets, spec.group_columns, context.sketch_accuracy)
+
+
+def _checkpoint(context: AzureMonitorContext, builder: Callable, timespan: str) -> Optional[ChunkCheckpoint]:
+    if not context.checkpoint_dir:
+        return None
+    # Checkpoints of earlier days' lookbacks are never resumed.
+    expire_checkpoints(context.checkpoint_dir, max(lookback_age(context.lookback_duration) or datetime.timedelta(0), datetime.timedelta(days=1)))
+    if timespan.startswith('P'):
+        # A lookback duration ends now, so its checkpoints are only resumed the same day.
+        timespan = f'{timespan}/{datetime.datetime.utcnow().date().isoformat()}'
+    # The query text for a placeholder resource identifies the builder and its counter spec.
+    return ChunkCheckpoint(os.path.join(context.checkpoint_dir, checkpoint_key(str(builder(['{resource_id}'])), timespan)))
+
+
+def _scheduler(context: AzureMonitorContext, logger) -> QueryScheduler:
+    return QueryScheduler(context.chunk_executor or functools.partial(_execute_chunk, logger=logger), max_concurrency=context.max_concurrency,
+        chunk_size=context.chunk_size, adaptive=context.adaptive_chunking, logger=logger)
+
+
+def _execute_chunk(workspace: str, rows: Sequence[Any], builder: Callable, timespan: str, logger) -> DataFrame:
+    from azmeta.access.monitor_logs import query_dataframe_by_workspace_chunk
+    from azmeta.access.utils.chunking import build_grouped_chunk_list
+    chunk_list = build_grouped_chunk_list(rows, lambda x:x.resource_id, lambda x:workspace, chunk_size=len(rows))
+    result = query_dataframe_by_workspace_chunk(chunk_list, builder, timespan=timespan, logger=logger)
+    return result.primary_result
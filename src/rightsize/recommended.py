@@ -1,12 +1,32 @@
 from typing import Dict
-from dagster import solid, SolidExecutionContext, Field, Array, String
+from dagster import solid, SolidExecutionContext, Field, Array, String, Int, Materialization, EventMetadataEntry, Output
 from azmeta.access.advisor import load_resize_recommendations
+from .instrumentation import instrumented
+from .advisor import load_recommendations
 
 
-@solid(config_schema={
-    'subscriptions': Field(Array(String), description='The subscriptions to query in Azure Advisor.')
+@solid(required_resource_keys={'profiling'}, config_schema={
+    'subscriptions': Field(Array(String), description='The subscriptions to query in Azure Advisor.'),
+    'max_concurrency': Field(Int, default_value=8, is_required=False, description='Subscriptions queried at the same time.'),
+    'store_dir': Field(String, is_required=False, description='Keep the recommendations in this directory and report the changes since the last run. '
+                                                              'advisor_validator reuses the validations of unchanged recommendations with its fingerprint_store, '
+                                                              'and warns of a missing one with recommendations_stored.'),
 })
+@instrumented
 def get_recommendations(context: SolidExecutionContext) -> Dict[str,str]:
     config = context.solid_config
-    recommendations = load_resize_recommendations(config['subscriptions'])
-    return {k:v.extended_properties['targetSku'] for k, v in recommendations.items()}
\ No newline at end of file
+    recommendations, delta = load_recommendations(config['subscriptions'], load_resize_recommendations, config['max_concurrency'],
+                                                  config.get('store_dir'), logger=context.log)
+    if delta is not None:
+        profile = context.resources.profiling.current(context)
+        for change, count in delta.items():
+            profile.add(f'recommendations_{change}', count)
+        yield Materialization(
+            label='advisor_recommendations',
+            description='The Advisor resize recommendations added, changed, unchanged and removed since the last run.',
+            metadata_entries=[
+                EventMetadataEntry.path(config['store_dir'], 'store_dir'),
+                EventMetadataEntry.json(delta, 'Changes'),
+            ],
+        )
+    yield Output(recommendations)
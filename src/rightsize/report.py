@@ -0,0 +1,282 @@
+"""Build the right size report table and write it as paginated HTML, Parquet and Excel.
+
+Limits and color classes are computed with joins over the unique SKUs instead of per row lookups,
+and the outputs are written one page at a time so report cost stays linear in the fleet size.
+"""
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from pandas import DataFrame
+import html
+import itertools
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ReportGroup(NamedTuple):
+    label: str
+    source: str
+    cached: Optional[bool]
+    counter_name: Optional[str]
+    attribute: str
+    scale: float
+
+
+REPORT_GROUPS = (
+    ReportGroup('CPU Used (ACUs)', 'cpu', None, None, 'd_total_acus', 1.0),
+    ReportGroup('Memory Used (GiB)', 'mem', None, None, 'memory_gb', 1.0),
+    ReportGroup('Cached Disk Througput (MiB/sec)', 'disk', True, 'Disk Bytes/sec', 'combined_temp_disk_and_cached_read_bytes_per_second', 1 / 1024.0 ** 2),
+    ReportGroup('Cached Disk Operations (IOPS)', 'disk', True, 'Disk Transfers/sec', 'combined_temp_disk_and_cached_iops', 1.0),
+    ReportGroup('Uncached Disk Througput (MiB/sec)', 'disk', False, 'Disk Bytes/sec', 'uncached_disk_bytes_per_second', 1 / 1024.0 ** 2),
+    ReportGroup('Uncached Disk Operations (IOPS)', 'disk', False, 'Disk Transfers/sec', 'uncached_disk_iops', 1.0),
+)
+LIMIT_BINS = 20
+DROP_UTILIZATION = ['samples', 'percentile_50th', 'percentile_80th']
+HEADER_PALETTE = ['#f6f6f6', '#eae9e9', '#d4d7dd']
+
+
+class ReportFiles(NamedTuple):
+    index_path: str
+    page_paths: List[str]
+    parquet_path: str
+    excel_path: Optional[str]
+
+
+def build_report_frame(advisor_analysis: Dict, local_analysis: Dict, cpu_utilization: DataFrame, mem_utilization: DataFrame,
+    disk_utilization: DataFrame, compute_specs, resources: DataFrame) -> DataFrame:
+    """One row per VM with two column levels: the group and the field. Each utilization group ends in the new SKU's limit."""
+    res_data = resources.assign(resource_name=resources.resource_id.str.extract(r'([^/]+)$', expand=False))
+    res_data = res_data.drop(columns=['subscription_id', 'storage_profile', 'disk_caching'], errors='ignore').set_index('resource_id')
+    res_data_col = res_data.columns.to_list()
+    res_data = res_data[res_data_col[1:-1] + res_data_col[-1:] + res_data_col[0:1]]
+    joins = [_with_group(res_data, 'Resource')]
+
+    new_skus = pd.Series({k: v.advisor_sku for k, v in local_analysis.items()}, dtype=object) if local_analysis else pd.Series(dtype=object)
+    limits = sku_limits(compute_specs, new_skus.unique(), [g.attribute for g in REPORT_GROUPS])
+    if local_analysis:
+        local_data = DataFrame([(k, v.advisor_sku, v.advisor_sku_invalid_reason, v.annual_savings_no_ri) for k, v in local_analysis.items()],
+                               columns=['resource_id', 'recommendation', 'invalidation', 'annual_savings']).convert_dtypes()
+        joins.append(_with_group(local_data.set_index('resource_id'), 'AzMeta'))
+
+    sources = {'cpu': cpu_utilization, 'mem': mem_utilization, 'disk': disk_utilization}
+    for group in REPORT_GROUPS:
+        data = sources[group.source]
+        if group.counter_name:
+            data = data[(data.cached == group.cached) & (data.counter_name == group.counter_name)].drop(columns=['cached', 'counter_name'])
+        data = data.drop(columns=DROP_UTILIZATION).set_index('resource_id')
+        if group.source == 'mem':
+            data = data / 1024.0
+        limit = new_skus.reindex(data.index).map(limits[group.attribute])
+        data = data.assign(new_limit=limit.astype(float)) * group.scale
+        joins.append(_with_group(data, group.label))
+
+    if advisor_analysis:
+        advisor_data = DataFrame([(k, v.advisor_sku, v.advisor_sku_invalid_reason) for k, v in advisor_analysis.items()],
+                                 dtype='string', columns=['resource_id', 'recommendation', 'invalidation'])
+        joins.append(_with_group(advisor_data.set_index('resource_id'), 'Advisor'))
+
+    return joins[0].join(joins[1:]).sort_index()
+
+
+def sku_limits(compute_specs, vm_sizes: Sequence[str], attributes: Sequence[str]) -> DataFrame:
+    """The capability attributes of each distinct SKU, indexed by SKU name."""
+    vm_sizes = [s for s in pd.unique(pd.Series(list(vm_sizes), dtype=object)) if isinstance(s, str)]
+    rows = [[getattr(compute_specs.virtual_machine_by_name(s).capabilities, a) for a in attributes] for s in vm_sizes]
+    return DataFrame(rows, index=pd.Index(vm_sizes, dtype=object), columns=list(attributes), dtype=float)
+
+
+def _with_group(frame: DataFrame, name: str) -> DataFrame:
+    frame = frame.copy()
+    frame.columns = pd.MultiIndex.from_tuples([(name, x) for x in frame.columns])
+    return frame
+
+
+def utilization_groups(frame: DataFrame) -> List[str]:
+    return [x for x in frame.columns.get_level_values(0).unique() if x not in ('Resource', 'AzMeta', 'Advisor')]
+
+
+def limit_bins(frame: DataFrame) -> np.ndarray:
+    """The color bin of every cell relative to its group's new limit, or -1 for no color.
+
+    Values are clipped to [0, limit] so everything over the limit gets the hottest color.
+    """
+    bins = np.full(frame.shape, -1, dtype=np.int8)
+    groups = frame.columns.get_level_values(0)
+    for group in utilization_groups(frame):
+        positions = np.flatnonzero(groups == group)
+        values = frame.iloc[:, positions].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.clip(values[:, :-1] / values[:, -1:], 0.0, 1.0)
+        bins[:, positions[:-1]] = np.where(np.isnan(ratio), -1, np.minimum(ratio * LIMIT_BINS, LIMIT_BINS - 1))
+    return bins
+
+
+def limit_palette(bins: int = LIMIT_BINS, cmap: str = 'coolwarm', text_color_threshold: float = 0.408) -> List[Tuple[str, str]]:
+    """The (background, text) colors of each bin, sampled from the colormap at the bin centers."""
+    def relative_luminance(rgba):
+        r, g, b = (
+            x / 12.92 if x <= 0.03928 else ((x + 0.055) / 1.055 ** 2.4)
+            for x in rgba[:3]
+        )
+        return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+    from matplotlib import cm, colors
+    rgbas = cm.get_cmap(cmap)((np.arange(bins) + 0.5) / bins)
+    return [(colors.rgb2hex(rgba), '#f1f1f1' if relative_luminance(rgba) < text_color_threshold else '#000000') for rgba in rgbas]
+
+
+def limit_css(frame: DataFrame) -> DataFrame:
+    """Inline CSS per cell for a pandas Styler, looked up from the color bins."""
+    styles = np.array([f'background-color: {b};color: {t};' for b, t in limit_palette()] + [''], dtype=object)
+    return DataFrame(styles[limit_bins(frame)], index=frame.index, columns=frame.columns)
+
+
+def header_styles(columns: pd.MultiIndex) -> List[Dict]:
+    start = 0
+    styles = []
+    for i, (_, group) in enumerate(itertools.groupby(columns, lambda c: c[0])):
+        color = HEADER_PALETTE[i % len(HEADER_PALETTE)]
+        styles.append({'selector': f'.col_heading.level0.col{start}', 'props': [('background-color', color)]})
+        group_len = len(tuple(group))
+        for j in range(group_len):
+            styles.append({'selector': f'.col_heading.level1.col{start + j}', 'props': [('background-color', color)]})
+        start += group_len
+    return styles
+
+
+def style_report(frame: DataFrame):
+    """A Styler for displaying (a slice of) the report frame in a notebook."""
+    num_mask = [x[0] in utilization_groups(frame) for x in frame.columns.to_flat_index()]
+    styler = frame.style.hide_index() \
+        .set_properties(**{'font-weight': 'bold'}, subset=[('Resource', 'resource_name')]) \
+        .format('{:.1f}', subset=num_mask, na_rep='N/A') \
+        .set_table_styles(header_styles(frame.columns))
+    if ('AzMeta', 'annual_savings') in frame.columns:
+        styler = styler.format('${:.2f}', subset=[('AzMeta', 'annual_savings')], na_rep='N/A')
+    css = limit_css(frame)
+    return styler.apply(lambda _: css, axis=None)
+
+
+def write_report(frame: DataFrame, output_dir: str, page_size: int = 500, excel: bool = True, title: str = 'AzMeta Resize Recommendations',
+    summary: Sequence[str] = ()) -> ReportFiles:
+    """Write the report as an index page linking fixed size HTML pages, a Parquet file and optionally an Excel workbook.
+
+    Each output is written a page of rows at a time.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    page_count = max(1, -(-len(frame) // page_size))
+    page_paths = [os.path.join(output_dir, f'page-{i + 1:05d}.html') for i in range(page_count)]
+    parquet_path = os.path.join(output_dir, 'report.parquet')
+    excel_path = os.path.join(output_dir, 'report.xlsx') if excel else None
+
+    flat_columns = [f'{group} | {column}' for group, column in frame.columns]
+    schema = pa.Schema.from_pandas(_flatten(frame, flat_columns), preserve_index=True)
+    bins = limit_bins(frame)
+    stylesheet = _stylesheet(frame.columns)
+    header = _html_header(frame.columns)
+
+    workbook = sheet = None
+    if excel:
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Report')
+        sheet.append(['Resource'] + [group for group, _ in frame.columns])
+        sheet.append(['resource_id'] + [column for _, column in frame.columns])
+
+    with pq.ParquetWriter(parquet_path, schema) as writer:
+        for i, path in enumerate(page_paths):
+            page = frame.iloc[i * page_size:(i + 1) * page_size]
+            writer.write_table(pa.Table.from_pandas(_flatten(page, flat_columns), schema=schema, preserve_index=True))
+            if sheet is not None:
+                for row in page.astype(object).where(page.notna(), None).itertuples(name=None):
+                    sheet.append(list(row))
+            with open(path, 'w', encoding='utf-8') as fd:
+                fd.write(_render_page(page, bins[i * page_size:(i + 1) * page_size], title, stylesheet, header, i, page_count))
+
+    if workbook is not None:
+        workbook.save(excel_path)
+
+    index_path = os.path.join(output_dir, 'index.html')
+    with open(index_path, 'w', encoding='utf-8') as fd:
+        fd.write(_render_index(frame, title, summary, page_paths, page_size, excel_path))
+
+    return ReportFiles(index_path, page_paths, parquet_path, excel_path)
+
+
+def _flatten(frame: DataFrame, flat_columns: List[str]) -> DataFrame:
+    flat = frame.copy(deep=False)
+    flat.columns = flat_columns
+    return flat
+
+
+def _stylesheet(columns: pd.MultiIndex) -> str:
+    rules = [
+        'table { border-collapse: collapse; font-family: sans-serif; font-size: 12px; }',
+        'th, td { padding: 2px 6px; text-align: right; white-space: nowrap; }',
+        'td.text { text-align: left; } td.name { font-weight: bold; }',
+    ]
+    rules.extend(f'td.l{i} {{ background-color: {b}; color: {t}; }}' for i, (b, t) in enumerate(limit_palette()))
+    for style in header_styles(columns):
+        selector = style['selector'].replace('.col_heading', 'th')
+        rules.append(f'{selector} {{ background-color: {style["props"][0][1]}; }}')
+    return '\n'.join(rules)
+
+
+def _html_header(columns: pd.MultiIndex) -> str:
+    groups = []
+    start = 0
+    for group, members in itertools.groupby(columns, lambda c: c[0]):
+        span = len(tuple(members))
+        groups.append(f'<th class="level0 col{start}" colspan="{span}">{html.escape(group)}</th>')
+        start += span
+    fields = ''.join(f'<th class="level1 col{i}">{html.escape(str(c))}</th>' for i, (_, c) in enumerate(columns))
+    return f'<thead><tr>{"".join(groups)}</tr><tr>{fields}</tr></thead>'
+
+
+def _render_page(page: DataFrame, bins: np.ndarray, title: str, stylesheet: str, header: str, page_index: int, page_count: int) -> str:
+    numeric_groups = set(utilization_groups(page))
+    bin_classes = np.array([f' class="l{i}"' for i in range(LIMIT_BINS)] + [''], dtype=object)
+    columns = []
+    for position, (group, column) in enumerate(page.columns):
+        values = page.iloc[:, position]
+        if group in numeric_groups:
+            text, na_text = np.char.mod('%.1f', values.to_numpy(dtype=float)), 'N/A'
+            opens = np.char.add(np.char.add('<td', bin_classes[bins[:, position]].astype(str)), '>')
+        elif (group, column) == ('AzMeta', 'annual_savings'):
+            text, na_text = np.char.mod('$%.2f', values.to_numpy(dtype=float, na_value=np.nan)), 'N/A'
+            opens = np.full(len(page), '<td>')
+        else:
+            text, na_text = np.array([html.escape(str(x)) for x in values.to_numpy(dtype=object)], dtype=str), ''
+            opens = np.full(len(page), '<td class="name">' if column == 'resource_name' else '<td class="text">')
+        columns.append(np.char.add(opens, np.where(values.isna().to_numpy(), na_text, text)))
+
+    body = '\n'.join('<tr>' + '</td>'.join(cells) + '</td></tr>' for cells in zip(*columns))
+    nav = _page_nav(page_index, page_count)
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)} - page {page_index + 1}</title>'
+            f'<style>\n{stylesheet}\n</style></head><body>\n{nav}\n<table>{header}<tbody>\n{body}\n</tbody></table>\n{nav}\n</body></html>\n')
+
+
+def _page_nav(page_index: int, page_count: int) -> str:
+    links = ['<a href="index.html">Index</a>']
+    if page_index > 0:
+        links.append(f'<a href="page-{page_index:05d}.html">Previous</a>')
+    links.append(f'Page {page_index + 1} of {page_count}')
+    if page_index + 1 < page_count:
+        links.append(f'<a href="page-{page_index + 2:05d}.html">Next</a>')
+    return f'<p>{" | ".join(links)}</p>'
+
+
+def _render_index(frame: DataFrame, title: str, summary: Sequence[str], page_paths: List[str], page_size: int, excel_path: Optional[str]) -> str:
+    names = frame[('Resource', 'resource_name')] if ('Resource', 'resource_name') in frame.columns else pd.Series(frame.index, index=frame.index)
+    items = []
+    for i, path in enumerate(page_paths):
+        first = names.iloc[i * page_size] if len(frame) else ''
+        last = names.iloc[min((i + 1) * page_size, len(frame)) - 1] if len(frame) else ''
+        items.append(f'<li><a href="{os.path.basename(path)}">Page {i + 1}</a>: {html.escape(str(first))} to {html.escape(str(last))}</li>')
+    downloads = ['<a href="report.parquet">Parquet</a>']
+    if excel_path:
+        downloads.append(f'<a href="{os.path.basename(excel_path)}">Excel</a>')
+    lines = ''.join(f'<p>{html.escape(x)}</p>' for x in summary)
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title></head><body>\n'
+            f'<h1>{html.escape(title)}</h1>\n{lines}\n<p>{len(frame)} VMs. Download: {" | ".join(downloads)}</p>\n<ol>\n' + '\n'.join(items) + '\n</ol>\n</body></html>\n')
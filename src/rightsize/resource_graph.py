@@ -0,0 +1,193 @@
+"""Resource Graph inventory queries fanned out over subscription batches, paginated, and cached on disk.
+
+Subscriptions are queried in batches concurrently. Each batch is read in pages ordered by resource id, each
+page continuing after the last id of the one before, so no request exceeds the Resource Graph page limit.
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from pandas import DataFrame
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+import pandas as pd
+from .arrow_storage import write_frame, read_frame
+from .normalization import encode_disk_caching
+from .scheduler import retry_throttled
+
+
+# query_dataframe(subscriptions, query) -> DataFrame
+ResourceGraphQuery = Callable[[Sequence[str], str], DataFrame]
+
+
+def vm_resources_query(filters: Optional[str] = None, custom_projections: Optional[str] = None) -> str:
+    """The inventory query of VMs matching ``filters``, projecting their id, subscription, ``custom_projections`` and location.
+
+    The location is projected unless ``custom_projections`` already does.
+    """
+    where = f'| where {filters}' if filters else ''
+    projections = ['resource_id = tolower(id)', 'subscription_id = subscriptionId']
+    if custom_projections:
+        projections.append(custom_projections)
+    if not any(_projected_name(p) == 'location' for p in _split_projections(custom_projections or '')):
+        projections.append('location')
+    return f"Resources | where type =~ 'Microsoft.Compute/virtualMachines' {where} | project {', '.join(projections)}"
+
+
+def _split_projections(projections: str) -> List[str]:
+    # Split on the commas outside of parentheses, brackets and string literals.
+    items, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(projections):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(projections[start:i])
+            start = i + 1
+    items.append(projections[start:])
+    return [p.strip() for p in items if p.strip()]
+
+
+def _projected_name(projection: str) -> str:
+    return projection.split('=', 1)[0].strip() if re.match(r'^\w+\s*=(?!=)', projection) else projection.strip()
+
+
+def fetch_vm_resources(subscriptions: Sequence[str], query: str, query_dataframe: ResourceGraphQuery, batch_size: int = 100,
+    page_size: int = 1000, max_concurrency: int = 4, max_attempts: int = 6, backoff_seconds: float = 2.0, logger=None,
+    sleep: Callable[[float], None] = time.sleep) -> DataFrame:
+    """Run a query projecting ``resource_id`` over every subscription and return the rows in batch order.
+
+    Throttled pages are retried after the Retry-After delay, or an exponential backoff.
+    """
+    def fetch_batch(batch: List[str]) -> DataFrame:
+        pages = []
+        last_id = None
+        while True:
+            after = f"| where strcmp(resource_id, '{last_id}') > 0 " if last_id is not None else ''
+            paged_query = f'{query} {after}| order by resource_id asc | take {page_size}'
+            page = retry_throttled(lambda: query_dataframe(batch, paged_query), f'Resource Graph query of {len(batch)} subscriptions',
+                                   max_attempts, backoff_seconds, logger, sleep)
+            pages.append(page)
+            if len(page) < page_size:
+                break
+            last_id = page.resource_id.iloc[-1]
+        return pd.concat(pages, ignore_index=True)
+
+    result, batches = _fan_out(subscriptions, batch_size, max_concurrency, fetch_batch)
+    if logger:
+        logger.info(f'Fetched {len(result)} resources from {len(subscriptions)} subscriptions in {batches} batches.')
+    return result
+
+
+def _fan_out(subscriptions: Sequence[str], batch_size: int, max_concurrency: int, fetch_batch: Callable[[List[str]], DataFrame]):
+    batches = [list(subscriptions[i:i + batch_size]) for i in range(0, len(subscriptions), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        frames = list(pool.map(fetch_batch, batches))
+    return (pd.concat(frames, ignore_index=True) if frames else DataFrame(columns=['resource_id', 'subscription_id'])), len(batches)
+
+
+def compact_storage_profiles(resources: DataFrame) -> DataFrame:
+    """Replace the nested ``storage_profile`` dicts by their ``disk_caching`` codes."""
+    if 'storage_profile' not in resources.columns:
+        return resources
+    codes: Dict[str, str] = {}
+    disk_caching = []
+    for profile in resources.storage_profile:
+        # Profiles differ per VM only in their disk ids, so most encode to a code seen before.
+        key = json.dumps(profile, sort_keys=True, default=str)
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = encode_disk_caching(profile)
+        disk_caching.append(code)
+    return resources.drop(columns=['storage_profile']).assign(disk_caching=pd.Series(disk_caching, index=resources.index, dtype=object))
+
+
+def change_probe(query: str) -> str:
+    """A cheap query summarizing the inventory of each subscription, to tell whether a snapshot is current.
+
+    Every projected column is hashed, so a resized VM or a changed disk layout changes the digest.
+    """
+    return f'{query} | summarize vms = count(), rows = sum(hash(tostring(pack_all()))) by subscription_id'
+
+
+class ResourceSnapshotCache(object):
+    """The result of an inventory query kept on disk, with the change probe result it was fetched with.
+
+    A snapshot is reused while it is younger than the ttl and the change probe still returns the same VM
+    count and digest of the projected rows for every subscription.
+    """
+
+    def __init__(self, directory: str, subscriptions: Sequence[str], query: str):
+        stem = hashlib.sha1('\n'.join([query] + sorted(subscriptions)).encode()).hexdigest()
+        self._table_path = os.path.join(directory, f'resources.{stem}.arrow')
+        self._manifest_path = os.path.join(directory, f'resources.{stem}.json')
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self._manifest_path) or not os.path.exists(self._table_path):
+            return None
+        with open(self._manifest_path) as fd:
+            return json.load(fd)
+
+    def read(self, probe: Optional[DataFrame], ttl: datetime.timedelta) -> Optional[DataFrame]:
+        """The snapshot if it is current, or None."""
+        manifest = self.read_manifest()
+        if manifest is None:
+            return None
+        if datetime.datetime.utcnow() - datetime.datetime.fromisoformat(manifest['created']) > ttl:
+            return None
+        if probe is not None and manifest['probe'] != probe_records(probe):
+            return None
+        resources = read_frame(self._table_path, writable=True)
+        if manifest['json_columns']:
+            resources = resources.assign(**{c: [json.loads(x) for x in resources[c]] for c in manifest['json_columns']})
+        return resources
+
+    def write(self, resources: DataFrame, probe: DataFrame) -> None:
+        # Nested values, such as uncompacted storage profiles, are kept as JSON text.
+        json_columns = [c for c in resources.columns if resources[c].dtype == object and any(isinstance(x, (dict, list)) for x in resources[c])]
+        table = resources.assign(**{c: [json.dumps(x) for x in resources[c]] for c in json_columns})
+        os.makedirs(os.path.dirname(self._table_path) or '.', exist_ok=True)
+        write_frame(table.reset_index(drop=True), f'{self._table_path}.tmp')
+        os.replace(f'{self._table_path}.tmp', self._table_path)
+        with open(f'{self._manifest_path}.tmp', 'w') as fd:
+            json.dump({'created': datetime.datetime.utcnow().isoformat(), 'resources': len(resources),
+                       'json_columns': json_columns, 'probe': probe_records(probe)}, fd)
+        os.replace(f'{self._manifest_path}.tmp', self._manifest_path)
+
+
+def probe_records(probe: DataFrame) -> List[List[Any]]:
+    columns = ['subscription_id', 'vms', 'rows']
+    return [[str(s), int(v), int(i)] for s, v, i in probe.sort_values('subscription_id')[columns].itertuples(index=False)]
+
+
+def load_vm_resources(subscriptions: Sequence[str], query: str, query_dataframe: ResourceGraphQuery, batch_size: int = 100,
+    page_size: int = 1000, max_concurrency: int = 4, compact: bool = True, snapshot_dir: Optional[str] = None,
+    ttl: datetime.timedelta = datetime.timedelta(hours=24), logger=None) -> DataFrame:
+    """Fetch the inventory, or reuse the snapshot in ``snapshot_dir`` if the inventory has not changed."""
+    cache = probe = None
+    if snapshot_dir:
+        cache = ResourceSnapshotCache(snapshot_dir, subscriptions, f'{query}\ncompact={compact}')
+        probe, _ = _fan_out(subscriptions, batch_size, max_concurrency,
+                            lambda batch: retry_throttled(lambda: query_dataframe(batch, change_probe(query)),
+                                                          f'Resource Graph probe of {len(batch)} subscriptions', logger=logger))
+        snapshot = cache.read(probe, ttl)
+        if snapshot is not None:
+            if logger:
+                logger.info(f'Using the resources snapshot of {len(snapshot)} VMs, the inventory is unchanged.')
+            return snapshot
+
+    resources = fetch_vm_resources(subscriptions, query, query_dataframe, batch_size, page_size, max_concurrency, logger=logger)
+    if compact:
+        resources = compact_storage_profiles(resources)
+    if cache:
+        cache.write(resources, probe)
+    return resources
+
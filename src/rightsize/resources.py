@@ -1,34 +1,42 @@
-from dagster import solid, SolidExecutionContext, Field, Array, String
+from dagster import solid, SolidExecutionContext, Field, Array, String, Int, Bool
 from dagster_pandas import PandasColumn, create_dagster_pandas_dataframe_type
 from pandas import DataFrame
 from typing import Any, Optional, List, TYPE_CHECKING
+import datetime
 from azmeta.access.resource_graph import query_dataframe
+from .instrumentation import instrumented
+from .arrow_storage import with_arrow_storage
+from .resource_graph import load_vm_resources, vm_resources_query
 
 if TYPE_CHECKING:
     ResourcesDataFrame = Any # DataFrame # Pandas has no type info yet.
 else:
-    ResourcesDataFrame = create_dagster_pandas_dataframe_type(
+    ResourcesDataFrame = with_arrow_storage(create_dagster_pandas_dataframe_type(
         name='ResourcesDataFrame',
         columns=[
             PandasColumn.string_column('resource_id'),
             PandasColumn.string_column('subscription_id'),
         ],
-    ) 
+    )) 
 
 
-@solid(config_schema={
+@solid(required_resource_keys={'profiling'}, config_schema={
     'subscriptions': Field(Array(String), description='The subscriptions to query in the Resource Graph.'),
     'filters': Field(String, is_required=False, description='Conditions for a KQL where operator.'),
-    'custom_projections': Field(String, is_required=False, description='Assignments for a KQL project operator.'),
+    'custom_projections': Field(String, is_required=False, description='Assignments for a KQL project operator. The VM location is projected unless these assign it.'),
+    'batch_size': Field(Int, default_value=100, is_required=False, description='Subscriptions per Resource Graph request.'),
+    'page_size': Field(Int, default_value=1000, is_required=False, description='Rows per Resource Graph page.'),
+    'max_concurrency': Field(Int, default_value=4, is_required=False, description='Subscription batches queried at the same time.'),
+    'compact_storage_profile': Field(Bool, default_value=True, is_required=False, description='Keep only the disk caching code of a projected storage_profile.'),
+    'snapshot_dir': Field(String, is_required=False, description='Cache the inventory in this directory and reuse it while unchanged.'),
+    'ttl_hours': Field(Int, default_value=24, is_required=False, description='How long a snapshot is reused.'),
 })
+@instrumented
 def query_vm_resources(context: SolidExecutionContext) -> ResourcesDataFrame:
     config = context.solid_config
-    filters = f'| where {config["filters"]}' if 'filters' in config else ''
-    custom_projections = f', {config["custom_projections"]}' if 'custom_projections' in config else ''
-    
-    query = f"Resources | where type =~ 'Microsoft.Compute/virtualMachines' {filters} | project resource_id = tolower(id), subscription_id = subscriptionId {custom_projections}"
+    query = vm_resources_query(config.get('filters'), config.get('custom_projections'))
 
-    dataframe_result = query_dataframe(config['subscriptions'], query)
-    
-    return dataframe_result
+    return load_vm_resources(config['subscriptions'], query, query_dataframe, config['batch_size'], config['page_size'],
+                             config['max_concurrency'], config['compact_storage_profile'], config.get('snapshot_dir'),
+                             datetime.timedelta(hours=config['ttl_hours']), logger=context.log)
 
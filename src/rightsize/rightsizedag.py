@@ -4,18 +4,22 @@ from .utilization import (
     query_cpu_utilization, normalize_cpu_utilization,
     query_mem_utilization, normalize_mem_utilization,
     query_disk_utilization, normalize_disk_utilization,
+    stream_cpu_utilization, stream_mem_utilization, stream_disk_utilization,
     default_azure_monitor_context
 )
-from .specifications import load_compute_specs
+from .catalogs import load_compute_specs, load_price_catalog
 from .recommended import get_recommendations
-from .right_size import right_size_engine, advisor_validator
-from .output import write_operation_inventory, right_size_report, write_html_report
+from .features import build_vm_features
+from .right_size import build_sku_index, right_size_engine, advisor_validator, fitness_policy_sweep
+from .output import write_operation_inventory, write_paginated_report
+from .instrumentation import solid_profiling
 
-@pipeline(
-    mode_defs=[ModeDefinition(
-        resource_defs={'azure_monitor': default_azure_monitor_context}
-    )]
-)
+MODE_DEFS = [ModeDefinition(
+    resource_defs={'azure_monitor': default_azure_monitor_context, 'profiling': solid_profiling}
+)]
+
+
+@pipeline(mode_defs=MODE_DEFS)
 def rightsize_pipeline():
     vm_resources = query_vm_resources()
     cpu_utilization = query_cpu_utilization(vm_resources)
@@ -27,14 +31,31 @@ def rightsize_pipeline():
     mem_utilization = normalize_mem_utilization(utilization=mem_utilization, compute_specs=compute_specs, resources=vm_resources)
     disk_utilization = normalize_disk_utilization(utilization=disk_utilization, compute_specs=compute_specs, resources=vm_resources)
 
+    _analyze_and_report(vm_resources, cpu_utilization, mem_utilization, disk_utilization, compute_specs)
+
+
+@pipeline(mode_defs=MODE_DEFS)
+def rightsize_streaming_pipeline():
+    """Normalizes each Log Analytics chunk as it arrives instead of after every chunk is queried."""
+    vm_resources = query_vm_resources()
+    compute_specs = load_compute_specs()
+    cpu_utilization = stream_cpu_utilization(resources=vm_resources, compute_specs=compute_specs)
+    mem_utilization = stream_mem_utilization(resources=vm_resources, compute_specs=compute_specs)
+    disk_utilization = stream_disk_utilization(resources=vm_resources)
+
+    _analyze_and_report(vm_resources, cpu_utilization, mem_utilization, disk_utilization, compute_specs)
+
+
+def _analyze_and_report(vm_resources, cpu_utilization, mem_utilization, disk_utilization, compute_specs):
+    price_catalog = load_price_catalog()
     recommendations = get_recommendations()
-    right_size_advisor_analysis = advisor_validator(cpu_utilization=cpu_utilization, mem_utilization=mem_utilization, disk_utilization=disk_utilization, 
-                                                    compute_specs=compute_specs, advisor_recommendations=recommendations, resources=vm_resources)
-    right_size_local_analysis = right_size_engine(cpu_utilization=cpu_utilization, mem_utilization=mem_utilization, disk_utilization=disk_utilization, 
-                                                  compute_specs=compute_specs, resources=vm_resources)                                            
+    features = build_vm_features(cpu_utilization=cpu_utilization, mem_utilization=mem_utilization, disk_utilization=disk_utilization, resources=vm_resources)
+    sku_index = build_sku_index(compute_specs=compute_specs, price_catalog=price_catalog, resources=vm_resources)
+    right_size_advisor_analysis = advisor_validator(features=features, sku_index=sku_index, advisor_recommendations=recommendations)
+    right_size_local_analysis = right_size_engine(features=features, sku_index=sku_index)
+    fitness_policy_sweep(features=features, sku_index=sku_index, advisor_recommendations=recommendations)
     
-    write_operation_inventory(analysis=right_size_local_analysis, resources=vm_resources)
-    report_notebook = right_size_report(advisor_analysis=right_size_advisor_analysis, local_analysis=right_size_local_analysis, resources=vm_resources, 
-                                        compute_specs=compute_specs, cpu_utilization=cpu_utilization, mem_utilization=mem_utilization, 
-                                        disk_utilization=disk_utilization)
-    write_html_report(report_notebook=report_notebook)
\ No newline at end of file
+    write_operation_inventory(analysis=right_size_local_analysis, resources=vm_resources, price_catalog=price_catalog)
+    write_paginated_report(advisor_analysis=right_size_advisor_analysis, local_analysis=right_size_local_analysis, resources=vm_resources, 
+                           compute_specs=compute_specs, price_catalog=price_catalog, cpu_utilization=cpu_utilization, mem_utilization=mem_utilization, 
+                           disk_utilization=disk_utilization)
@@ -0,0 +1,302 @@
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Sequence, TypeVar
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from collections import deque
+from pandas import DataFrame
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import datetime
+import email.utils
+import random
+import time
+from .checkpoints import ChunkCheckpoint
+
+
+T = TypeVar('T')
+
+
+# execute(workspace, rows, builder, timespan) -> DataFrame
+ChunkExecutor = Callable[[str, Sequence[Any], Callable, str], DataFrame]
+# transform(result, rows) -> DataFrame
+ChunkTransform = Callable[[DataFrame, Sequence[Any]], DataFrame]
+
+
+class ThrottledError(Exception):
+    """Raised by a chunk executor when the service asked the caller to back off."""
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__(f'Throttled, retry after {retry_after}s.')
+        self.retry_after = retry_after
+
+
+class ChunkStats(NamedTuple):
+    workspace: str
+    resources: int
+    rows: int
+    bytes: int
+    seconds: float
+    attempts: int
+    transform_seconds: float = 0.0
+    status: str = 'queried'
+
+
+class _Chunk(NamedTuple):
+    sequence: int
+    workspace: str
+    rows: List[Any]
+    attempt: int
+
+
+class ColumnarAccumulator(object):
+    """Collects chunk frames as columns and concatenates them in chunk order.
+
+    Each column is concatenated and its parts released in turn, so building the frame needs memory for the
+    parts plus one column rather than a second copy of every chunk. Column dtypes, categoricals included,
+    are kept. Every chunk with rows must have the columns of the first.
+    """
+
+    def __init__(self):
+        self._parts: Dict[int, Dict[str, pd.Series]] = {}
+        self._columns: Optional[List[str]] = None
+        self._empty: Optional[DataFrame] = None
+
+    def add(self, sequence: int, frame: DataFrame) -> None:
+        if self._empty is None or len(frame.columns) > len(self._empty.columns):
+            self._empty = frame.iloc[:0]  # Only used when every chunk is empty.
+        if not len(frame):
+            return
+        if self._columns is None:
+            self._columns = list(frame.columns)
+        elif set(frame.columns) != set(self._columns):
+            raise ValueError(f'Chunk {sequence} has columns {list(frame.columns)}, expected {self._columns}.')
+        self._parts[sequence] = {c: frame[c].reset_index(drop=True) for c in frame.columns}
+
+    def to_frame(self) -> DataFrame:
+        if not self._parts:
+            return DataFrame() if self._empty is None else self._empty.reset_index(drop=True)
+        order = sorted(self._parts)
+        columns = {c: _concat_column([self._parts[k].pop(c) for k in order]) for c in self._columns}
+        self._parts.clear()
+        return DataFrame(columns, columns=self._columns)
+
+
+def _concat_column(parts: List[pd.Series]) -> pd.Series:
+    if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+        # Chunks have their own categories, which concat would turn into object values.
+        return pd.Series(union_categoricals([p.array for p in parts]), name=parts[0].name)
+    return pd.concat(parts, ignore_index=True)
+
+
+class _WorkspaceQueue(object):
+    def __init__(self, workspace: str, chunk_size: int):
+        self.workspace = workspace
+        self.chunk_size = chunk_size
+        self.pending: Deque[Any] = deque()
+        self.retries: Deque[_Chunk] = deque()
+        self.not_before = 0.0
+
+    def has_work(self) -> bool:
+        return bool(self.pending or self.retries)
+
+
+class QueryScheduler(object):
+    """Run Log Analytics chunk queries with bounded concurrency.
+
+    Chunks are taken round-robin across workspaces so every workspace is queried in parallel. A throttled
+    chunk is retried after the Retry-After delay, or an exponential backoff, and halves the chunk size of its
+    workspace. With adaptive chunking each workspace resizes its chunks toward the target latency and row
+    count observed so far.
+
+    The chunks in flight are limited by an additive increase, multiplicative decrease window: a throttle
+    halves the window, and each successful chunk grows it by one chunk per window, up to ``max_concurrency``.
+    So a service that admits fewer concurrent queries than ``max_concurrency`` settles near its own limit.
+    """
+
+    def __init__(self, execute: ChunkExecutor, max_concurrency: int = 8, chunk_size: int = 32, adaptive: bool = True,
+        min_chunk_size: int = 4, max_chunk_size: int = 256, target_seconds: float = 30.0, target_rows: int = 200_000,
+        max_attempts: int = 6, backoff_seconds: float = 2.0, logger=None, sleep: Callable[[float], None] = time.sleep):
+        self._execute = execute
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.adaptive = adaptive
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_seconds = target_seconds
+        self.target_rows = target_rows
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._logger = logger
+        self._sleep = sleep
+        self.stats: List[ChunkStats] = []
+        self.in_flight_limit = float(max_concurrency)
+
+    def run(self, resources: DataFrame, workspace_of: Callable[[Any], str], builder: Callable, timespan: str,
+        transform: Optional[ChunkTransform] = None, checkpoint: Optional[ChunkCheckpoint] = None) -> DataFrame:
+        """Query every resource and return the results in chunk order.
+
+        ``transform`` is applied to each chunk's result on the worker that queried it, as soon as it arrives,
+        so only the transformed results are kept and transforming overlaps with the chunks still in flight.
+        With a ``checkpoint`` each queried chunk's result is saved before it is transformed, and resources
+        whose results were saved by an earlier run are not queried again.
+        """
+        frames = ColumnarAccumulator()
+        sequence = 0
+        restored = set()
+        for chunk in checkpoint.restore(resources.resource_id) if checkpoint else []:
+            frames.add(sequence, transform(chunk.frame, list(resources[resources.resource_id.isin(chunk.resource_ids)].itertuples()))
+                       if transform else chunk.frame)
+            self.stats.append(ChunkStats(chunk.workspace, len(chunk.resource_ids), len(chunk.frame), 
+                                         int(chunk.frame.memory_usage(index=False).sum()), 0.0, 0, status='restored'))
+            restored.update(chunk.resource_ids)
+            sequence += 1
+        if restored and self._logger:
+            self._logger.info(f'Restored {len(restored)} resources in {sequence} chunks from checkpoint {checkpoint.directory}.')
+
+        queues: Dict[str, _WorkspaceQueue] = {}
+        for row in resources.itertuples():
+            if row.resource_id in restored:
+                continue
+            workspace = workspace_of(row)
+            queue = queues.get(workspace)
+            if queue is None:
+                queue = queues[workspace] = _WorkspaceQueue(workspace, self.chunk_size)
+            queue.pending.append(row)
+
+        in_flight: Dict[Future, _Chunk] = {}
+        order = list(queues.values())
+        self.in_flight_limit = float(self.max_concurrency)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while in_flight or any(q.has_work() for q in order):
+                now = time.monotonic()
+                submitted = True
+                while submitted and len(in_flight) < int(self.in_flight_limit):
+                    submitted = False
+                    for queue in order:
+                        if len(in_flight) >= int(self.in_flight_limit):
+                            break
+                        if not queue.has_work() or queue.not_before > now:
+                            continue
+                        if queue.retries:
+                            chunk = queue.retries.popleft()
+                        else:
+                            take = min(queue.chunk_size, len(queue.pending))
+                            chunk = _Chunk(sequence, queue.workspace, [queue.pending.popleft() for _ in range(take)], 1)
+                            sequence += 1
+                        in_flight[pool.submit(self._timed_execute, chunk, builder, timespan, transform, checkpoint)] = chunk
+                        submitted = True
+
+                if not in_flight:
+                    waiting = [q.not_before for q in order if q.has_work()]
+                    self._sleep(max(0.0, min(waiting) - time.monotonic()))
+                    continue
+
+                done, _ = wait(list(in_flight), timeout=self._next_wake(order), return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = in_flight.pop(future)
+                    self._complete(chunk, future, queues[chunk.workspace], frames)
+
+        return frames.to_frame()
+
+    def _timed_execute(self, chunk: _Chunk, builder: Callable, timespan: str, transform: Optional[ChunkTransform],
+        checkpoint: Optional[ChunkCheckpoint]):
+        start = time.monotonic()
+        frame = self._execute(chunk.workspace, chunk.rows, builder, timespan)
+        seconds = time.monotonic() - start
+        if checkpoint:
+            checkpoint.save(chunk.workspace, [r.resource_id for r in chunk.rows], frame)
+        rows, size = len(frame), int(frame.memory_usage(index=False).sum())
+        if transform is None:
+            return frame, rows, size, seconds, 0.0
+        frame = transform(frame, chunk.rows)
+        return frame, rows, size, seconds, time.monotonic() - start - seconds
+
+    def _complete(self, chunk: _Chunk, future: Future, queue: _WorkspaceQueue, frames: ColumnarAccumulator) -> None:
+        try:
+            frame, rows, size, seconds, transform_seconds = future.result()
+        except Exception as e:
+            retry_after = throttle_delay(e)
+            if retry_after is None or chunk.attempt >= self.max_attempts:
+                self.stats.append(ChunkStats(chunk.workspace, len(chunk.rows), 0, 0, 0.0, chunk.attempt, status='failed'))
+                if self._logger:
+                    self._logger.error(f'Workspace {chunk.workspace} chunk of {len(chunk.rows)} resources failed after {chunk.attempt} attempts, '
+                                       f'{chunk_status_counts(self.stats)}.')
+                raise
+            delay = retry_after if retry_after > 0 else self.backoff_seconds * 2 ** (chunk.attempt - 1) * (1 + random.random())
+            if self._logger:
+                self._logger.warning(f'Workspace {chunk.workspace} throttled, retrying {len(chunk.rows)} resources in {delay:.1f}s.')
+            queue.not_before = max(queue.not_before, time.monotonic() + delay)
+            queue.chunk_size = max(self.min_chunk_size, queue.chunk_size // 2)
+            self.in_flight_limit = max(1.0, self.in_flight_limit / 2)
+            queue.retries.append(chunk._replace(attempt=chunk.attempt + 1))
+            return
+
+        frames.add(chunk.sequence, frame)
+        stats = ChunkStats(chunk.workspace, len(chunk.rows), rows, size, seconds, chunk.attempt, transform_seconds)
+        self.stats.append(stats)
+        self.in_flight_limit = min(float(self.max_concurrency), self.in_flight_limit + 1 / self.in_flight_limit)
+        if self.adaptive:
+            queue.chunk_size = self._adapt(queue.chunk_size, stats)
+
+    def _adapt(self, chunk_size: int, stats: ChunkStats) -> int:
+        per_resource_seconds = stats.seconds / stats.resources
+        per_resource_rows = max(stats.rows, 1) / stats.resources
+        estimate = min(self.target_seconds / per_resource_seconds if per_resource_seconds > 0 else self.max_chunk_size,
+                       self.target_rows / per_resource_rows)
+        # Move halfway toward the estimate to damp noisy latencies.
+        adapted = int((chunk_size + estimate) / 2)
+        return max(self.min_chunk_size, min(self.max_chunk_size, adapted))
+
+    @staticmethod
+    def _next_wake(queues: Sequence[_WorkspaceQueue]) -> Optional[float]:
+        waiting = [q.not_before for q in queues if q.has_work() and q.not_before > time.monotonic()]
+        return max(0.0, min(waiting) - time.monotonic()) if waiting else None
+
+
+def chunk_status_counts(stats: Sequence[ChunkStats]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for s in stats:
+        counts[s.status] = counts.get(s.status, 0) + 1
+    return counts
+
+
+def throttle_delay(error: Exception) -> Optional[float]:
+    """The seconds to wait before retrying a throttled request, 0 for the default backoff or None if not throttled.
+
+    Understands the HTTP errors of the Azure SDK and requests, which carry the response, and of urllib. The
+    Retry-After header may be a number of seconds or an HTTP date.
+    """
+    if isinstance(error, ThrottledError):
+        return error.retry_after or 0.0
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    if status not in (429, 503):
+        return None
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+    retry_after = headers.get('Retry-After')
+    if not retry_after:
+        return 0.0
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (email.utils.parsedate_to_datetime(retry_after) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def retry_throttled(call: Callable[[], T], description: str, max_attempts: int = 6, backoff_seconds: float = 2.0, logger=None,
+    sleep: Callable[[float], None] = time.sleep) -> T:
+    """Call until it is not throttled, waiting the Retry-After delay or an exponential backoff in between."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return call()
+        except Exception as e:
+            retry_after = throttle_delay(e)
+            if retry_after is None or attempt >= max_attempts:
+                raise
+            delay = retry_after if retry_after > 0 else backoff_seconds * 2 ** (attempt - 1) * (1 + random.random())
+            if logger:
+                logger.warning(f'{description} throttled, retrying in {delay:.1f}s.')
+            sleep(delay)
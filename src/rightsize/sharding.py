@@ -0,0 +1,74 @@
+"""Memory-mapped arrays shared with worker processes, and the assignment of VMs to shards.
+
+Workers open the arrays read-only from files written once by the parent, so the SKU tables and VM
+requirements are paged in from the page cache instead of pickled to every process.
+"""
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+import os
+import numpy as np
+import pandas as pd
+from .fitness import SkuIndex, FitnessSelection, cheapest_fit, frontiers_at
+
+
+class SharedArray(NamedTuple):
+    path: str
+    dtype: str
+    shape: Tuple[int, ...]
+
+    def open(self) -> np.ndarray:
+        if 0 in self.shape:
+            return np.empty(self.shape, dtype=self.dtype)  # A zero length file cannot be mapped.
+        return np.memmap(self.path, dtype=self.dtype, mode='r', shape=self.shape)
+
+
+def share(directory: str, name: str, array: np.ndarray) -> SharedArray:
+    """Write an array to ``directory`` for workers to map."""
+    array = np.ascontiguousarray(array)
+    shared = SharedArray(os.path.join(directory, f'{name}.bin'), array.dtype.str, array.shape)
+    array.tofile(shared.path)
+    return shared
+
+
+class SharedSkuIndex(NamedTuple):
+    """The arrays of a ``SkuIndex`` the cheapest fit search uses, with the candidate names for the results."""
+    names: List[str]
+    costs: SharedArray
+    capabilities: SharedArray
+    frontier: SharedArray
+    memory_frontiers: Dict[float, SharedArray]
+
+    def select_cheapest_fit(self, requirements: np.ndarray, current_costs: np.ndarray, current_memory_gb: np.ndarray) -> FitnessSelection:
+        capabilities = self.capabilities.open()
+        frontier, memory_frontiers = frontiers_at(capabilities, self.frontier.open(), {m: p.open() for m, p in self.memory_frontiers.items()})
+        return cheapest_fit(self.costs.open(), capabilities, frontier, memory_frontiers, requirements, current_costs, current_memory_gb)
+
+
+def share_sku_index(directory: str, name: str, sku_index: SkuIndex) -> SharedSkuIndex:
+    candidates = sku_index.candidates
+    return SharedSkuIndex(
+        names=[s.name for s in candidates.skus],
+        costs=share(directory, f'{name}-costs', candidates.costs),
+        capabilities=share(directory, f'{name}-capabilities', candidates.capabilities),
+        frontier=share(directory, f'{name}-frontier', sku_index.frontier.positions),
+        memory_frontiers={m: share(directory, f'{name}-frontier-{i}', f.positions) for i, (m, f) in enumerate(sku_index.memory_frontiers.items())},
+    )
+
+
+def shard_assignments(resource_ids: Sequence[str], shards: int, by: str = 'hash') -> np.ndarray:
+    """The shard of each resource, from a stable hash of its id or of its subscription id.
+
+    Sharding by subscription keeps a subscription's VMs together, at the cost of uneven shards.
+    """
+    if by not in ('hash', 'subscription'):
+        raise ValueError(f'Unknown shard key {by}, expected hash or subscription.')
+    keys = pd.Series(np.asarray(resource_ids, dtype=object))
+    if by == 'subscription':
+        keys = keys.str.extract(r'^/subscriptions/([^/]+)', expand=False).fillna(keys)
+    return (pd.util.hash_pandas_object(keys, index=False).to_numpy() % np.uint64(max(1, shards))).astype(np.int64)
+
+
+def shard_bounds(assignments: np.ndarray, shards: int) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    """A stable order grouping the VMs by shard, and the [start, stop) range of each non-empty shard in it."""
+    order = np.argsort(assignments, kind='stable')
+    edges = np.searchsorted(assignments[order], np.arange(shards + 1))
+    return order, [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
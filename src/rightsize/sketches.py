@@ -0,0 +1,211 @@
+"""Mergeable per-day quantile sketches of performance counters.
+
+Each counter value is counted in a logarithmic bucket (the DDSketch scheme) so a day of samples for a
+resource reduces to a handful of (sign, bucket, count) rows. Buckets from any set of days merge by adding
+counts. A quantile read from merged buckets is within ``relative_accuracy`` of the true sample value at
+rank ``q * (samples - 1)``; ``max`` and ``samples`` are exact.
+"""
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+from pandas import DataFrame
+import datetime
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+
+QUANTILES = (
+    ('percentile_50th', 0.50),
+    ('percentile_80th', 0.80),
+    ('percentile_90th', 0.90),
+    ('percentile_95th', 0.95),
+    ('percentile_99th', 0.99),
+)
+BUCKET_DTYPES = {'sign': 'int8', 'bucket': 'int32', 'count': 'int64', 'max': 'float64'}
+BUCKET_COLUMNS = list(BUCKET_DTYPES)
+
+
+class SketchCounterSpec(NamedTuple):
+    key: str
+    object_name: str
+    counter_names: Tuple[str, ...]
+    instance_name: Optional[str] = None
+    value_expression: Optional[str] = None
+    by_instance: bool = False
+
+    @property
+    def group_columns(self) -> List[str]:
+        return ['resource_id', 'instance_name', 'counter_name'] if self.by_instance else ['resource_id']
+
+
+def gamma(relative_accuracy: float) -> float:
+    return (1 + relative_accuracy) / (1 - relative_accuracy)
+
+
+def build_sketch_query(resource_ids: Sequence[str], spec: SketchCounterSpec, start: datetime.date, end: datetime.date, relative_accuracy: float) -> str:
+    """Build a KQL query returning the daily bucket counts of a counter for the resources over [start, end)."""
+    ids = ', '.join(f"'{x}'" for x in resource_ids)
+    counters = ', '.join(f"'{x}'" for x in spec.counter_names)
+    if spec.by_instance:
+        instance_filter = "| where InstanceName matches regex '^[A-Za-z]:$'"
+        by = 'resource_id = tolower(_ResourceId), instance_name = InstanceName, counter_name = CounterName'
+    else:
+        instance_filter = f"| where InstanceName == '{spec.instance_name}'" if spec.instance_name else ''
+        by = 'resource_id = tolower(_ResourceId)'
+    return f"""Perf
+| where TimeGenerated >= datetime({start.isoformat()}) and TimeGenerated < datetime({end.isoformat()})
+| where _ResourceId in~ ({ids})
+| where ObjectName == '{spec.object_name}' and CounterName in ({counters})
+{instance_filter}
+| extend value = CounterValue
+| extend value = {spec.value_expression or 'value'}
+| extend ['sign'] = toint(sign(value)), magnitude = abs(value)
+| extend bucket = iff(magnitude < 1e-9, 0, toint(ceiling(log(magnitude) / log({gamma(relative_accuracy)!r}))))
+| extend ['sign'] = iff(magnitude < 1e-9, 0, ['sign'])
+| summarize ['count'] = count(), ['max'] = max(value) by {by}, day = startofday(TimeGenerated), ['sign'], bucket"""
+
+
+def sketch_quantiles(buckets: DataFrame, group_columns: List[str], relative_accuracy: float) -> DataFrame:
+    """Merge bucket counts over days and read the utilization percentiles, max and samples of each group."""
+    columns = group_columns + [c for c, _ in QUANTILES] + ['max', 'samples']
+    if buckets.empty:
+        return DataFrame(columns=columns)
+
+    g = gamma(relative_accuracy)
+    buckets = buckets.astype(BUCKET_DTYPES)
+    merged = buckets.groupby(group_columns + ['sign', 'bucket'], sort=False).agg(count=('count', 'sum'), max=('max', 'max')).reset_index()
+    merged['value'] = merged.sign * 2 * np.power(g, merged.bucket.astype(float)) / (g + 1)
+    merged = merged.sort_values(group_columns + ['value'], kind='mergesort')
+
+    grouped = merged.groupby(group_columns, sort=True)
+    result = grouped.agg(max=('max', 'max'), samples=('count', 'sum'))
+    cumulative = grouped['count'].cumsum()
+    total = grouped['count'].transform('sum')
+    for column, q in QUANTILES:
+        # The bucket holding the sample of zero based rank q * (n - 1).
+        holds_rank = cumulative > q * (total - 1)
+        result[column] = merged[holds_rank].groupby(group_columns, sort=True).value.first()
+        result[column] = result[column].clip(upper=result['max'])
+
+    return result.reset_index()[columns]
+
+
+def lookback_days(lookback_duration: str, today: Optional[datetime.date] = None) -> List[datetime.date]:
+    """The complete UTC days covered by an ISO 8601 day duration such as P30D, oldest first."""
+    match = re.fullmatch(r'P(\d+)D', lookback_duration)
+    if not match:
+        raise ValueError(f'Sketch lookback must be a whole number of days (PnD), got {lookback_duration}.')
+    today = today or datetime.datetime.utcnow().date()
+    count = int(match.group(1))
+    return [today - datetime.timedelta(days=count - i) for i in range(count)]
+
+
+def contiguous_runs(days: Iterable[datetime.date]) -> List[Tuple[datetime.date, datetime.date]]:
+    """Group days into [start, end) runs of consecutive days."""
+    runs: List[Tuple[datetime.date, datetime.date]] = []
+    for day in sorted(days):
+        if runs and runs[-1][1] == day:
+            runs[-1] = (runs[-1][0], day + datetime.timedelta(days=1))
+        else:
+            runs.append((day, day + datetime.timedelta(days=1)))
+    return runs
+
+
+# How long after a day ends its late samples may still arrive in Log Analytics.
+DEFAULT_INGESTION_DELAY = datetime.timedelta(hours=6)
+
+
+class SketchStore(object):
+    """Daily bucket counts per counter on disk, with the set of resources each day has been queried for.
+
+    A day is only marked covered once it ended more than ``ingestion_delay`` ago, so a day queried while its
+    samples may still be arriving is queried again by the next run. With ``retention_days`` the days older
+    than that many days before today are deleted on write.
+    """
+
+    def __init__(self, root: str, retention_days: Optional[int] = None, ingestion_delay: datetime.timedelta = DEFAULT_INGESTION_DELAY):
+        self.root = root
+        self.retention_days = retention_days
+        self.ingestion_delay = ingestion_delay
+
+    def _path(self, counter_key: str, day: datetime.date, suffix: str) -> str:
+        return os.path.join(self.root, counter_key, f'{day.isoformat()}.{suffix}')
+
+    def covered(self, counter_key: str, day: datetime.date) -> Set[str]:
+        path = self._path(counter_key, day, 'covered.json')
+        if not os.path.exists(path):
+            return set()
+        with open(path) as fd:
+            return set(json.load(fd))
+
+    def missing(self, counter_key: str, days: Sequence[datetime.date], resource_ids: Iterable[str]) -> Tuple[Set[str], List[datetime.date]]:
+        """The resources and days that must be queried so every resource is covered on every day."""
+        resource_ids = set(resource_ids)
+        missing_ids: Set[str] = set()
+        missing_days = []
+        for day in days:
+            uncovered = resource_ids - self.covered(counter_key, day)
+            if uncovered:
+                missing_ids |= uncovered
+                missing_days.append(day)
+        return missing_ids, missing_days
+
+    def read(self, counter_key: str, days: Sequence[datetime.date], resource_ids: Iterable[str]) -> DataFrame:
+        frames = [pd.read_parquet(self._path(counter_key, d, 'parquet')) for d in days if os.path.exists(self._path(counter_key, d, 'parquet'))]
+        if not frames:
+            return DataFrame()
+        buckets = pd.concat(frames, ignore_index=True)
+        return buckets[buckets.resource_id.isin(set(resource_ids))]
+
+    def write(self, counter_key: str, day: datetime.date, buckets: DataFrame, resource_ids: Iterable[str],
+        now: Optional[datetime.datetime] = None) -> None:
+        """Replace the stored buckets of the queried resources for a day, and mark them covered if the day is complete."""
+        now = now or datetime.datetime.utcnow()
+        resource_ids = set(resource_ids)
+        buckets = buckets.astype(BUCKET_DTYPES)
+        os.makedirs(os.path.join(self.root, counter_key), exist_ok=True)
+        path = self._path(counter_key, day, 'parquet')
+        if os.path.exists(path):
+            existing = pd.read_parquet(path)
+            buckets = pd.concat([existing[~existing.resource_id.isin(resource_ids)], buckets], ignore_index=True)
+        _replace(path, lambda p: buckets.to_parquet(p, index=False))
+        if self.complete(day, now):
+            covered = sorted(self.covered(counter_key, day) | resource_ids)
+            _replace(self._path(counter_key, day, 'covered.json'), lambda p: _write_json(p, covered))
+        if self.retention_days is not None:
+            self.prune(counter_key, now.date() - datetime.timedelta(days=self.retention_days))
+
+    def complete(self, day: datetime.date, now: datetime.datetime) -> bool:
+        """Whether every sample of the UTC day has been ingested by ``now``."""
+        return now - datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()) >= self.ingestion_delay
+
+    def prune(self, counter_key: str, oldest: datetime.date) -> int:
+        """Delete the days before ``oldest`` and return how many were deleted."""
+        directory = os.path.join(self.root, counter_key)
+        days = {name.split('.', 1)[0] for name in os.listdir(directory)} if os.path.isdir(directory) else set()
+        expired = [d for d in days if re.fullmatch(r'\d{4}-\d{2}-\d{2}', d) and datetime.date.fromisoformat(d) < oldest]
+        for d in expired:
+            for suffix in ('parquet', 'covered.json'):
+                path = self._path(counter_key, datetime.date.fromisoformat(d), suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        return len(expired)
+
+
+def split_days(result: DataFrame) -> Iterable[Tuple[datetime.date, DataFrame]]:
+    if result.empty:
+        return []
+    days = pd.to_datetime(result['day'], utc=True).dt.date
+    return ((day, frame.drop(columns=['day'])) for day, frame in result.groupby(days.to_numpy()))
+
+
+def _write_json(path: str, value) -> None:
+    with open(path, 'w') as fd:
+        json.dump(value, fd)
+
+
+def _replace(path: str, write) -> None:
+    temp_path = f'{path}.tmp'
+    write(temp_path)
+    os.replace(temp_path, path)
@@ -1,15 +1,151 @@
-from dagster import solid, SolidExecutionContext, Field, Array, String, PythonObjectDagsterType, make_python_type_usable_as_dagster_type
-from typing import Any, Optional, List, TYPE_CHECKING
-from azmeta.access.specifications import AzureComputeSpecifications, load_compute_specifications
+from typing import Any, Optional, List, TYPE_CHECKING, Dict, Iterable, NamedTuple
+from types import SimpleNamespace
+from pandas import DataFrame
+import pandas as pd
+import datetime
+import hashlib
+import json
+import os
+import threading
 
+if TYPE_CHECKING:
+    from azmeta.access.specifications import AzureComputeSpecifications
 
-AzureComputeSpecificationsDagsterType = PythonObjectDagsterType(AzureComputeSpecifications)
-make_python_type_usable_as_dagster_type(AzureComputeSpecifications, AzureComputeSpecificationsDagsterType)
 
+class SnapshotSku(NamedTuple):
+    name: str
+    family: str
+    capabilities: SimpleNamespace
 
-@solid(config_schema={
-    'subscription': Field(String, is_required=False, description='The subscription ID to list SKUs from.')
-})
-def load_compute_specs(context: SolidExecutionContext) -> AzureComputeSpecifications:
-    return load_compute_specifications(logger=context.log)
 
+class ComputeSpecificationsSnapshot(object):
+    """Compute specifications loaded from a local snapshot, usable anywhere AzureComputeSpecifications is."""
+
+    def __init__(self, table: DataFrame, version: str, created: datetime.datetime):
+        self.version = version
+        self.created = created
+        capability_columns = [c for c in table.columns if c not in ('name', 'family')]
+        self._skus = [
+            SnapshotSku(r['name'], r['family'], SimpleNamespace(**{c: _from_cell(r[c]) for c in capability_columns}))
+            for r in table.to_dict('records')
+        ]
+        self._by_name = {s.name.lower(): s for s in self._skus}
+
+    @property
+    def virtual_machine_skus(self) -> List[SnapshotSku]:
+        return self._skus
+
+    def virtual_machine_by_name(self, name: str) -> SnapshotSku:
+        return self._by_name[name.lower()]
+
+
+# The capabilities read by name by the normalization, engine, pricing and report. Some are properties
+# derived by azmeta rather than fields, so they are read with getattr rather than from vars().
+SNAPSHOT_CAPABILITIES = (
+    'parent_size', 'vcpus', 'd_vcpus_available', 'd_total_acus', 'memory_gb',
+    'combined_temp_disk_and_cached_iops', 'combined_temp_disk_and_cached_read_bytes_per_second',
+    'uncached_disk_iops', 'uncached_disk_bytes_per_second',
+)
+
+
+class SpecificationsSnapshotCache(object):
+    """A columnar snapshot of the compute specifications, in a file named by a subscription and region label.
+
+    The labels only keep snapshots taken for different configurations apart. The SKU list is downloaded as
+    azmeta lists it, and the snapshot's content version identifies what it holds.
+    """
+
+    def __init__(self, directory: str, subscription: Optional[str] = None, region: Optional[str] = None):
+        stem = f'compute_specs.{subscription or "default"}.{region or "all"}'
+        self._table_path = os.path.join(directory, f'{stem}.parquet')
+        self._manifest_path = os.path.join(directory, f'{stem}.json')
+        self.refresh_thread: Optional[threading.Thread] = None
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self._manifest_path) or not os.path.exists(self._table_path):
+            return None
+        with open(self._manifest_path) as fd:
+            return json.load(fd)
+
+    def read(self) -> Optional[ComputeSpecificationsSnapshot]:
+        manifest = self.read_manifest()
+        if manifest is None:
+            return None
+        created = datetime.datetime.fromisoformat(manifest['created'])
+        return ComputeSpecificationsSnapshot(pd.read_parquet(self._table_path), manifest['version'], created)
+
+    def write(self, specs: 'AzureComputeSpecifications') -> str:
+        table = specifications_table(specs)
+        version = table_version(table)
+        os.makedirs(os.path.dirname(self._table_path) or '.', exist_ok=True)
+        table.to_parquet(f'{self._table_path}.tmp', index=False)
+        os.replace(f'{self._table_path}.tmp', self._table_path)
+        with open(f'{self._manifest_path}.tmp', 'w') as fd:
+            json.dump({'version': version, 'created': datetime.datetime.utcnow().isoformat(), 'skus': len(table)}, fd)
+        os.replace(f'{self._manifest_path}.tmp', self._manifest_path)
+        return version
+
+    def refresh(self, logger=None) -> 'AzureComputeSpecifications':
+        from azmeta.access.specifications import load_compute_specifications
+        specs = load_compute_specifications(logger=logger)
+        version = self.write(specs)
+        if logger:
+            logger.info(f'Wrote compute specifications snapshot {version}.')
+        return specs
+
+    def load(self, ttl: datetime.timedelta, background_refresh: bool = True, offline: bool = False, logger=None):
+        snapshot = self.read()
+        if offline:
+            if snapshot is None:
+                raise Exception(f'No compute specifications snapshot at {self._table_path} for offline mode.')
+            return snapshot
+        if snapshot is None:
+            return self.refresh(logger)
+
+        age = datetime.datetime.utcnow() - snapshot.created
+        if age <= ttl:
+            return snapshot
+        if not background_refresh:
+            return self.refresh(logger)
+
+        if logger:
+            logger.info(f'Compute specifications snapshot is {age} old, refreshing in the background.')
+        # Not a daemon, so the refresh completes even if the run finishes first.
+        self.refresh_thread = threading.Thread(target=self.refresh, kwargs={'logger': logger}, name='compute-specs-refresh')
+        self.refresh_thread.start()
+        return snapshot
+
+
+def specifications_table(specs: 'AzureComputeSpecifications') -> DataFrame:
+    """One row per SKU with its name, family, every scalar capability field and the derived capabilities the engine reads."""
+    rows = []
+    for sku in specs.virtual_machine_skus:
+        row = {'name': sku.name, 'family': sku.family}
+        row.update((k, v) for k, v in _capability_fields(sku.capabilities).items() if v is None or isinstance(v, (str, int, float, bool)))
+        row.update((k, getattr(sku.capabilities, k)) for k in SNAPSHOT_CAPABILITIES)
+        rows.append(row)
+    return DataFrame(rows).sort_values('name', kind='mergesort').reset_index(drop=True)
+
+
+def table_version(table: DataFrame) -> str:
+    return hashlib.sha1(pd.util.hash_pandas_object(table.astype(str), index=False).to_numpy().tobytes()).hexdigest()[:16]
+
+
+def specifications_version(specs: 'AzureComputeSpecifications') -> str:
+    """A content hash identifying a set of compute specifications."""
+    version = getattr(specs, 'version', None)
+    return version if version else table_version(specifications_table(specs))
+
+
+def _capability_fields(capabilities) -> Dict[str, Any]:
+    if hasattr(capabilities, '_asdict'):
+        return dict(capabilities._asdict())
+    return dict(vars(capabilities))
+
+
+def _from_cell(value):
+    if isinstance(value, float) and value != value:
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
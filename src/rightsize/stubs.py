@@ -0,0 +1,132 @@
+"""Local stand-ins for the Azure services the pipeline queries, for tests and benchmarks."""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from types import SimpleNamespace
+from pandas import DataFrame
+import datetime
+import json
+import pandas as pd
+import re
+import threading
+import time
+import zlib
+from .scheduler import ThrottledError
+
+
+class StubLogAnalytics(object):
+    """A chunk executor that answers from canned per-resource results.
+
+    Every call sleeps ``latency + per_resource_latency * len(rows)`` seconds. Calls fail with a
+    :class:`ThrottledError` carrying ``retry_after`` when ``throttle`` returns true for the 1-based call
+    number, or while more than ``max_concurrent`` calls are in flight.
+    """
+
+    def __init__(self, results: DataFrame, latency: float = 0.0, per_resource_latency: float = 0.0,
+        throttle: Optional[Callable[[int], bool]] = None, retry_after: Optional[float] = None, max_concurrent: Optional[int] = None):
+        self._results = {k: v for k, v in results.groupby('resource_id', sort=False)}
+        self._columns = results.columns
+        self.latency = latency
+        self.per_resource_latency = per_resource_latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.max_concurrent = max_concurrent
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def execute(self, workspace: str, rows: Sequence[Any], builder: Callable, timespan: str) -> DataFrame:
+        with self._lock:
+            self._in_flight += 1
+            call = len(self.calls) + 1
+            throttled = bool(self.throttle and self.throttle(call)) or \
+                        (self.max_concurrent is not None and self._in_flight > self.max_concurrent)
+            self.calls.append({'workspace': workspace, 'resources': len(rows), 'timespan': timespan, 'throttled': throttled})
+        try:
+            if throttled:
+                raise ThrottledError(self.retry_after)
+            time.sleep(self.latency + self.per_resource_latency * len(rows))
+            frames = [self._results[r.resource_id] for r in rows if r.resource_id in self._results]
+            return pd.concat(frames, ignore_index=True) if frames else DataFrame(columns=self._columns)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+class StubResourceGraph(object):
+    """Answers Resource Graph queries with a fixed resources frame, filtered to the requested subscriptions.
+
+    Honors the resource id paging and ``take`` of paged queries, and answers the change probe with each
+    subscription's VM count and a digest of its rows. Calls fail with a :class:`ThrottledError` when
+    ``throttle`` returns true for the 1-based call number.
+    """
+
+    def __init__(self, resources: DataFrame, latency: float = 0.0, throttle: Optional[Callable[[int], bool]] = None):
+        self.resources = resources
+        self.latency = latency
+        self.throttle = throttle
+        self.queries: List[str] = []
+        self._lock = threading.Lock()
+
+    def query_dataframe(self, subscriptions: Sequence[str], query: str) -> DataFrame:
+        with self._lock:
+            self.queries.append(query)
+            throttled = bool(self.throttle and self.throttle(len(self.queries)))
+        if throttled:
+            raise ThrottledError()
+        time.sleep(self.latency)
+        result = self.resources[self.resources.subscription_id.isin(set(subscriptions))]
+        if 'summarize vms = count()' in query:
+            digests = [zlib.crc32(json.dumps(r, sort_keys=True, default=str).encode()) for r in result.to_dict('records')]
+            return DataFrame({'subscription_id': result.subscription_id.to_numpy(), 'digest': digests}).groupby('subscription_id') \
+                .digest.agg(vms='count', rows='sum').reset_index()
+        after = re.search(r"strcmp\(resource_id, '([^']*)'\) > 0", query)
+        if after:
+            result = result[result.resource_id > after.group(1)]
+        if 'order by resource_id' in query:
+            result = result.sort_values('resource_id')
+        take = re.search(r'\| take (\d+)', query)
+        if take:
+            result = result.iloc[:int(take.group(1))]
+        return result.reset_index(drop=True)
+
+
+class StubAdvisor(object):
+    """Answers Advisor resize recommendation requests from a resource id to target SKU mapping.
+
+    Recommendations are last updated at ``last_updated[resource_id]``, or ``updated``. Requests fail with a
+    :class:`ThrottledError` when ``throttle`` returns true for the 1-based request number.
+    """
+
+    def __init__(self, recommendations: Dict[str, str], latency: float = 0.0, last_updated: Optional[Dict[str, datetime.datetime]] = None,
+        updated: datetime.datetime = datetime.datetime(2020, 6, 1, tzinfo=datetime.timezone.utc), throttle: Optional[Callable[[int], bool]] = None):
+        self.recommendations = recommendations
+        self.latency = latency
+        self.last_updated = last_updated or {}
+        self.updated = updated
+        self.throttle = throttle
+        self.requests: List[Sequence[str]] = []
+        self._lock = threading.Lock()
+
+    def load_resize_recommendations(self, subscriptions: Sequence[str]) -> Dict[str, Any]:
+        with self._lock:
+            self.requests.append(subscriptions)
+            throttled = bool(self.throttle and self.throttle(len(self.requests)))
+        if throttled:
+            raise ThrottledError()
+        time.sleep(self.latency)
+        prefixes = tuple(f'/subscriptions/{s}/' for s in subscriptions)
+        return {k: SimpleNamespace(extended_properties={'targetSku': v}, last_updated=self.last_updated.get(k, self.updated))
+                for k, v in self.recommendations.items() if k.startswith(prefixes)}
+
+
+class StubComputeSpecifications(object):
+    """Serves a fixed set of compute specifications in place of the resource SKU list download."""
+
+    def __init__(self, compute_specs, latency: float = 0.0):
+        self.compute_specs = compute_specs
+        self.latency = latency
+        self.loads = 0
+
+    def load_compute_specifications(self, logger=None):
+        self.loads += 1
+        time.sleep(self.latency)
+        return self.compute_specs
@@ -0,0 +1,79 @@
+"""Evaluate many fitness policies over a fleet at once, for what-if comparisons of savings and Advisor validity.
+
+The current prices, SKU tables and Advisor SKU capabilities are computed once. The requirements of every
+policy are stacked and searched in one cheapest fit pass per region, in batches bounded by ``max_rows``.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from pandas import DataFrame
+import itertools
+import numpy as np
+import pandas as pd
+from .fitness import FitnessPolicy, DEFAULT_POLICY, RegionalSkuIndex, build_requirements
+from .engine import current_prices
+
+
+SWEEP_COLUMNS = ['vms_evaluated', 'resizable', 'annual_savings', 'advised', 'advisor_valid']
+
+
+def policy_grid(**values: Iterable[float]) -> List[FitnessPolicy]:
+    """Every combination of the given threshold values, the other thresholds as in the default policy.
+
+    For example ``policy_grid(cpu_p99=[0.8, 0.9], memory_p99=[1.0, 1.05])`` is four policies.
+    """
+    unknown = set(values) - set(FitnessPolicy._fields)
+    if unknown:
+        raise ValueError(f'Unknown fitness thresholds {", ".join(sorted(unknown))}, expected some of {", ".join(FitnessPolicy._fields)}.')
+    names = list(values)
+    return [DEFAULT_POLICY._replace(**dict(zip(names, combination))) for combination in itertools.product(*(list(values[n]) for n in names))]
+
+
+def sweep_policies(features: DataFrame, sku_index: RegionalSkuIndex, policies: Sequence[FitnessPolicy], logger,
+    advisor_recommendations: Optional[Dict[str, str]] = None, max_rows: int = 2_000_000) -> DataFrame:
+    """One row per policy with its thresholds, the VMs evaluated and resizable, their annual savings, and how
+    many Advisor recommendations it validates.
+
+    Each policy's results match running the engine and the Advisor validator with that policy.
+    """
+    policies = list(policies)
+    totals = np.zeros((len(policies), len(SWEEP_COLUMNS)))
+    evaluated = features[features.complete.to_numpy()]
+    regions = np.array([sku_index.region_of(x) for x in evaluated.location.to_numpy(dtype=object)], dtype=object)
+    for region in pd.unique(regions):
+        if region not in sku_index.regions:
+            continue
+        region_index = sku_index.regions[region]
+        vms = evaluated[regions == region]
+        priced, current_costs, current_memory_gb = current_prices(vms, region_index, logger)
+        vms, current_costs, current_memory_gb = vms[priced], current_costs[priced], current_memory_gb[priced]
+        names = np.array([s.name for s in region_index.candidates.skus], dtype=object)
+        vm_sizes = vms.vm_size.to_numpy(dtype=object)
+        for batch in _batches(len(policies), len(vms), max_rows):
+            requirements = np.concatenate([build_requirements(vms, policies[i]) for i in batch])
+            costs = np.tile(current_costs, len(batch))
+            selection = region_index.select_cheapest_fit(requirements, costs, np.tile(current_memory_gb, len(batch)))
+            new_costs = region_index.candidates.costs[selection.index]
+            resizable = (new_costs <= costs) & (names[selection.index] != np.tile(vm_sizes, len(batch)))
+            savings = np.where(resizable, costs - new_costs, 0.0)
+            totals[batch, 0] += len(vms)
+            totals[batch, 1] += resizable.reshape(len(batch), -1).sum(axis=1)
+            totals[batch, 2] += savings.reshape(len(batch), -1).sum(axis=1)
+
+    if advisor_recommendations:
+        advisor_skus = np.array([advisor_recommendations.get(x) for x in features.resource_id.to_numpy(dtype=object)], dtype=object)
+        mask = features.complete.to_numpy() & (advisor_skus != None)
+        advised = features[mask]
+        capabilities = sku_index.default.capabilities_of(advisor_skus[mask])
+        for i, policy in enumerate(policies):
+            totals[i, 3] = len(advised)
+            totals[i, 4] = (capabilities > build_requirements(advised, policy)).all(axis=1).sum()
+
+    table = DataFrame(policies, columns=FitnessPolicy._fields)
+    for j, column in enumerate(SWEEP_COLUMNS):
+        table[column] = totals[:, j] if column == 'annual_savings' else totals[:, j].astype(np.int64)
+    return table
+
+
+def _batches(policies: int, vms: int, max_rows: int) -> Iterable[List[int]]:
+    size = max(1, max_rows // max(1, vms))
+    for start in range(0, policies, size):
+        yield list(range(start, min(start + size, policies)))
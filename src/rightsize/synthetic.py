@@ -0,0 +1,147 @@
+"""Synthetic fleets for exercising the pipeline without Azure access."""
+from typing import Dict, List, NamedTuple, Sequence
+from pandas import DataFrame
+import datetime
+import numpy as np
+import pandas as pd
+from .pricing import PriceCatalog
+from .specifications import ComputeSpecificationsSnapshot, table_version
+
+
+PERCENTILE_COLUMNS = ['percentile_50th', 'percentile_80th', 'percentile_90th', 'percentile_95th', 'percentile_99th', 'max']
+_PERCENTILE_LEVELS = np.array([0.50, 0.80, 0.90, 0.95, 0.99, 1.0])
+
+# (family, name format, vcpu sizes, ACUs per vcpu, memory GiB per vcpu, Linux USD per vcpu hour)
+_SKU_SERIES = [
+    ('standardDSv2Family', 'Standard_DS{}_v2', [(1, 1), (2, 2), (3, 4), (4, 8), (5, 16)], 210, 3.5, 0.0730),
+    ('standardDSv3Family', 'Standard_D{}s_v3', [(2, 2), (4, 4), (8, 8), (16, 16), (32, 32), (48, 48), (64, 64)], 160, 4.0, 0.0480),
+    ('standardESv3Family', 'Standard_E{}s_v3', [(2, 2), (4, 4), (8, 8), (16, 16), (20, 20), (32, 32), (48, 48), (64, 64)], 160, 8.0, 0.0630),
+    ('standardMSFamily', 'Standard_M{}s', [(8, 8), (16, 16), (32, 32), (64, 64), (128, 128)], 160, 14.0, 0.2250),
+]
+
+
+class SyntheticFleet(NamedTuple):
+    resources: DataFrame
+    cpu_utilization: DataFrame
+    mem_utilization: DataFrame
+    disk_utilization: DataFrame
+    advisor_recommendations: Dict[str, str]
+    compute_specs: ComputeSpecificationsSnapshot
+    price_catalog: PriceCatalog
+
+
+def synthetic_compute_specs() -> ComputeSpecificationsSnapshot:
+    rows = []
+    for family, name_format, sizes, acus, memory_per_vcpu, _ in _SKU_SERIES:
+        for label, vcpus in sizes:
+            rows.append({
+                'name': name_format.format(label), 'family': family, 'parent_size': None,
+                'vcpus': vcpus, 'd_vcpus_available': vcpus, 'd_total_acus': float(vcpus * acus),
+                'memory_gb': float(vcpus * memory_per_vcpu),
+                'combined_temp_disk_and_cached_iops': float(2000 * vcpus),
+                'combined_temp_disk_and_cached_read_bytes_per_second': float(16 * 1024**2 * vcpus),
+                'uncached_disk_iops': float(1600 * vcpus),
+                'uncached_disk_bytes_per_second': float(24 * 1024**2 * vcpus),
+            })
+    table = DataFrame(rows)
+    return ComputeSpecificationsSnapshot(table, table_version(table), datetime.datetime.utcnow())
+
+
+def synthetic_price_catalog(compute_specs: ComputeSpecificationsSnapshot, regions: Sequence[str] = ('eastus2',)) -> PriceCatalog:
+    hourly = {family: price for family, _, _, _, _, price in _SKU_SERIES}
+    rows = []
+    for region_index, region in enumerate(regions):
+        for sku in compute_specs.virtual_machine_skus:
+            bill_sku = sku.name.replace('s_', '_').replace('_DS', '_D')
+            price = round(hourly[sku.family] * sku.capabilities.vcpus * (1 + 0.05 * region_index), 4)
+            rows.append((bill_sku, region, 'Linux', 'Consumption', price, '1 Hour'))
+            rows.append((bill_sku, region, 'Windows', 'Consumption', round(price + 0.046 * sku.capabilities.vcpus, 4), '1 Hour'))
+    prices = DataFrame(rows, columns=['armSkuName', 'armRegionName', 'os', 'type', 'unitPrice', 'unitOfMeasure']).drop_duplicates(subset=['armSkuName', 'armRegionName', 'os', 'type'])
+    return PriceCatalog(prices.reset_index(drop=True), 'synthetic', regions[0])
+
+
+def generate_fleet(vm_count: int, seed: int = 0, subscription_count: int = 8, regions: Sequence[str] = ('eastus2',),
+    database_fraction: float = 0.2, advisor_fraction: float = 0.3) -> SyntheticFleet:
+    """Generate VMs with storage profiles, disk layouts and raw Log Analytics percentile results.
+
+    Utilization is drawn per VM from a lognormal load level so most VMs are oversized and a long tail runs hot.
+    """
+    rng = np.random.default_rng(seed)
+    compute_specs = synthetic_compute_specs()
+    skus = compute_specs.virtual_machine_skus
+    sku_weights = np.array([1.0 / (1 + s.capabilities.vcpus / 8) for s in skus])
+    sku_index = rng.choice(len(skus), vm_count, p=sku_weights / sku_weights.sum())
+
+    subscriptions = [f'{i:08x}-0000-4000-8000-{seed:012x}' for i in range(subscription_count)]
+    subscription_ids = rng.choice(subscriptions, vm_count)
+    resource_ids = [f'/subscriptions/{s}/resourcegroups/rg{i % 97}/providers/microsoft.compute/virtualmachines/vm{i:07d}' for i, s in enumerate(subscription_ids)]
+    is_database = rng.random(vm_count) < database_fraction
+    data_disk_counts = np.where(is_database, 3, rng.integers(1, 4, vm_count))
+    resources = DataFrame({
+        'resource_id': resource_ids,
+        'subscription_id': subscription_ids,
+        'location': rng.choice(list(regions), vm_count),
+        'vm_size': [skus[i].name for i in sku_index],
+        'role_code': np.where(is_database, 'DBS', 'APP'),
+        'storage_profile': [_storage_profile(resource_id, db, n) for resource_id, db, n in zip(resource_ids, is_database, data_disk_counts)],
+    })
+
+    load = np.clip(rng.lognormal(-1.6, 0.7, vm_count), 0.01, 1.0)
+    capabilities = [skus[i].capabilities for i in sku_index]
+    cpu_utilization = _percentile_frame(rng, resource_ids, load * 100, np.full(vm_count, 100.0))
+    total_memory_mib = np.array([c.memory_gb * 1024 for c in capabilities])
+    used_memory = _percentile_frame(rng, resource_ids, total_memory_mib * np.clip(load * 1.5, 0.05, 0.98), total_memory_mib)
+    # Log Analytics returns negated available memory.
+    mem_utilization = used_memory.assign(**{c: used_memory[c] - total_memory_mib for c in PERCENTILE_COLUMNS})
+
+    disk_utilization = _disk_frame(rng, resources, capabilities, load, data_disk_counts)
+
+    advised = rng.random(vm_count) < advisor_fraction
+    recommendations = {}
+    for i in np.flatnonzero(advised):
+        family = [s for s in skus if s.family == skus[sku_index[i]].family]
+        smaller = [s for s in family if s.capabilities.vcpus < capabilities[i].vcpus]
+        if smaller:
+            recommendations[resource_ids[i]] = smaller[-1].name
+
+    return SyntheticFleet(resources, cpu_utilization, mem_utilization, disk_utilization, recommendations, compute_specs,
+                          synthetic_price_catalog(compute_specs, regions))
+
+
+def _storage_profile(resource_id: str, is_database: bool, data_disk_count: int) -> Dict:
+    roles = ['data', 'log', 'temp'] if is_database else ['disk'] * data_disk_count
+    return {
+        'osDisk': {'caching': 'ReadWrite', 'managedDisk': {'id': f'{resource_id}-os'}},
+        # Application and log disks are uncached, so every VM has both caching classes and its drives are deducible.
+        'dataDisks': [{'lun': i, 'caching': 'ReadOnly' if role in ('data', 'temp') else 'None',
+                       'managedDisk': {'id': f'{resource_id}-{role}{"" if is_database else i}'}} for i, role in enumerate(roles[:data_disk_count])],
+    }
+
+
+def _percentile_frame(rng, resource_ids: List[str], level: np.ndarray, ceiling: np.ndarray) -> DataFrame:
+    spread = 1 + rng.random((len(resource_ids), 1)) * 2
+    values = np.minimum(level[:, None] * (0.5 + _PERCENTILE_LEVELS[None, :] ** 4 * spread), ceiling[:, None])
+    frame = DataFrame(values, columns=PERCENTILE_COLUMNS)
+    frame.insert(0, 'resource_id', resource_ids)
+    frame['samples'] = rng.integers(8000, 8640, len(resource_ids))
+    return frame
+
+
+def _disk_frame(rng, resources: DataFrame, capabilities, load: np.ndarray, data_disk_counts: np.ndarray) -> DataFrame:
+    drive_ids = []
+    drive_names = []
+    drive_load = []
+    for i, (resource_id, role_code, count) in enumerate(zip(resources.resource_id, resources.role_code, data_disk_counts)):
+        names = ['C:', 'D:'] + (['S:', 'L:', 'T:'] if role_code == 'DBS' else ['E:', 'F:', 'G:'][:count])
+        drive_ids.extend([resource_id] * len(names))
+        drive_names.extend(names)
+        drive_load.extend([load[i] * capabilities[i].vcpus] * len(names))
+
+    drive_load = np.array(drive_load) * rng.random(len(drive_ids))
+    frames = []
+    for counter_name, per_load in (('Disk Bytes/sec', 12 * 1024**2), ('Disk Transfers/sec', 900.0)):
+        frame = _percentile_frame(rng, drive_ids, drive_load * per_load, np.full(len(drive_ids), np.inf))
+        frame.insert(1, 'instance_name', drive_names)
+        frame.insert(2, 'counter_name', counter_name)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
@@ -1,24 +1,28 @@
-from dagster import solid, resource, SolidExecutionContext, ExpectationResult, EventMetadataEntry, Output, InitResourceContext, Field, String, Permissive
+from dagster import solid, resource, SolidExecutionContext, ExpectationResult, EventMetadataEntry, Output, Materialization, InitResourceContext, Field, String, Permissive, Int, Bool, Float
 from dagster_pandas import PandasColumn, create_dagster_pandas_dataframe_type
 from pandas import DataFrame
-import pandas as pd
-from typing import Any, Optional, List, TYPE_CHECKING, NamedTuple, Callable, Dict, Set
+from typing import Any, List, TYPE_CHECKING, NamedTuple, Callable
 import dagster_pandas
+import datetime
 import functools
 from azmeta.access.monitor_logs import (
     PerformanceCounterSpec,
-    query_dataframe_by_workspace_chunk, 
     build_perf_counter_percentile_query,
     build_disk_percentile_query
 )
-from azmeta.access.utils.chunking import build_grouped_chunk_list
 from .resources import ResourcesDataFrame
-from .specifications import AzureComputeSpecifications
+from .arrow_storage import with_arrow_storage
+from .catalogs import AzureComputeSpecifications
+from .normalization import to_acus, to_used_memory, classify_disk_utilization
+from .scheduler import chunk_status_counts
+from .instrumentation import SolidProfile, instrumented
+from .sketches import SketchCounterSpec
+from .queries import AzureMonitorContext, query_utilization, run_query, run_sketch_query
 
 if TYPE_CHECKING:
     UtilizationDataFrame = Any # DataFrame # Pandas has no type info yet.
 else:
-    UtilizationDataFrame = create_dagster_pandas_dataframe_type(
+    UtilizationDataFrame = with_arrow_storage(create_dagster_pandas_dataframe_type(
         name='UtilizationDataFrame',
         columns=[
             PandasColumn.string_column('resource_id'),
@@ -30,140 +34,111 @@ else:
             PandasColumn.float_column('max'),
             PandasColumn.integer_column('samples'),
         ],
-    ) 
+    )) 
 
 
-@solid(required_resource_keys={'azure_monitor'})
+CPU_SKETCH_SPEC = SketchCounterSpec('cpu', 'Processor', ('% Processor Time',), '_Total')
+MEM_SKETCH_SPEC = SketchCounterSpec('memory', 'Memory', ('Available Mbytes',), None, 'value * -1')
+DISK_SKETCH_SPEC = SketchCounterSpec('disk', 'LogicalDisk', ('Disk Bytes/sec', 'Disk Transfers/sec'), by_instance=True)
+CPU_QUERY = functools.partial(build_perf_counter_percentile_query, spec=PerformanceCounterSpec("Processor", "% Processor Time", "_Total"))
+MEM_QUERY = functools.partial(build_perf_counter_percentile_query, spec=PerformanceCounterSpec("Memory", "Available Mbytes", None, "value * -1"))
+
+
+@solid(required_resource_keys={'azure_monitor', 'profiling'})
+@instrumented
 def query_cpu_utilization(context: SolidExecutionContext, resources: ResourcesDataFrame) -> UtilizationDataFrame:
-    builder = functools.partial(build_perf_counter_percentile_query, spec=PerformanceCounterSpec("Processor", "% Processor Time", "_Total"))
-    result = _run_query(builder, resources, context.resources.azure_monitor, context.log)
+    profile = context.resources.profiling.current(context)
+    result = yield from _with_checkpoint_status(lambda: query_utilization(CPU_QUERY, CPU_SKETCH_SPEC, resources, context.resources.azure_monitor, context.log, profile), context.resources.azure_monitor, profile)
     yield _expect_all_resources_in_result(resources, result)
     yield Output(result)
 
 
-@solid(required_resource_keys={'azure_monitor'})
+@solid(required_resource_keys={'azure_monitor', 'profiling'})
+@instrumented
 def query_mem_utilization(context: SolidExecutionContext, resources: ResourcesDataFrame) -> UtilizationDataFrame:
-    builder = functools.partial(build_perf_counter_percentile_query, spec=PerformanceCounterSpec("Memory", "Available Mbytes", None, "value * -1"))
-    result = _run_query(builder, resources, context.resources.azure_monitor, context.log)
+    profile = context.resources.profiling.current(context)
+    result = yield from _with_checkpoint_status(lambda: query_utilization(MEM_QUERY, MEM_SKETCH_SPEC, resources, context.resources.azure_monitor, context.log, profile), context.resources.azure_monitor, profile)
     yield _expect_all_resources_in_result(resources, result)
     yield Output(result)
 
 
-@solid(required_resource_keys={'azure_monitor'})
+@solid(required_resource_keys={'azure_monitor', 'profiling'})
+@instrumented
 def query_disk_utilization(context: SolidExecutionContext, resources: ResourcesDataFrame) -> UtilizationDataFrame:
-    result = _run_query(build_disk_percentile_query, resources, context.resources.azure_monitor, context.log)
+    profile = context.resources.profiling.current(context)
+    result = yield from _with_checkpoint_status(lambda: query_utilization(build_disk_percentile_query, DISK_SKETCH_SPEC, resources, context.resources.azure_monitor, context.log, profile), context.resources.azure_monitor, profile)
     yield _expect_all_resources_in_result(resources, result)
     yield Output(result)
 
 
-@solid
-def normalize_cpu_utilization(context: SolidExecutionContext, utilization: UtilizationDataFrame, compute_specs: AzureComputeSpecifications, resources: ResourcesDataFrame) -> UtilizationDataFrame:
-    resources = resources.set_index('resource_id')
+@solid(required_resource_keys={'azure_monitor', 'profiling'})
+@instrumented
+def stream_cpu_utilization(context: SolidExecutionContext, resources: ResourcesDataFrame, compute_specs: AzureComputeSpecifications) -> UtilizationDataFrame:
+    profile = context.resources.profiling.current(context)
+    result = yield from _with_checkpoint_status(lambda: _stream_utilization(CPU_QUERY, CPU_SKETCH_SPEC, resources, lambda x, r: to_acus(x, compute_specs, r), context, profile), context.resources.azure_monitor, profile)
+    yield _expect_all_resources_in_result(resources, result)
+    yield Output(result)
 
-    def to_acus(row):
-        vm_sku_name = resources.loc[row['resource_id']].vm_size
-        vm_sku = compute_specs.virtual_machine_by_name(vm_sku_name)
-        acus = vm_sku.capabilities.d_total_acus
-        row.update(row['percentile_50th':'max'] / 100 * acus)
-        return row
 
-    utilization = utilization.apply(to_acus, axis=1)
+@solid(required_resource_keys={'azure_monitor', 'profiling'})
+@instrumented
+def stream_mem_utilization(context: SolidExecutionContext, resources: ResourcesDataFrame, compute_specs: AzureComputeSpecifications) -> UtilizationDataFrame:
+    profile = context.resources.profiling.current(context)
+    result = yield from _with_checkpoint_status(lambda: _stream_utilization(MEM_QUERY, MEM_SKETCH_SPEC, resources, lambda x, r: to_used_memory(x, compute_specs, r), context, profile), context.resources.azure_monitor, profile)
+    yield _expect_all_resources_in_result(resources, result)
+    yield Output(result)
 
-    yield Output(utilization)
 
+@solid(required_resource_keys={'azure_monitor', 'profiling'})
+@instrumented
+def stream_disk_utilization(context: SolidExecutionContext, resources: ResourcesDataFrame) -> UtilizationDataFrame:
+    profile = context.resources.profiling.current(context)
+    result = yield from _with_checkpoint_status(lambda: _stream_utilization(build_disk_percentile_query, DISK_SKETCH_SPEC, resources, lambda x, r: classify_disk_utilization(x, r, context.log), context, profile), context.resources.azure_monitor, profile)
+    # Chunks are summed separately, restore the order summing all rows at once gives.
+    result = result.sort_values(['resource_id', 'cached', 'counter_name'], kind='mergesort', ignore_index=True)
+    yield _expect_all_resources_in_result(resources, result)
+    yield Output(result)
 
-@solid
-def normalize_mem_utilization(context: SolidExecutionContext, utilization: UtilizationDataFrame, compute_specs: AzureComputeSpecifications, resources: ResourcesDataFrame) -> UtilizationDataFrame:
-    resources = resources.set_index('resource_id')
 
-    def to_used(row):
-        vm_sku_name = resources.loc[row['resource_id']].vm_size
-        vm_sku = compute_specs.virtual_machine_by_name(vm_sku_name)
-        total_memory_mib = vm_sku.capabilities.memory_gb * 1024
-        row.update(total_memory_mib + row['percentile_50th':'max'])
-        return row
+@solid(required_resource_keys={'profiling'})
+@instrumented
+def normalize_cpu_utilization(context: SolidExecutionContext, utilization: UtilizationDataFrame, compute_specs: AzureComputeSpecifications, resources: ResourcesDataFrame) -> UtilizationDataFrame:
+    yield Output(to_acus(utilization, compute_specs, resources))
 
-    utilization = utilization.apply(to_used, axis=1)
 
-    yield Output(utilization)
+@solid(required_resource_keys={'profiling'})
+@instrumented
+def normalize_mem_utilization(context: SolidExecutionContext, utilization: UtilizationDataFrame, compute_specs: AzureComputeSpecifications, resources: ResourcesDataFrame) -> UtilizationDataFrame:
+    yield Output(to_used_memory(utilization, compute_specs, resources))
 
 
-@solid
+@solid(required_resource_keys={'profiling'})
+@instrumented
 def normalize_disk_utilization(context: SolidExecutionContext, utilization: UtilizationDataFrame, compute_specs: AzureComputeSpecifications, resources: ResourcesDataFrame) -> UtilizationDataFrame:
-    resources = resources.set_index('resource_id')
-    utilization = utilization.set_index('resource_id').sort_index()
-
-    clean_name = lambda name:name.rstrip(':').upper()
-    resource_frames = []
-    utilization_resources = utilization.groupby(['resource_id'])
-    for resource_id, data in utilization_resources:
-        all_names = {clean_name(x) for x in data.instance_name.unique()}
-        storage_profile = resources.loc[resource_id].storage_profile
-        mapping_cache = {x: _disk_is_cached(x, storage_profile, all_names) for x in all_names}
-        unmapped = [k for k,v in mapping_cache.items() if v is None]
-        if unmapped:
-            context.log.warning(f'Failed to deduce cache config for {",".join(unmapped)} on {resource_id}')
-            for k in unmapped:
-                mapping_cache[k] = True
-        data = data.assign(cached=data.apply(lambda x:mapping_cache[clean_name(x.instance_name)], axis=1))
-        data = data.groupby(['cached', 'counter_name']).sum().reset_index().assign(resource_id=resource_id)
-        resource_frames.append(data)
-
-    unioned = pd.concat(resource_frames, ignore_index=True)
-    yield Output(unioned)
-
-
-def _disk_is_cached(name: str, storage_profile: Dict, all_names: Set[str]) -> Optional[bool]:
-    if name == 'D':
-        return True
-
-    if name == 'C':
-        return _caching_on(storage_profile['osDisk']['caching'])
-
-    if len(all_names) == 3 and len(storage_profile['dataDisks']) == 1:
-        return _caching_on(storage_profile['dataDisks'][0]['caching'])
-    
-    if 'S' in all_names and 'L' in all_names and name in ('S', 'L'):
-        suffix = 'data' if name == 'S' else 'log'
-        caching = list(x['caching'] for x in storage_profile['dataDisks'] if x['managedDisk']['id'].endswith(suffix))
-        if caching:
-            return _caching_on(caching[0])
-
-    if name == 'T':
-        caching = list(x['caching'] for x in storage_profile['dataDisks'] if x['managedDisk']['id'].endswith('temp'))
-        if caching:
-            return _caching_on(caching[0])
-
-    cache_settings = set(_caching_on(x['caching']) for x in storage_profile['dataDisks'])
-    if len(cache_settings) == 1:
-        return next(iter(cache_settings))
-
-    return None
-
-
-def _caching_on(value: str) -> bool:
-    return value.lower() in ('readonly', 'readwrite')
-
-
-class AzureMonitorContext(object):
-    def __init__(self, lookback_duration: str, workspace_map: dict):
-        self.lookback_duration = lookback_duration
-        self._workspace_map = workspace_map
-    
-    def map_to_workspace(self, subscription_id: str) -> str:
-        return self._workspace_map[subscription_id]
+    yield Output(classify_disk_utilization(utilization, resources, context.log))
 
 
 @resource(config_schema={
     'lookback_duration': Field(String, default_value='P30D', is_required=False),
     'workspace_map': Field(Permissive(), is_required=False),
-    'workspace': Field(String, is_required=False)
+    'workspace': Field(String, is_required=False),
+    'max_concurrency': Field(Int, default_value=8, is_required=False, description='The most chunk queries to run at once.'),
+    'chunk_size': Field(Int, default_value=32, is_required=False, description='The resources per chunk query, or the starting size with adaptive chunking.'),
+    'adaptive_chunking': Field(Bool, default_value=True, is_required=False, description='Resize chunks from observed response size and latency.'),
+    'sketch_store': Field(String, is_required=False, description='A directory of daily quantile sketches. When set only days missing from it are queried, and days before the lookback are deleted.'),
+    'sketch_accuracy': Field(Float, default_value=0.01, is_required=False, description='The relative error bound of sketched percentiles.'),
+    'sketch_ingestion_delay_hours': Field(Float, default_value=6.0, is_required=False, description='Hours after a day ends before its sketches are final and not queried again.'),
+    'checkpoint_dir': Field(String, is_required=False, description='Save each chunk result here, so a re-executed query only fetches the chunks it is missing.'),
 })
 def default_azure_monitor_context(context: InitResourceContext):
     if 'workspace_map' not in context.resource_config and 'workspace' not in context.resource_config:
         raise Exception('omg') # TODO add logic
 
-    return AzureMonitorContext(context.resource_config['lookback_duration'], context.resource_config['workspace_map'])
+    config = context.resource_config
+    return AzureMonitorContext(config['lookback_duration'], config['workspace_map'], 
+        config['max_concurrency'], config['chunk_size'], config['adaptive_chunking'], 
+        sketch_store=config.get('sketch_store'), sketch_accuracy=config['sketch_accuracy'], checkpoint_dir=config.get('checkpoint_dir'),
+        sketch_ingestion_delay=datetime.timedelta(hours=config['sketch_ingestion_delay_hours']))
 
 
 def _expect_all_resources_in_result(resources: ResourcesDataFrame, result: UtilizationDataFrame) -> ExpectationResult:
@@ -183,7 +158,39 @@ def _expect_all_resources_in_result(resources: ResourcesDataFrame, result: Utili
         metadata_entries=entries)
 
 
-def _run_query(builder: Callable, resources: ResourcesDataFrame, context: AzureMonitorContext, logger) -> DataFrame:
-    chunk_list = build_grouped_chunk_list(resources.itertuples(), lambda x:x.resource_id, lambda x:context.map_to_workspace(x.subscription_id), chunk_size=32)
-    result = query_dataframe_by_workspace_chunk(chunk_list, builder, timespan=context.lookback_duration, logger=logger)
-    return result.primary_result
+def _stream_utilization(builder: Callable, sketch_spec: SketchCounterSpec, resources: ResourcesDataFrame, 
+    normalize: Callable[[DataFrame, DataFrame], DataFrame], context: SolidExecutionContext, profile: SolidProfile) -> DataFrame:
+    """Query utilization and normalize each chunk's result, given the chunk's resources, as it arrives.
+
+    Only normalized rows are kept, and normalizing overlaps with the chunks still being queried. Sketched
+    utilization is merged across days before it is normalized.
+    """
+    monitor: AzureMonitorContext = context.resources.azure_monitor
+    if monitor.sketch_store:
+        return normalize(run_sketch_query(sketch_spec, resources, monitor, context.log, profile), resources)
+    transform = lambda frame, rows: normalize(frame, resources.loc[[r.Index for r in rows]])
+    return run_query(builder, resources, monitor, context.log, profile, transform)
+
+
+def _with_checkpoint_status(query: Callable[[], DataFrame], context: AzureMonitorContext, profile: SolidProfile):
+    """Run the query and yield the checkpoint status, also when the query fails. Returns the query result."""
+    try:
+        result = query()
+    except Exception:
+        yield from _checkpoint_status(context, profile)
+        raise
+    yield from _checkpoint_status(context, profile)
+    return result
+
+
+def _checkpoint_status(context: AzureMonitorContext, profile: SolidProfile):
+    if not context.checkpoint_dir:
+        return
+    yield Materialization(
+        label='query_checkpoint',
+        description='The Log Analytics chunks queried, and restored from the checkpoints of earlier runs.',
+        metadata_entries=[
+            EventMetadataEntry.path(context.checkpoint_dir, 'checkpoint_dir'),
+            EventMetadataEntry.json(chunk_status_counts(profile.chunks), 'Chunk Status'),
+            EventMetadataEntry.json({'chunks': [[c.workspace, c.resources, c.rows, c.status] for c in profile.chunks]}, 'Chunks'),
+        ])
@@ -0,0 +1,29 @@
+from typing import NamedTuple
+from pandas import DataFrame
+import logging
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from rightsize.engine import normalize_utilization, vm_features, regional_sku_index
+from rightsize.fitness import RegionalSkuIndex
+from rightsize.synthetic import generate_fleet, SyntheticFleet
+
+
+class AnalysisInputs(NamedTuple):
+    fleet: SyntheticFleet
+    features: DataFrame
+    sku_index: RegionalSkuIndex
+
+
+@pytest.fixture(scope='session')
+def analysis_inputs() -> AnalysisInputs:
+    """A synthetic fleet over three regions, its VM features and its SKU index, as the engine takes them."""
+    logger = logging.getLogger(__name__)
+    fleet = generate_fleet(400, seed=11, subscription_count=6, regions=('westus2', 'eastus', 'northeurope'))
+    cpu, mem, disk = normalize_utilization(fleet.cpu_utilization, fleet.mem_utilization, fleet.disk_utilization,
+                                           fleet.compute_specs, fleet.resources, logger)
+    features = vm_features(cpu, mem, disk, fleet.resources)
+    return AnalysisInputs(fleet, features, regional_sku_index(fleet.compute_specs, fleet.price_catalog, fleet.resources, logger))
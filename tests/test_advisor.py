@@ -0,0 +1,86 @@
+import datetime
+import pytest
+from rightsize.advisor import fetch_resize_recommendations, load_recommendations, recommendation_delta, RecommendationStore
+from rightsize.engine import validate_advised
+from rightsize.stubs import StubAdvisor
+from rightsize.synthetic import generate_fleet
+
+
+LATER = datetime.datetime(2020, 7, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture(scope='module')
+def fleet():
+    return generate_fleet(300, seed=11, subscription_count=6)
+
+
+def subscriptions(fleet):
+    return sorted(fleet.resources.subscription_id.unique())
+
+
+def test_fetch_keeps_compact_columns(fleet):
+    stub = StubAdvisor(fleet.advisor_recommendations)
+    table = fetch_resize_recommendations(subscriptions(fleet), stub.load_resize_recommendations, max_concurrency=3)
+
+    assert table.columns.tolist() == ['resource_id', 'target_sku', 'last_updated']
+    assert dict(zip(table.resource_id, table.target_sku)) == fleet.advisor_recommendations
+    assert (table.last_updated == stub.updated).all()
+    # One request per subscription.
+    assert sorted(s for r in stub.requests for s in r) == subscriptions(fleet)
+
+
+def test_throttled_subscription_is_retried(fleet):
+    stub = StubAdvisor(fleet.advisor_recommendations, throttle=lambda request: request in (1, 2))
+    delays = []
+    table = fetch_resize_recommendations(subscriptions(fleet), stub.load_resize_recommendations, max_concurrency=1, sleep=delays.append)
+
+    assert dict(zip(table.resource_id, table.target_sku)) == fleet.advisor_recommendations
+    assert len(stub.requests) == len(subscriptions(fleet)) + 2
+    assert len(delays) == 2
+
+
+def test_delta_counts(fleet, tmp_path):
+    recommendations = dict(fleet.advisor_recommendations)
+    stub = StubAdvisor(recommendations)
+    mapping, delta = load_recommendations(subscriptions(fleet), stub.load_resize_recommendations, store_dir=str(tmp_path))
+    assert mapping == recommendations
+    assert delta == {'added': len(recommendations), 'changed': 0, 'unchanged': 0, 'removed': 0}
+
+    ids = sorted(recommendations)
+    stub.last_updated[ids[0]] = LATER
+    recommendations[ids[1]] = 'Standard_D2s_v3'
+    del recommendations[ids[2]]
+    recommendations['/subscriptions/new/resourcegroups/rg/providers/microsoft.compute/virtualmachines/vm'] = 'Standard_D2s_v3'
+    mapping, delta = load_recommendations(subscriptions(fleet) + ['new'], stub.load_resize_recommendations, store_dir=str(tmp_path))
+
+    assert mapping == recommendations
+    assert delta == {'added': 1, 'changed': 2, 'unchanged': len(recommendations) - 3, 'removed': 1}
+    stored = RecommendationStore(str(tmp_path)).read()
+    assert dict(zip(stored.resource_id, stored.target_sku)) == recommendations
+
+
+def test_delta_against_empty_store(tmp_path):
+    stub = StubAdvisor({'/subscriptions/a/vm': 'Standard_D2s_v3'})
+    current = fetch_resize_recommendations(['a'], stub.load_resize_recommendations)
+
+    assert recommendation_delta(RecommendationStore(str(tmp_path)).read(), current) == {'added': 1, 'changed': 0, 'unchanged': 0, 'removed': 0}
+    assert recommendation_delta(current, current.iloc[:0]) == {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 1}
+
+
+def test_validations_of_unchanged_recommendations_are_reused(analysis_inputs, tmp_path):
+    fleet, features, index = analysis_inputs
+    stub = StubAdvisor(dict(fleet.advisor_recommendations))
+    store = str(tmp_path / 'fingerprints')
+
+    recommendations, _ = load_recommendations(subscriptions(fleet), stub.load_resize_recommendations, store_dir=str(tmp_path))
+    first, hits = validate_advised(features, index, recommendations, store)
+    assert hits == 0 and first
+
+    changed = next(k for k in sorted(first) if recommendations[k] != 'Standard_D64s_v3')
+    stub.recommendations[changed] = 'Standard_D64s_v3'
+    recommendations, delta = load_recommendations(subscriptions(fleet), stub.load_resize_recommendations, store_dir=str(tmp_path))
+    second, hits = validate_advised(features, index, recommendations, store)
+
+    assert delta['changed'] == 1
+    assert hits == len(first) - 1
+    assert second[changed].advisor_sku == 'Standard_D64s_v3'
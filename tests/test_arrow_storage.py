@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from rightsize.arrow_storage import write_frame, read_frame
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'resource_id': ['vm-a', 'vm-b', 'vm-a', None],
+        'max': [1.5, 2.5, np.nan, 4.0],
+        'samples': np.arange(4, dtype='int64'),
+        'percentile_50th': [0.5, 1.0, 1.5, 2.0],
+        'complete': [True, False, True, True],
+        'updated': pd.to_datetime(['2020-06-01', '2020-06-02', None, '2020-06-04'], utc=True),
+        'storage_profile': [{'osDisk': {'caching': 'ReadWrite'}}, None, [1, 2], {'dataDisks': []}],
+    })
+
+
+def test_round_trip(frame, tmp_path):
+    path = str(tmp_path / 'frame.arrow')
+    write_frame(frame, path)
+
+    for writable in (False, True):
+        back = read_frame(path, writable=writable)
+        assert list(back.columns) == list(frame.columns)
+        assert back.resource_id.tolist() == frame.resource_id.tolist()
+        assert back.storage_profile.tolist() == frame.storage_profile.tolist()
+        pd.testing.assert_frame_equal(back.drop(columns=['resource_id', 'storage_profile']), frame.drop(columns=['resource_id', 'storage_profile']))
+
+
+def test_empty_round_trip(frame, tmp_path):
+    path = str(tmp_path / 'empty.arrow')
+    write_frame(frame[['max', 'samples']].iloc[:0], path)
+
+    back = read_frame(path)
+    assert back.empty
+    assert list(back.dtypes) == [np.dtype('float64'), np.dtype('int64')]
+
+
+def test_strings_are_dictionary_encoded(frame, tmp_path):
+    path = str(tmp_path / 'frame.arrow')
+    write_frame(frame, path)
+
+    schema = pa.ipc.open_file(pa.memory_map(path, 'r')).schema
+    assert pa.types.is_dictionary(schema.field('resource_id').type)
+    assert pa.types.is_dictionary(schema.field('storage_profile').type)
+
+
+def test_mapped_columns_are_read_only(frame, tmp_path):
+    path = str(tmp_path / 'frame.arrow')
+    write_frame(frame, path)
+
+    back = read_frame(path)
+    assert not back.percentile_50th.to_numpy().flags.writeable
+    with pytest.raises(ValueError, match='read-only'):
+        back.percentile_50th.to_numpy()[0] = 1.0
+
+
+def test_writable_frames_can_be_modified_in_place(frame, tmp_path):
+    path = str(tmp_path / 'frame.arrow')
+    write_frame(frame, path)
+
+    back = read_frame(path, writable=True)
+    back.loc[0, 'percentile_50th'] = 9.0
+    back.loc[1, 'samples'] = 9
+    back.loc[2, 'resource_id'] = 'vm-c'
+    assert back.percentile_50th.tolist() == [9.0, 1.0, 1.5, 2.0]
+    assert back.samples.tolist() == [0, 9, 2, 3]
+
+    # The file is not modified.
+    pd.testing.assert_frame_equal(read_frame(path).drop(columns=['storage_profile']), read_frame(path, writable=True).drop(columns=['storage_profile']))
+    assert read_frame(path).percentile_50th[0] == 0.5
+    assert read_frame(path).resource_id[2] == 'vm-a'
@@ -0,0 +1,63 @@
+import datetime
+import os
+import time
+import pandas as pd
+import pytest
+from rightsize.checkpoints import ChunkCheckpoint, expire_checkpoints, lookback_age
+from rightsize.scheduler import QueryScheduler
+from rightsize.stubs import StubLogAnalytics
+from .test_scheduler import make_resources, make_results
+
+
+class FailingLogAnalytics(StubLogAnalytics):
+    def __init__(self, results, fail_after: int):
+        super().__init__(results)
+        self.fail_after = fail_after
+
+    def execute(self, workspace, rows, builder, timespan):
+        if len(self.calls) >= self.fail_after:
+            raise RuntimeError('Query failed.')
+        return super().execute(workspace, rows, builder, timespan)
+
+
+def test_resume_after_failure(tmp_path):
+    resources = make_resources(workspaces=2, per_workspace=8)
+    results = make_results(resources)
+    checkpoint = ChunkCheckpoint(str(tmp_path / 'query'))
+    failing = FailingLogAnalytics(results, fail_after=3)
+    scheduler = QueryScheduler(failing.execute, chunk_size=2, max_concurrency=1, adaptive=False)
+    with pytest.raises(RuntimeError):
+        scheduler.run(resources, lambda row: row.workspace, None, 'P7D', checkpoint=checkpoint)
+    assert [s.status for s in scheduler.stats] == ['queried'] * 3 + ['failed']
+
+    stub = StubLogAnalytics(results)
+    scheduler = QueryScheduler(stub.execute, chunk_size=2, max_concurrency=1, adaptive=False)
+    result = scheduler.run(resources, lambda row: row.workspace, None, 'P7D', checkpoint=checkpoint)
+
+    assert sum(c['resources'] for c in stub.calls) == len(resources) - 6
+    assert [s.status for s in scheduler.stats].count('restored') == 3
+    key = lambda x: x.sort_values(['resource_id', 'counter']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(key(result), key(results), check_dtype=False)
+
+
+def test_lookback_age():
+    assert lookback_age('P30D') == datetime.timedelta(days=30)
+    assert lookback_age('PT12H') == datetime.timedelta(hours=12)
+    assert lookback_age('P1DT2H30M') == datetime.timedelta(days=1, hours=2, minutes=30)
+    assert lookback_age('P') is None
+    assert lookback_age('2020-06-01T00:00:00Z/2020-06-08T00:00:00Z') is None
+
+
+def test_expire_checkpoints(tmp_path):
+    frame = pd.DataFrame({'resource_id': ['a'], 'value': [1.0]})
+    old, recent = ChunkCheckpoint(str(tmp_path / 'old')), ChunkCheckpoint(str(tmp_path / 'recent'))
+    old.save('ws', ['a'], frame)
+    recent.save('ws', ['a'], frame)
+    two_days_ago = time.time() - 2 * 86400
+    for path in [old.directory] + [os.path.join(old.directory, f) for f in os.listdir(old.directory)]:
+        os.utime(path, (two_days_ago, two_days_ago))
+
+    assert expire_checkpoints(str(tmp_path), datetime.timedelta(days=1)) == 1
+    assert sorted(os.listdir(tmp_path)) == ['recent']
+    assert len(recent.restore(['a'])) == 1
+    assert expire_checkpoints(str(tmp_path / 'missing'), datetime.timedelta(days=1)) == 0
@@ -0,0 +1,14 @@
+import logging
+import pytest
+from rightsize.engine import right_size, right_size_sharded
+
+
+@pytest.mark.parametrize('processes, shard_by', [(1, 'hash'), (2, 'hash'), (3, 'subscription')])
+def test_sharded_matches_serial(analysis_inputs, processes, shard_by):
+    _, features, index = analysis_inputs
+    logger = logging.getLogger(__name__)
+    serial = right_size(features, index, logger)
+
+    sharded = right_size_sharded(features, index, logger, processes, shard_by)
+    assert len(serial) > 0
+    assert sharded == serial
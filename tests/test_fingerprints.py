@@ -0,0 +1,48 @@
+import logging
+from rightsize import engine
+from rightsize.engine import right_size_fleet, validate_advised
+from rightsize.fingerprints import FingerprintStore
+from rightsize.fitness import DEFAULT_POLICY, rules_version
+
+
+def test_unchanged_vms_are_reused(analysis_inputs, tmp_path):
+    _, features, index = analysis_inputs
+    logger = logging.getLogger(__name__)
+    first, hits = right_size_fleet(features, index, logger, fingerprint_store=str(tmp_path))
+    assert hits == 0
+
+    second, hits = right_size_fleet(features, index, logger, fingerprint_store=str(tmp_path))
+    assert hits == len(first)
+    assert second == first
+
+
+def test_rules_version_invalidates_stored_analyses(analysis_inputs, tmp_path, monkeypatch):
+    _, features, index = analysis_inputs
+    logger = logging.getLogger(__name__)
+    right_size_fleet(features, index, logger, fingerprint_store=str(tmp_path))
+
+    monkeypatch.setattr(engine, 'rules_version', lambda: rules_version(DEFAULT_POLICY._replace(cpu_p99=0.8)))
+    _, hits = right_size_fleet(features, index, logger, fingerprint_store=str(tmp_path))
+    assert hits == 0
+
+
+def test_rules_version_identifies_policy():
+    assert rules_version() == rules_version(DEFAULT_POLICY)
+    assert rules_version(DEFAULT_POLICY._replace(memory_p99=1.0)) != rules_version()
+
+
+def test_departed_vms_are_pruned(analysis_inputs, tmp_path):
+    fleet, features, index = analysis_inputs
+    logger = logging.getLogger(__name__)
+    right_size_fleet(features, index, logger, fingerprint_store=str(tmp_path))
+    validate_advised(features, index, fleet.advisor_recommendations, str(tmp_path))
+    store = FingerprintStore(str(tmp_path))
+    assert set(store.read('engine').resource_id) == set(features.resource_id[features.complete])
+
+    remaining = features.iloc[len(features) // 2:]
+    _, hits = right_size_fleet(remaining, index, logger, fingerprint_store=str(tmp_path))
+    validate_advised(remaining, index, fleet.advisor_recommendations, str(tmp_path))
+
+    assert hits == int(remaining.complete.sum())
+    assert set(store.read('engine').resource_id) == set(remaining.resource_id[remaining.complete])
+    assert set(store.read('advisor').resource_id) <= set(remaining.resource_id)
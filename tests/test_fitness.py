@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from rightsize.fitness import AXES, SkuIndex, first_fit, pareto_frontier
+
+
+MEMORY_SIZES = [2.0, 4.0, 8.0, 16.0]
+
+
+def dense_cheapest_fit(costs, capabilities, memory_gb, requirements, current_costs, current_memory_gb):
+    """The VM x SKU fitness matrix scan the frontier search replaced."""
+    fit = capabilities[np.newaxis, :, :] > requirements[:, np.newaxis, :]
+    cpu = fit[:, :, 0]
+    mem = fit[:, :, 1]
+    disk = fit[:, :, 2:].all(axis=2)
+    eligible = costs[np.newaxis, :] <= current_costs[:, np.newaxis]
+    mem_equity = memory_gb[np.newaxis, :] == current_memory_gb[:, np.newaxis]
+    stop = ~eligible | (cpu & disk & (mem | mem_equity))
+
+    rows = np.arange(len(requirements))
+    selected = np.where(stop.any(axis=1), stop.argmax(axis=1), len(costs) - 1)
+    evaluated = np.where(eligible[rows, selected], selected, np.maximum(selected - 1, 0))
+    return selected, cpu[rows, evaluated], mem[rows, evaluated], disk[rows, evaluated]
+
+
+def random_skus(rng, count):
+    # Coarse capability and cost grids, so ties, dominated SKUs and requirements equal to a capability are common.
+    costs = np.sort(rng.integers(1, 20, count)).astype(float) * 100
+    memory_gb = rng.choice(MEMORY_SIZES, count)
+    capabilities = np.column_stack([rng.integers(1, 6, count) * 100.0, memory_gb * 1024] +
+                                   [rng.integers(1, 5, count) * 1000.0 for _ in AXES[2:]])
+    skus = [SimpleNamespace(name=f'sku_{i}', capabilities=SimpleNamespace(
+                d_total_acus=c[0], memory_gb=m, combined_temp_disk_and_cached_read_bytes_per_second=c[2],
+                combined_temp_disk_and_cached_iops=c[3], uncached_disk_bytes_per_second=c[4], uncached_disk_iops=c[5]))
+            for i, (c, m) in enumerate(zip(capabilities, memory_gb))]
+    return costs, memory_gb, capabilities, skus
+
+
+def random_vms(rng, count, capabilities):
+    # Requirements sometimes equal a SKU capability, and sometimes exceed every SKU.
+    top = capabilities.max(axis=0)
+    requirements = np.where(rng.random((count, len(AXES))) < 0.3,
+                            capabilities[rng.integers(0, len(capabilities), count)],
+                            rng.random((count, len(AXES))) * top * 1.2)
+    current_costs = rng.integers(0, 22, count) * 100.0
+    current_memory_gb = rng.choice(MEMORY_SIZES + [3.0], count)
+    return requirements, current_costs, current_memory_gb
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_cheapest_fit_matches_dense_scan(seed):
+    rng = np.random.default_rng(seed)
+    costs, memory_gb, capabilities, skus = random_skus(rng, int(rng.integers(1, 40)))
+    requirements, current_costs, current_memory_gb = random_vms(rng, 50, capabilities)
+
+    index = SkuIndex(skus, {}, list(zip(costs, skus)))
+    selection = index.select_cheapest_fit(requirements, current_costs, current_memory_gb)
+    selected, cpu, memory, disk = dense_cheapest_fit(costs, capabilities, memory_gb, requirements, current_costs, current_memory_gb)
+
+    np.testing.assert_array_equal(selection.index, selected)
+    np.testing.assert_array_equal(selection.cpu, cpu)
+    np.testing.assert_array_equal(selection.memory, memory)
+    np.testing.assert_array_equal(selection.disk, disk)
+    assert (selection.comparisons <= len(costs) * 2).all()
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_first_fit_matches_dense_scan(seed):
+    rng = np.random.default_rng(seed)
+    costs, _, capabilities, _ = random_skus(rng, int(rng.integers(1, 40)))
+    requirements, _, _ = random_vms(rng, 50, capabilities)
+    limits = rng.integers(0, len(costs) + 1, len(requirements))
+
+    result = first_fit(pareto_frontier(capabilities, np.arange(len(costs))), requirements, limits)
+
+    fits = (capabilities[np.newaxis, :, :] > requirements[:, np.newaxis, :]).all(axis=2)
+    fits &= np.arange(len(costs))[np.newaxis, :] < limits[:, np.newaxis]
+    np.testing.assert_array_equal(result, np.where(fits.any(axis=1), fits.argmax(axis=1), limits))
+
+
+def test_no_candidates():
+    index = SkuIndex([], {}, [])
+    with pytest.raises(ValueError):
+        index.select_cheapest_fit(np.zeros((1, len(AXES))), np.ones(1), np.ones(1))
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+import os
+import pandas as pd
+import pytest
+
+dagster = pytest.importorskip('dagster')
+from dagster import Output, Materialization
+from rightsize.instrumentation import SolidProfiler, instrumented
+
+
+def solid_context(enabled: bool = True, profile_dir: str = None) -> SimpleNamespace:
+    return SimpleNamespace(resources=SimpleNamespace(profiling=SolidProfiler(enabled, profile_dir)), solid=SimpleNamespace(name='load'), run_id='run')
+
+
+def metadata(materialization: Materialization) -> dict:
+    return {e.label: getattr(e.entry_data, 'data', getattr(e.entry_data, 'path', None)) for e in materialization.metadata_entries}
+
+
+def test_events_are_reported_as_they_happen():
+    steps = []
+
+    @instrumented
+    def load(context, frame):
+        steps.append('started')
+        yield Materialization(label='progress')
+        steps.append('resumed')
+        yield Output(frame.iloc[:1])
+
+    events = load(solid_context(), pd.DataFrame({'x': [1, 2]}))
+    assert next(events).label == 'progress'
+    assert steps == ['started']
+
+    profile, output = list(events)
+    assert steps == ['started', 'resumed']
+    assert profile.label == 'load_profile'
+    assert metadata(profile)['Row Counts'] == {'inputs': {'frame': 2}, 'outputs': {'result': 1}}
+    assert metadata(profile)['Time and Memory']['wall_seconds'] >= 0
+    assert isinstance(output, Output)
+
+
+def test_failed_solid_reports_its_events_and_profile():
+    context = solid_context()
+
+    @instrumented
+    def load(context):
+        yield Materialization(label='progress')
+        raise ValueError('query failed')
+
+    events = []
+    with pytest.raises(ValueError, match='query failed'):
+        for event in load(context):
+            events.append(event)
+    assert [e.label for e in events] == ['progress', 'load_profile']
+    assert metadata(events[1])['Row Counts'] == {'inputs': {}, 'outputs': {}}
+    assert context.resources.profiling._active == {}
+
+
+def test_profile_is_written_to_the_profile_dir(tmp_path):
+    @instrumented
+    def load(context):
+        return [1, 2, 3]
+
+    profile, output = list(load(solid_context(profile_dir=str(tmp_path))))
+    assert metadata(profile)['profile_path'] == os.path.join(str(tmp_path), 'run', 'load.prof')
+    assert os.path.exists(metadata(profile)['profile_path'])
+    assert output.value == [1, 2, 3]
+
+
+def test_disabled_instrumentation_passes_events_through():
+    @instrumented
+    def load(context):
+        return [1, 2, 3]
+
+    events = list(load(solid_context(enabled=False)))
+    assert len(events) == 1 and events[0].value == [1, 2, 3]
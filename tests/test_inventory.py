@@ -0,0 +1,48 @@
+import gzip
+import json
+import os
+from pandas import DataFrame
+import pytest
+from rightsize.engine import RightSizeAnalysis
+from rightsize.inventory import inventory_operations, write_inventory
+from rightsize.synthetic import generate_fleet
+
+
+RESOURCES = DataFrame({
+    'resource_id': ['vm-a', 'vm-b', 'vm-c'],
+    'subscription_id': ['sub-2', 'sub-1', 'sub-2'],
+    'vm_size': ['Standard_D8s_v3', 'Standard_E8s_v3', 'Standard_D4s_v3'],
+})
+
+
+def test_operations_are_the_valid_analyses_by_subscription():
+    analysis = {
+        'vm-a': RightSizeAnalysis('Standard_D4s_v3', True),
+        'vm-b': RightSizeAnalysis('Standard_E4s_v3', True),
+        'vm-c': RightSizeAnalysis('Standard_D2s_v3', False, 'CPU fitness.'),
+    }
+    operations = inventory_operations(analysis, RESOURCES)
+
+    assert operations.to_dict('records') == [
+        {'subscription_id': 'sub-1', 'resource_id': 'vm-b', 'current_sku': 'Standard_E8s_v3', 'new_sku': 'Standard_E4s_v3'},
+        {'subscription_id': 'sub-2', 'resource_id': 'vm-a', 'current_sku': 'Standard_D8s_v3', 'new_sku': 'Standard_D4s_v3'},
+    ]
+
+
+def test_operation_for_unknown_vm_fails():
+    analysis = {'vm-a': RightSizeAnalysis('Standard_D4s_v3', True), 'vm-x': RightSizeAnalysis('Standard_D2s_v3', True)}
+    with pytest.raises(KeyError, match='vm-x'):
+        inventory_operations(analysis, RESOURCES)
+
+
+def test_write_inventory_shards(tmp_path):
+    catalog = generate_fleet(10).price_catalog
+    analysis = {'vm-a': RightSizeAnalysis('Standard_D4s_v3', True), 'vm-b': RightSizeAnalysis('Standard_E4s_v3', True)}
+    manifest_path = write_inventory(analysis, RESOURCES, catalog, str(tmp_path), compress=True)
+
+    with open(manifest_path) as fd:
+        manifest = json.load(fd)
+    assert manifest['complete'] and manifest['price_catalog_version'] == catalog.version
+    assert [(s['subscription_id'], s['operations'], s['status']) for s in manifest['shards']] == [('sub-1', 1, 'complete'), ('sub-2', 1, 'complete')]
+    with gzip.open(os.path.join(str(tmp_path), manifest['shards'][1]['path']), 'rt') as fd:
+        assert [json.loads(x)['resource_id'] for x in fd] == ['vm-a']
@@ -0,0 +1,50 @@
+import logging
+import pandas as pd
+import pytest
+from rightsize.benchmark import _rowwise_to_acus, _rowwise_to_used_memory, _rowwise_classify_disk_utilization, _rowwise_validate_recommendations
+from rightsize.engine import normalize_utilization, validate_recommendations
+from rightsize.normalization import to_acus, to_used_memory, classify_disk_utilization
+
+
+@pytest.fixture(scope='module')
+def fleet(analysis_inputs):
+    return analysis_inputs.fleet
+
+
+@pytest.mark.parametrize('vectorized, rowwise, counter', [
+    (to_acus, _rowwise_to_acus, 'cpu_utilization'),
+    (to_used_memory, _rowwise_to_used_memory, 'mem_utilization'),
+])
+def test_normalization_matches_rowwise(fleet, vectorized, rowwise, counter):
+    utilization = getattr(fleet, counter)
+    expected = rowwise(utilization, fleet.compute_specs, fleet.resources)
+
+    pd.testing.assert_frame_equal(vectorized(utilization, fleet.compute_specs, fleet.resources), expected)
+
+
+def test_disk_classification_matches_rowwise(fleet, caplog):
+    logger = logging.getLogger(__name__)
+    with caplog.at_level(logging.WARNING):
+        expected = _rowwise_classify_disk_utilization(fleet.disk_utilization, fleet.resources, logger)
+        rowwise_warnings = sorted(caplog.messages)
+        caplog.clear()
+        classified = classify_disk_utilization(fleet.disk_utilization, fleet.resources, logger)
+    keys = ['resource_id', 'cached', 'counter_name']
+
+    assert sorted(caplog.messages) == rowwise_warnings
+    assert expected.cached.nunique() == 2
+    pd.testing.assert_frame_equal(classified.sort_values(keys).reset_index(drop=True),
+                                  expected[classified.columns].sort_values(keys).reset_index(drop=True))
+
+
+def test_validator_matches_rowwise(analysis_inputs):
+    fleet, features, index = analysis_inputs
+    logger = logging.getLogger(__name__)
+    cpu, mem, disk = normalize_utilization(fleet.cpu_utilization, fleet.mem_utilization, fleet.disk_utilization,
+                                           fleet.compute_specs, fleet.resources, logger)
+    expected = _rowwise_validate_recommendations(cpu, mem, disk, fleet.compute_specs, fleet.advisor_recommendations, fleet.resources)
+
+    results = validate_recommendations(features, index.default, fleet.advisor_recommendations)
+    assert len(expected) > 0
+    assert {a.advisor_sku_valid for a in expected.values()} == {True, False}
+    assert results == expected
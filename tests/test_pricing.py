@@ -0,0 +1,51 @@
+import json
+import os
+from rightsize.pricing import load_catalog
+
+
+def write_price_sheet(path, unit_price: float, mtime_ns: int) -> None:
+    records = [
+        {'serviceName': 'Virtual Machines', 'partNumber': 'P1', 'skuName': 'D2 v3', 'productName': 'Virtual Machines Dv3 Series',
+         'armSkuName': 'Standard_D2_v3', 'armRegionName': region, 'type': 'Consumption', 'unitPrice': unit_price, 'unitOfMeasure': '1 Hour'}
+        for region in ('eastus2', 'westus2')
+    ]
+    records.append(dict(records[0], skuName='D2 v3 Low Priority', unitPrice=0.01))
+    with open(path, 'w') as fd:
+        json.dump(records, fd)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_catalog_is_reused_while_the_sheet_is_unchanged(tmp_path):
+    sheet = tmp_path / 'prices.json'
+    write_price_sheet(sheet, 0.1, 1_000_000_000)
+    catalog = load_catalog(str(sheet), str(tmp_path / 'cache'))
+
+    assert load_catalog(str(sheet), str(tmp_path / 'cache')) is catalog
+    assert catalog.hourly_price('Standard_D2_v3', 'eastus2') == 0.1
+    assert catalog.default_region == 'eastus2'
+    assert sorted(catalog.regions) == ['eastus2', 'westus2']
+
+
+def test_replaced_sheet_is_loaded_again(tmp_path):
+    sheet = tmp_path / 'prices.json'
+    write_price_sheet(sheet, 0.1, 1_000_000_000)
+    first = load_catalog(str(sheet), str(tmp_path / 'cache'))
+
+    write_price_sheet(sheet, 0.2, 2_000_000_000)
+    second = load_catalog(str(sheet), str(tmp_path / 'cache'))
+    assert second.version != first.version
+    assert second.hourly_price('Standard_D2_v3', 'westus2') == 0.2
+    # Each version is compacted once into the cache directory.
+    assert len(os.listdir(tmp_path / 'cache')) == 2
+
+
+def test_compact_form_is_read_without_the_sheet_parser(tmp_path, monkeypatch):
+    sheet = tmp_path / 'prices.json'
+    write_price_sheet(sheet, 0.1, 1_000_000_000)
+    first = load_catalog(str(sheet), str(tmp_path / 'cache'), 'westus2')
+
+    monkeypatch.setattr('pandas.read_json', lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError('parsed the sheet')))
+    second = load_catalog(str(sheet), str(tmp_path / 'cache'), 'eastus2')
+    assert second.version == first.version
+    assert second.default_region == 'eastus2'
+    assert second.find('Standard_D2_v3', 'eastus2') == first.find('Standard_D2_v3', 'eastus2')
@@ -0,0 +1,22 @@
+import logging
+import pytest
+from rightsize.benchmark import cold_start
+from rightsize.queries import AzureMonitorContext, run_query
+from rightsize.stubs import StubLogAnalytics
+from .test_scheduler import make_resources, make_results
+
+
+def test_run_query_through_chunk_executor():
+    resources = make_resources(workspaces=3).assign(subscription_id=lambda f: f.workspace.str.replace('ws', 'sub'))
+    stub = StubLogAnalytics(make_results(resources))
+    context = AzureMonitorContext('P30D', {f'sub-{w}': f'ws-{w}' for w in range(3)}, chunk_size=4, adaptive_chunking=False, chunk_executor=stub.execute)
+    result = run_query(None, resources, context, logging.getLogger(__name__))
+
+    assert sorted(result.resource_id) == sorted(make_results(resources).resource_id)
+    assert {c['workspace'] for c in stub.calls} == {'ws-0', 'ws-1', 'ws-2'}
+    assert {c['timespan'] for c in stub.calls} == {'P30D'}
+
+
+@pytest.mark.parametrize('module', ['rightsize.queries', 'rightsize.benchmark'])
+def test_imports_without_orchestration(module):
+    assert cold_start(module).heavy_modules == []
@@ -0,0 +1,134 @@
+import datetime
+import logging
+import pandas as pd
+import pytest
+from rightsize.normalization import classify_disk_utilization
+from rightsize.resource_graph import fetch_vm_resources, load_vm_resources, compact_storage_profiles, vm_resources_query
+from rightsize.stubs import StubResourceGraph
+from rightsize.synthetic import generate_fleet
+
+
+QUERY = "Resources | project resource_id = tolower(id), subscription_id = subscriptionId, location"
+
+
+@pytest.fixture(scope='module')
+def fleet():
+    return generate_fleet(300, seed=7, subscription_count=5)
+
+
+def subscriptions(resources: pd.DataFrame):
+    return sorted(resources.subscription_id.unique())
+
+
+def by_id(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.sort_values('resource_id').reset_index(drop=True)
+
+
+def test_fetch_pages_each_batch(fleet):
+    resources = fleet.resources
+    stub = StubResourceGraph(resources)
+    result = fetch_vm_resources(subscriptions(resources), QUERY, stub.query_dataframe, batch_size=2, page_size=25)
+
+    assert by_id(result).resource_id.tolist() == by_id(resources).resource_id.tolist()
+    # Three batches, each read in pages of 25 until a short page.
+    batch_sizes = [resources.subscription_id.isin(subscriptions(resources)[i:i + 2]).sum() for i in range(0, 5, 2)]
+    assert len(stub.queries) == sum(n // 25 + 1 for n in batch_sizes)
+    assert sum("strcmp(resource_id" in q for q in stub.queries) == sum(n // 25 for n in batch_sizes)
+
+
+def test_throttled_page_is_retried(fleet):
+    resources = fleet.resources
+    stub = StubResourceGraph(resources, throttle=lambda call: call in (2, 3))
+    delays = []
+    result = fetch_vm_resources(subscriptions(resources), QUERY, stub.query_dataframe, batch_size=5, page_size=100,
+                                max_concurrency=1, backoff_seconds=0.5, sleep=delays.append)
+
+    assert len(result) == len(resources)
+    assert len(stub.queries) == len(resources) // 100 + 1 + 2
+    assert len(delays) == 2 and 0.5 <= delays[0] <= 1.0 and 1.0 <= delays[1] <= 2.0
+
+
+def test_throttling_gives_up_after_max_attempts(fleet):
+    stub = StubResourceGraph(fleet.resources, throttle=lambda call: True)
+    with pytest.raises(Exception):
+        fetch_vm_resources(subscriptions(fleet.resources), QUERY, stub.query_dataframe, max_attempts=3, sleep=lambda s: None)
+    assert len(stub.queries) == 3
+
+
+def test_snapshot_reused_while_unchanged(fleet, tmp_path):
+    resources = fleet.resources
+    stub = StubResourceGraph(resources)
+    first = load_vm_resources(subscriptions(resources), QUERY, stub.query_dataframe, batch_size=5, page_size=100, snapshot_dir=str(tmp_path))
+    queries = len(stub.queries)
+    second = load_vm_resources(subscriptions(resources), QUERY, stub.query_dataframe, batch_size=5, page_size=100, snapshot_dir=str(tmp_path))
+
+    # Only the change probe is queried.
+    assert len(stub.queries) == queries + 1
+    assert 'summarize' in stub.queries[-1]
+    assert second.astype(object).equals(first.astype(object))
+
+
+@pytest.mark.parametrize('change', ['removed', 'resized', 'disks'])
+def test_snapshot_invalidated_by_probe(fleet, tmp_path, change):
+    resources = fleet.resources.copy()
+    stub = StubResourceGraph(resources)
+    load_vm_resources(subscriptions(resources), QUERY, stub.query_dataframe, snapshot_dir=str(tmp_path))
+
+    if change == 'removed':
+        stub.resources = resources.iloc[1:]
+    elif change == 'resized':
+        stub.resources = resources.assign(vm_size=resources.vm_size.where(resources.index != 0, 'Standard_D64s_v3'))
+    else:
+        profile = dict(resources.storage_profile.iloc[0], osDisk={'caching': 'None'})
+        stub.resources = resources.assign(storage_profile=[profile] + resources.storage_profile.iloc[1:].tolist())
+    queries = len(stub.queries)
+    result = load_vm_resources(subscriptions(resources), QUERY, stub.query_dataframe, snapshot_dir=str(tmp_path))
+
+    assert len(stub.queries) > queries + 1
+    assert by_id(result).equals(by_id(compact_storage_profiles(stub.resources)))
+
+
+def test_snapshot_expires(fleet, tmp_path):
+    stub = StubResourceGraph(fleet.resources)
+    load_vm_resources(subscriptions(fleet.resources), QUERY, stub.query_dataframe, snapshot_dir=str(tmp_path))
+    queries = len(stub.queries)
+    load_vm_resources(subscriptions(fleet.resources), QUERY, stub.query_dataframe, snapshot_dir=str(tmp_path), ttl=datetime.timedelta(0))
+
+    assert len(stub.queries) > queries + 1
+
+
+def test_uncompacted_snapshot_keeps_storage_profiles(fleet, tmp_path):
+    stub = StubResourceGraph(fleet.resources)
+    load_vm_resources(subscriptions(fleet.resources), QUERY, stub.query_dataframe, compact=False, snapshot_dir=str(tmp_path))
+    snapshot = load_vm_resources(subscriptions(fleet.resources), QUERY, stub.query_dataframe, compact=False, snapshot_dir=str(tmp_path))
+
+    assert by_id(snapshot).storage_profile.tolist() == by_id(fleet.resources).storage_profile.tolist()
+
+
+def test_compact_storage_profiles_classify_the_same(fleet):
+    logger = logging.getLogger(__name__)
+    compact = compact_storage_profiles(fleet.resources)
+    columns = ['resource_id', 'cached', 'counter_name']
+
+    assert 'storage_profile' not in compact.columns
+    assert compact.disk_caching.nunique() < len(compact)
+    expected = classify_disk_utilization(fleet.disk_utilization, fleet.resources, logger).sort_values(columns).reset_index(drop=True)
+    actual = classify_disk_utilization(fleet.disk_utilization, compact, logger).sort_values(columns).reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize('custom_projections, location_projected', [
+    (None, True),
+    ('storage_profile = properties.storageProfile', True),
+    ('location = tolower(location)', False),
+    ('vm_size = properties.hardwareProfile.vmSize, location', False),
+    ('name, region = iff(location == "", "unknown", location)', True),
+    ("tags = pack('location', location)", True),
+])
+def test_location_projected_once(custom_projections, location_projected):
+    query = vm_resources_query("resourceGroup =~ 'rg'", custom_projections)
+
+    assert "| where resourceGroup =~ 'rg'" in query
+    projected = query.split('| project ', 1)[1]
+    expected = ', '.join(['resource_id = tolower(id)', 'subscription_id = subscriptionId'] + [custom_projections] * bool(custom_projections))
+    assert projected == (f'{expected}, location' if location_projected else expected)
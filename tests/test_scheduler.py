@@ -0,0 +1,284 @@
+from typing import Tuple
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pandas import DataFrame
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlparse, parse_qs
+import json
+import pandas as pd
+import pytest
+import threading
+import time
+import urllib.request
+from rightsize.scheduler import QueryScheduler, ChunkStats, ColumnarAccumulator, ThrottledError, throttle_delay
+from rightsize.stubs import StubLogAnalytics
+
+
+def make_resources(workspaces: int = 2, per_workspace: int = 8) -> DataFrame:
+    return DataFrame({
+        'resource_id': [f'vm-{w}-{i:02}' for w in range(workspaces) for i in range(per_workspace)],
+        'workspace': [f'ws-{w}' for w in range(workspaces) for _ in range(per_workspace)],
+    })
+
+
+def make_results(resources: DataFrame) -> DataFrame:
+    return DataFrame({
+        'resource_id': [r for r in resources.resource_id for _ in range(2)],
+        'counter': ['a', 'b'] * len(resources),
+        'value': range(2 * len(resources)),
+    })
+
+
+def run(stub: StubLogAnalytics, resources: DataFrame, **kwargs) -> Tuple[DataFrame, QueryScheduler]:
+    kwargs.setdefault('adaptive', False)
+    scheduler = QueryScheduler(stub.execute, **kwargs)
+    return scheduler.run(resources, lambda row: row.workspace, None, 'P7D'), scheduler
+
+
+def test_results_in_chunk_order():
+    resources = make_resources()
+    # Later chunks finish first, as the first chunk of each workspace is the largest.
+    stub = StubLogAnalytics(make_results(resources), per_resource_latency=0.005)
+    result, scheduler = run(stub, resources, chunk_size=3, max_concurrency=8)
+
+    # Chunks are numbered round-robin across workspaces: ws-0 [0:3], ws-1 [0:3], ws-0 [3:6], ...
+    expected = []
+    for start in range(0, 8, 3):
+        for workspace in range(2):
+            expected.extend(f'vm-{workspace}-{i:02}' for i in range(start, min(start + 3, 8)) for _ in range(2))
+    assert result.resource_id.tolist() == expected
+    assert len(scheduler.stats) == 6
+
+
+def test_round_robin_across_workspaces():
+    resources = make_resources(workspaces=3)
+    stub = StubLogAnalytics(make_results(resources), latency=0.01)
+    run(stub, resources, chunk_size=4, max_concurrency=3)
+
+    assert {c['workspace'] for c in stub.calls[:3]} == {'ws-0', 'ws-1', 'ws-2'}
+
+
+def test_stats():
+    resources = make_resources(workspaces=1, per_workspace=5)
+    stub = StubLogAnalytics(make_results(resources))
+    _, scheduler = run(stub, resources, chunk_size=2)
+
+    assert sorted(s.resources for s in scheduler.stats) == [1, 2, 2]
+    for s in scheduler.stats:
+        assert isinstance(s, ChunkStats)
+        assert (s.workspace, s.rows, s.attempts, s.status) == ('ws-0', 2 * s.resources, 1, 'queried')
+        assert s.bytes > 0 and s.seconds >= 0
+
+
+def test_retry_after_throttle():
+    resources = make_resources(workspaces=1)
+    stub = StubLogAnalytics(make_results(resources), throttle=lambda call: call == 1, retry_after=0.05)
+    result, scheduler = run(stub, resources, chunk_size=4, min_chunk_size=1, max_concurrency=1)
+
+    assert result.equals(make_results(resources))
+    assert [c['throttled'] for c in stub.calls] == [True, False, False, False]
+    assert [s.attempts for s in scheduler.stats] == [2, 1, 1]
+    # The throttled chunk is retried whole, then the workspace takes chunks of half the size.
+    assert [c['resources'] for c in stub.calls] == [4, 4, 2, 2]
+
+
+def test_backoff_without_retry_after():
+    resources = make_resources(workspaces=1, per_workspace=4)
+    delays = []
+    stub = StubLogAnalytics(make_results(resources), throttle=lambda call: call <= 2)
+    scheduler = QueryScheduler(stub.execute, chunk_size=4, max_concurrency=1, adaptive=False, backoff_seconds=0.01, sleep=delays.append)
+    result = scheduler.run(resources, lambda row: row.workspace, None, 'P7D')
+
+    assert len(result) == 8
+    assert len(stub.calls) == 3
+    # Waits of at most backoff_seconds * 2 ** (attempt - 1) * 2.
+    assert delays and max(delays) <= 0.04
+    assert [s.attempts for s in scheduler.stats] == [3]
+
+
+def test_gives_up_after_max_attempts():
+    resources = make_resources(workspaces=1, per_workspace=2)
+    stub = StubLogAnalytics(make_results(resources), throttle=lambda call: True, retry_after=0.01)
+    scheduler = QueryScheduler(stub.execute, chunk_size=2, max_concurrency=1, adaptive=False, max_attempts=3)
+
+    with pytest.raises(ThrottledError):
+        scheduler.run(resources, lambda row: row.workspace, None, 'P7D')
+    assert len(stub.calls) == 3
+    assert [(s.status, s.attempts) for s in scheduler.stats] == [('failed', 3)]
+
+
+def test_non_throttle_errors_are_not_retried():
+    resources = make_resources(workspaces=1, per_workspace=2)
+
+    def execute(workspace, rows, builder, timespan):
+        raise ValueError('bad query')
+    scheduler = QueryScheduler(execute, chunk_size=2, max_concurrency=1)
+
+    with pytest.raises(ValueError):
+        scheduler.run(resources, lambda row: row.workspace, None, 'P7D')
+    assert [(s.status, s.attempts) for s in scheduler.stats] == [('failed', 1)]
+
+
+def test_concurrency_limit_throttles_are_retried():
+    resources = make_resources(workspaces=4, per_workspace=8)
+    stub = StubLogAnalytics(make_results(resources), latency=0.02, max_concurrent=2, retry_after=0.01)
+    result, scheduler = run(stub, resources, chunk_size=2, max_concurrency=4)
+
+    assert sorted(result.resource_id.unique()) == sorted(resources.resource_id)
+    assert len(result) == 2 * len(resources)
+    assert sum(c['throttled'] for c in stub.calls) == sum(s.attempts - 1 for s in scheduler.stats)
+    # The window settles near the service limit instead of throttling every round.
+    assert sum(c['throttled'] for c in stub.calls) < len(scheduler.stats)
+    assert scheduler.in_flight_limit < 4
+
+
+def test_in_flight_limit_halves_on_throttle_and_grows_back():
+    resources = make_resources(workspaces=1, per_workspace=120)
+    stub = StubLogAnalytics(make_results(resources), throttle=lambda call: call == 1, retry_after=0.01)
+    limits = []
+    scheduler = QueryScheduler(stub.execute, chunk_size=1, max_concurrency=8, adaptive=False)
+    original = scheduler._complete
+
+    def complete(*args):
+        original(*args)
+        limits.append(scheduler.in_flight_limit)
+    scheduler._complete = complete
+    scheduler.run(resources, lambda row: row.workspace, None, 'P7D')
+
+    throttled = limits.index(min(limits))
+    assert limits[throttled] == 4.0
+    # One more chunk per window after the throttle, until the window is back at max_concurrency.
+    after = limits[throttled:]
+    assert all(b == min(8.0, a + 1 / a) for a, b in zip(after, after[1:]))
+    assert limits[-1] == 8.0
+
+
+@pytest.fixture
+def throttling_server():
+    """A query endpoint answering the first ``throttled`` requests with the ``status`` and ``retry_after`` set on it."""
+    results = make_results(make_resources(workspaces=1))
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(time.monotonic())
+            if len(requests) <= server.throttled:
+                self.send_response(server.status)
+                self.send_header('Retry-After', server.retry_after)
+                self.end_headers()
+                return
+            ids = parse_qs(urlparse(self.path).query)['id']
+            body = json.dumps(results[results.resource_id.isin(ids)].to_dict('records')).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.throttled, server.status, server.retry_after, server.requests = 0, 429, '1', requests
+    server.url = f'http://127.0.0.1:{server.server_port}/query'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def http_execute(url):
+    def execute(workspace, rows, builder, timespan):
+        with urllib.request.urlopen(f'{url}?{urlencode([("id", r.resource_id) for r in rows])}') as response:
+            return DataFrame(json.load(response), columns=['resource_id', 'counter', 'value'])
+    return execute
+
+
+def test_http_429_is_retried_after_retry_after(throttling_server):
+    throttling_server.throttled = 1
+    resources = make_resources(workspaces=1)
+    scheduler = QueryScheduler(http_execute(throttling_server.url), chunk_size=8, max_concurrency=1, adaptive=False)
+    result = scheduler.run(resources, lambda row: row.workspace, None, 'P7D')
+
+    assert result.equals(make_results(resources))
+    assert [s.attempts for s in scheduler.stats] == [2]
+    # The retry waited for the one second the 429 asked for, not the default backoff.
+    first, retry = throttling_server.requests
+    assert 1.0 <= retry - first < 1.9
+
+
+@pytest.mark.parametrize('status, retry_after, expected', [
+    (429, '7', (7.0, 7.0)),
+    (503, None, (0.0, 0.0)),
+    (429, 'soon', (0.0, 0.0)),
+    (429, 'date', (1.0, 4.0)),
+])
+def test_throttle_delay_of_http_errors(throttling_server, status, retry_after, expected):
+    throttling_server.throttled, throttling_server.status = 1, status
+    throttling_server.retry_after = formatdate(time.time() + 4, usegmt=True) if retry_after == 'date' else (retry_after or '')
+    with pytest.raises(HTTPError) as error:
+        urllib.request.urlopen(throttling_server.url)
+
+    assert expected[0] <= throttle_delay(error.value) <= expected[1]
+
+
+def test_other_http_errors_are_not_throttles(throttling_server):
+    throttling_server.throttled, throttling_server.status = 1, 500
+    with pytest.raises(HTTPError) as error:
+        urllib.request.urlopen(throttling_server.url)
+
+    assert throttle_delay(error.value) is None
+
+
+def test_adapt_moves_halfway_toward_targets():
+    scheduler = QueryScheduler(None, target_seconds=10.0, target_rows=1000, min_chunk_size=4, max_chunk_size=256)
+
+    # 0.5s per resource: 20 resources fit the latency target.
+    assert scheduler._adapt(32, ChunkStats('ws', 10, 10, 0, 5.0, 1)) == 26
+    # 100 rows per resource: 10 resources fit the row target.
+    assert scheduler._adapt(32, ChunkStats('ws', 10, 1000, 0, 0.1, 1)) == 21
+    # Clamped to the chunk size bounds.
+    assert scheduler._adapt(4, ChunkStats('ws', 10, 100_000, 0, 100.0, 1)) == 4
+    assert scheduler._adapt(256, ChunkStats('ws', 10, 0, 0, 0.0, 1)) == 256
+
+
+def test_adaptive_chunks_grow_when_fast():
+    resources = make_resources(workspaces=1, per_workspace=200)
+    stub = StubLogAnalytics(make_results(resources))
+    result, scheduler = run(stub, resources, adaptive=True, chunk_size=8, max_concurrency=1, max_chunk_size=64)
+
+    sizes = [c['resources'] for c in stub.calls]
+    assert sizes[0] == 8 and max(sizes) > 8
+    assert len(result) == 400
+
+
+def test_accumulator_keeps_dtypes():
+    accumulator = ColumnarAccumulator()
+    accumulator.add(1, DataFrame({'name': pd.Categorical(['b', 'c']), 'count': pd.array([3, None], dtype='Int64')}))
+    accumulator.add(0, DataFrame({'name': pd.Categorical(['a']), 'count': pd.array([1], dtype='Int64')}))
+    accumulator.add(2, DataFrame({'name': pd.Categorical([]), 'count': pd.array([], dtype='Int64')}))
+    frame = accumulator.to_frame()
+
+    assert frame.name.dtype == 'category'
+    assert frame.name.tolist() == ['a', 'b', 'c']
+    assert str(frame['count'].dtype) == 'Int64'
+    assert frame['count'].tolist()[:2] == [1, 3] and frame['count'].isna().tolist() == [False, False, True]
+
+
+def test_accumulator_rejects_mismatched_chunks():
+    accumulator = ColumnarAccumulator()
+    accumulator.add(0, DataFrame({'resource_id': ['a'], 'value': [1.0]}))
+    with pytest.raises(ValueError):
+        accumulator.add(1, DataFrame({'resource_id': ['b']}))
+
+
+def test_empty_chunks_are_transformed():
+    resources = make_resources(workspaces=1, per_workspace=4)
+    stub = StubLogAnalytics(make_results(resources).iloc[:0])
+    transform = lambda frame, rows: frame.assign(doubled=frame.value * 2)
+    scheduler = QueryScheduler(stub.execute, chunk_size=2, adaptive=False)
+    result = scheduler.run(resources, lambda row: row.workspace, None, 'P7D', transform)
+
+    assert len(result) == 0
+    assert result.columns.tolist() == ['resource_id', 'counter', 'value', 'doubled']
@@ -0,0 +1,102 @@
+import datetime
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from rightsize.sketches import QUANTILES, SketchStore, gamma, lookback_days, sketch_quantiles
+
+
+TODAY = datetime.date(2020, 6, 15)
+NOON = datetime.datetime(2020, 6, 15, 12)
+
+
+def bucket_counts(samples: pd.DataFrame, relative_accuracy: float) -> pd.DataFrame:
+    """The daily bucket counts the sketch query summarizes samples of resource_id, day and value to."""
+    magnitude = samples.value.abs()
+    zero = magnitude < 1e-9
+    bucket = np.where(zero, 0, np.ceil(np.log(magnitude.where(~zero, 1)) / np.log(gamma(relative_accuracy)))).astype(int)
+    frame = samples.assign(sign=np.where(zero, 0, np.sign(samples.value)).astype(int), bucket=bucket)
+    return frame.groupby(['resource_id', 'day', 'sign', 'bucket']).agg(count=('value', 'count'), max=('value', 'max')).reset_index()
+
+
+def random_samples(rng, resources: int, days: int) -> pd.DataFrame:
+    frames = []
+    for i in range(resources):
+        n = int(rng.integers(1, 2000))
+        # Lognormal loads, negated for some resources as memory counters are, with some idle zeros.
+        values = rng.lognormal(rng.uniform(-2, 6), rng.uniform(0.1, 2), n) * (-1 if i % 3 == 0 else 1)
+        values[rng.random(n) < 0.05] = 0.0
+        frames.append(pd.DataFrame({'resource_id': f'vm-{i}', 'day': rng.integers(0, days, n), 'value': values}))
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.mark.parametrize('relative_accuracy', [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    rng = np.random.default_rng(3)
+    samples = random_samples(rng, 40, days=5)
+    result = sketch_quantiles(bucket_counts(samples, relative_accuracy), ['resource_id'], relative_accuracy).set_index('resource_id')
+
+    for resource_id, values in samples.groupby('resource_id').value:
+        values = np.sort(values.to_numpy())
+        row = result.loc[resource_id]
+        assert row['samples'] == len(values)
+        assert row['max'] == values[-1]
+        for column, q in QUANTILES:
+            # The sample of zero based rank q * (n - 1).
+            expected = values[int(np.floor(q * (len(values) - 1)))]
+            assert abs(row[column] - expected) <= relative_accuracy * abs(expected) + 1e-12, (resource_id, column)
+
+
+def test_days_merge_to_the_quantiles_of_all_samples():
+    rng = np.random.default_rng(4)
+    samples = random_samples(rng, 10, days=7)
+    by_day = sketch_quantiles(bucket_counts(samples, 0.01), ['resource_id'], 0.01)
+    one_day = sketch_quantiles(bucket_counts(samples.assign(day=0), 0.01), ['resource_id'], 0.01)
+
+    pd.testing.assert_frame_equal(by_day, one_day)
+
+
+def buckets_for(resource_ids, count: int = 1) -> pd.DataFrame:
+    return pd.DataFrame({'resource_id': list(resource_ids), 'sign': 1, 'bucket': 10, 'count': count, 'max': 1.0})
+
+
+def test_missing_shrinks_as_days_are_written(tmp_path):
+    store = SketchStore(str(tmp_path))
+    days = lookback_days('P3D', TODAY)
+
+    assert store.missing('cpu', days, ['a', 'b']) == ({'a', 'b'}, days)
+    for day in days:
+        store.write('cpu', day, buckets_for(['a', 'b']), ['a', 'b'], now=NOON)
+    assert store.missing('cpu', days, ['a', 'b']) == (set(), [])
+
+    # A new resource is only queried for, on every day.
+    assert store.missing('cpu', days, ['a', 'b', 'c']) == ({'c'}, days)
+    store.write('cpu', days[0], buckets_for(['c']), ['c'], now=NOON)
+    assert store.missing('cpu', days, ['a', 'b', 'c']) == ({'c'}, days[1:])
+    assert sorted(store.read('cpu', days, ['a', 'c']).resource_id) == ['a', 'a', 'a', 'c']
+
+
+def test_day_inside_ingestion_delay_is_queried_again(tmp_path):
+    store = SketchStore(str(tmp_path), ingestion_delay=datetime.timedelta(hours=6))
+    yesterday = TODAY - datetime.timedelta(days=1)
+
+    store.write('cpu', yesterday, buckets_for(['a']), ['a'], now=datetime.datetime(2020, 6, 15, 1))
+    assert store.missing('cpu', [yesterday], ['a']) == ({'a'}, [yesterday])
+    # Its buckets are used until then.
+    assert store.read('cpu', [yesterday], ['a'])['count'].tolist() == [1]
+
+    # The late samples replace the earlier buckets once the day is queried after the delay.
+    store.write('cpu', yesterday, buckets_for(['a'], count=3), ['a'], now=datetime.datetime(2020, 6, 15, 6))
+    assert store.missing('cpu', [yesterday], ['a']) == (set(), [])
+    assert store.read('cpu', [yesterday], ['a'])['count'].tolist() == [3]
+
+
+def test_days_before_the_retention_are_deleted(tmp_path):
+    store = SketchStore(str(tmp_path), retention_days=3)
+    days = lookback_days('P5D', TODAY)
+    for day in days:
+        store.write('cpu', day, buckets_for(['a']), ['a'], now=datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(days=1, hours=12))
+
+    assert store.missing('cpu', days, ['a']) == ({'a'}, days[:2])
+    assert sorted(os.listdir(tmp_path / 'cpu')) == sorted(f'{d.isoformat()}.{s}' for d in days[2:] for s in ('parquet', 'covered.json'))
+    assert store.prune('cpu', TODAY) == 3
@@ -0,0 +1,77 @@
+from typing import List, NamedTuple, Optional
+import datetime
+import pytest
+from rightsize.fitness import sku_capability_vector
+from rightsize.specifications import SNAPSHOT_CAPABILITIES, SpecificationsSnapshotCache, specifications_version
+
+
+class LiveCapabilities(object):
+    """Capabilities shaped like azmeta's, with derived values as properties."""
+
+    def __init__(self, vcpus: int, constrained_vcpus: Optional[int], acus_per_vcpu: int, memory_gb: float, parent_size: Optional[str]):
+        self.vcpus = vcpus
+        self.constrained_vcpus = constrained_vcpus
+        self.acus_per_vcpu = acus_per_vcpu
+        self.memory_gb = memory_gb
+        self.parent_size = parent_size
+        self.combined_temp_disk_and_cached_iops = 2000.0 * vcpus
+        self.combined_temp_disk_and_cached_read_bytes_per_second = 16.0 * 1024**2 * vcpus
+        self.uncached_disk_iops = 1600.0 * vcpus
+        self.uncached_disk_bytes_per_second = 24.0 * 1024**2 * vcpus
+
+    @property
+    def d_vcpus_available(self) -> int:
+        return self.constrained_vcpus or self.vcpus
+
+    @property
+    def d_total_acus(self) -> float:
+        return float(self.d_vcpus_available * self.acus_per_vcpu)
+
+
+class LiveSku(NamedTuple):
+    name: str
+    family: str
+    capabilities: LiveCapabilities
+
+
+class LiveSpecifications(object):
+    def __init__(self, skus: List[LiveSku]):
+        self.virtual_machine_skus = skus
+
+    def virtual_machine_by_name(self, name: str) -> LiveSku:
+        return next(s for s in self.virtual_machine_skus if s.name.lower() == name.lower())
+
+
+@pytest.fixture
+def live_specs() -> LiveSpecifications:
+    return LiveSpecifications([
+        LiveSku('Standard_D4s_v3', 'standardDSv3Family', LiveCapabilities(4, None, 160, 16.0, None)),
+        LiveSku('Standard_E8-2s_v3', 'standardESv3Family', LiveCapabilities(8, 2, 160, 64.0, 'Standard_E8s_v3')),
+        LiveSku('Standard_F2s_v2', 'standardFSv2Family', LiveCapabilities(2, None, 195, 4.0, None)),
+    ])
+
+
+def test_snapshot_round_trip(tmp_path, live_specs):
+    cache = SpecificationsSnapshotCache(str(tmp_path), 'sub', 'eastus2')
+    version = cache.write(live_specs)
+    snapshot = cache.read()
+
+    assert snapshot.version == version == specifications_version(live_specs)
+    assert [s.name for s in snapshot.virtual_machine_skus] == sorted(s.name for s in live_specs.virtual_machine_skus)
+    for live in live_specs.virtual_machine_skus:
+        restored = snapshot.virtual_machine_by_name(live.name)
+        assert restored.family == live.family
+        assert sku_capability_vector(restored) == sku_capability_vector(live)
+        for name in SNAPSHOT_CAPABILITIES:
+            assert getattr(restored.capabilities, name) == getattr(live.capabilities, name), name
+
+
+def test_load_uses_fresh_snapshot_offline(tmp_path, live_specs):
+    cache = SpecificationsSnapshotCache(str(tmp_path))
+    with pytest.raises(Exception):
+        cache.load(datetime.timedelta(hours=1), offline=True)
+    cache.write(live_specs)
+
+    snapshot = cache.load(datetime.timedelta(hours=1), offline=True)
+    assert len(snapshot.virtual_machine_skus) == 3
+    assert snapshot.virtual_machine_by_name('standard_e8-2s_v3').capabilities.d_vcpus_available == 2
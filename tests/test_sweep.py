@@ -0,0 +1,55 @@
+import logging
+import pytest
+from rightsize import engine, sweep
+from rightsize.engine import right_size, validate_advised
+from rightsize.fitness import build_requirements
+from rightsize.sweep import policy_grid, sweep_policies
+
+
+POLICIES = policy_grid(cpu_p99=[0.7, 0.9, 1.2], memory_p99=[1.0, 1.05], disk_p99=[0.9, 1.5])
+
+
+def engine_totals(analysis_inputs, policy, monkeypatch):
+    """The sweep row of a policy from running the engine and the Advisor validator with that policy."""
+    fleet, features, index = analysis_inputs
+    monkeypatch.setattr(engine, 'build_requirements', lambda features: build_requirements(features, policy))
+    analyses = right_size(features, index, logging.getLogger(__name__))
+    validations, _ = validate_advised(features, index, fleet.advisor_recommendations)
+    return {
+        'vms_evaluated': len(analyses),
+        'resizable': sum(a.advisor_sku_valid for a in analyses.values()),
+        'annual_savings': sum(a.annual_savings_no_ri or 0 for a in analyses.values()),
+        'advised': len(validations),
+        'advisor_valid': sum(a.advisor_sku_valid for a in validations.values()),
+    }
+
+
+@pytest.mark.parametrize('max_rows', [2_000_000, 500, 1])
+def test_sweep_matches_engine(analysis_inputs, monkeypatch, max_rows):
+    fleet, features, index = analysis_inputs
+    batches = []
+    split = sweep._batches
+
+    def recorded_batches(*args):
+        batches.append(list(split(*args)))
+        return batches[-1]
+
+    monkeypatch.setattr(sweep, '_batches', recorded_batches)
+    table = sweep_policies(features, index, POLICIES, logging.getLogger(__name__), fleet.advisor_recommendations, max_rows=max_rows)
+
+    assert len(table) == len(POLICIES)
+    # Every region is searched once with the default bound, and in several batches with the small ones.
+    assert all(len(b) == 1 for b in batches) == (max_rows == 2_000_000)
+    if max_rows == 1:
+        assert all(len(batch) == 1 for b in batches for batch in b)
+    monkeypatch.undo()
+    for policy, row in zip(POLICIES, table.itertuples(index=False)):
+        expected = engine_totals(analysis_inputs, policy, monkeypatch)
+        assert tuple(row)[:len(policy)] == tuple(policy)
+        assert row.vms_evaluated == expected['vms_evaluated']
+        assert row.resizable == expected['resizable']
+        assert row.annual_savings == pytest.approx(expected['annual_savings'])
+        assert row.advised == expected['advised']
+        assert row.advisor_valid == expected['advisor_valid']
+    # The grid spans policies that resize and validate differently.
+    assert table.resizable.nunique() > 1 and table.advisor_valid.nunique() > 1